@@ -1,39 +1,14 @@
 #!/bin/bash
 
-#not really the best because it was hitting limits quite fast
+# every user of the locustfile with every key distribution against the same
+# stack, see python run_benchmarks.py --help for the sweep options
 
-mkdir results
+docker-compose up -d --build
 
-docker-compose up -d
+until curl -sf http://localhost:8000/health-check/ > /dev/null; do
+  sleep 1
+done
 
-locust --host http://localhost:8000 -u 400 -r 50 -t 60 \
-  --autostart --autoquit 0 --print-stats --reset-stats --csv results/redis-entry-redis-lock.csv RedisEntryRedisLockUser
-
-docker-compose down
-
-printf "\n\n\n\n\n"
-
-docker-compose up -d
-
-locust --host http://localhost:8000 -u 400 -r 50 -t 60 \
-  --autostart --autoquit 0 --print-stats --reset-stats --csv results/django-entry-django-lock.csv DjangoEntryDjangoLockUser
-
-docker-compose down
-
-printf "\n\n\n\n\n"
-
-docker-compose up -d
-
-locust --host http://localhost:8000 -u 400 -r 50 -t 60 \
-  --autostart --autoquit 0 --print-stats --reset-stats --csv results/redis-entry-django-lock.csv RedisEntryDjangoLockUser
-
-docker-compose down
-
-printf "\n\n\n\n\n"
-
-docker-compose up -d
-
-locust --host http://localhost:8000 -u 400 -r 50 -t 60 \
-  --autostart --autoquit 0 --print-stats --reset-stats --csv results/django-entry-django-lock.csv DjangoEntryDjangoLockUser
+python run_benchmarks.py --host http://localhost:8000 "$@"
 
 docker-compose down
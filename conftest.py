@@ -1,7 +1,125 @@
+import json
+import subprocess
+
 import pytest
+from django.db import connections
 from django_redis import get_redis_connection
 
+from entry.benchmark import capture_redis_commands, find_regressions, measure
+from entry.value_cache import entry_values
+from smart_lock.metrics import registry
+
+# results of the benchmarks that ran, by name
+benchmark_results = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        help="run the micro-benchmarks, they are skipped otherwise",
+    )
+    group.addoption(
+        "--benchmark-rounds",
+        type=int,
+        default=200,
+        help="how many times every operation is timed",
+    )
+    group.addoption(
+        "--benchmark-json", metavar="PATH", help="write the results to PATH"
+    )
+    group.addoption(
+        "--benchmark-compare",
+        metavar="PATH",
+        help="fail the benchmarks that regressed since the results in PATH",
+    )
+    group.addoption(
+        "--benchmark-threshold",
+        type=float,
+        default=0.2,
+        help="how much slower than the compared results a median may be",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "benchmark: micro-benchmark, only run with --benchmark"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="micro-benchmarks need --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption("--benchmark-json")
+    if not path or not benchmark_results:
+        return
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    with open(path, "w") as file:
+        json.dump({"commit": commit, "benchmarks": benchmark_results}, file, indent=2)
+
+
+@pytest.fixture(scope="session")
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    # connections of the threads started by the tests would outlive them and
+    # keep the test database from being dropped
+    connections["default"].settings_dict["CONN_MAX_AGE"] = 0
+
 
 @pytest.fixture(autouse=True)
 def flush_cache():
     get_redis_connection("default").flushall()
+    entry_values.clear()
+    registry.reset()
+
+
+@pytest.fixture
+def redis_commands():
+    """
+    Names of the commands sent to redis during the test.
+    """
+    with capture_redis_commands() as commands:
+        yield commands
+
+
+@pytest.fixture(scope="session")
+def benchmark_baseline(pytestconfig):
+    path = pytestconfig.getoption("--benchmark-compare")
+    if not path:
+        return {}
+    with open(path) as file:
+        return json.load(file)["benchmarks"]
+
+
+@pytest.fixture
+def benchmark(request, benchmark_baseline):
+    """
+    Measures an operation, records its results under the name of the test and
+    fails the test if it regressed.
+    """
+    config = request.config
+
+    def run(operation) -> dict:
+        result = measure(operation, config.getoption("--benchmark-rounds"))
+        name = request.node.nodeid
+        benchmark_results[name] = result
+        if name in benchmark_baseline:
+            regressions = find_regressions(
+                result,
+                benchmark_baseline[name],
+                config.getoption("--benchmark-threshold"),
+            )
+            if regressions:
+                pytest.fail("; ".join(regressions))
+        return result
+
+    return run
@@ -8,6 +8,10 @@ python3 manage.py migrate
 #echo "Load data into the server"
 #python3 manage.py loaddata default_data.json
 
+# Flush write-behind increments in the background
+echo "Starting write-behind flusher"
+python3 manage.py flush_entries --interval 1 > /dev/null &
+
 # Start server
 echo "Starting server"
-python3 manage.py runserver 0.0.0.0:8000
+python3 manage.py serve --bind 0.0.0.0:8000
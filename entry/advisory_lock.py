@@ -0,0 +1,183 @@
+import hashlib
+import logging
+import time as mod_time
+import uuid
+import weakref
+
+from django.db import connection
+from redis.exceptions import LockError, LockNotOwnedError
+
+from entry.django_redlock import DjangoRedlock
+from smart_lock.metrics import count_attempt
+
+logger = logging.getLogger(__name__)
+
+# advisory locks are reentrant within a database session, so the keys held by
+# every session are tracked to keep the semantics of DjangoRedlock, where a
+# second lock on the same name can not be acquired, and to emulate timeouts
+_session_locks = weakref.WeakKeyDictionary()
+
+
+def lock_key(name: str) -> int:
+    """
+    Hashes ``name`` to the signed bigint key used by advisory locks.
+    """
+    digest = hashlib.blake2b(name.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class DjangoAdvisoryLock(DjangoRedlock):
+    """
+    Redlock implementation using PostgreSQL advisory locks, no row is written
+    to hold the lock
+    """
+
+    def __init__(self, name, *args, transaction=False, **kwargs):
+        """
+        Takes the same arguments as ``DjangoRedlock``.
+
+        Session level locks are held with ``pg_try_advisory_lock`` by the
+        database connection of the thread that acquired them and are released
+        by PostgreSQL when that connection is closed. PostgreSQL knows nothing
+        about ``timeout``, it is emulated: once it elapses the lock is no
+        longer owned, it can not be extended nor released, and it is unlocked
+        as soon as the connection holding it touches that name again. Other
+        sessions do not see the timeout, they wait until the holder unlocks
+        it or its session ends, a persistent connection of a hung holder
+        keeps it for as long as the connection lives.
+
+        ``transaction`` indicates whether to use transaction level locks
+        instead, they must be acquired inside an atomic block and are held
+        until it is committed or rolled back, ``release`` only forgets the
+        token. A blocking acquire without ``blocking_timeout`` waits inside
+        PostgreSQL with ``pg_advisory_xact_lock`` instead of polling.
+        Transaction level locks are reentrant and do not support ``timeout``,
+        ``idle_in_transaction_session_timeout`` bounds how long an idle
+        holder keeps them.
+        """
+        super().__init__(name, *args, **kwargs)
+        self.key = lock_key(name)
+        self.transaction = bool(transaction)
+        if self.transaction and self.timeout:
+            raise LockError("Transaction level locks do not support a timeout")
+        if self.auto_renew:
+            raise LockError("Advisory locks do not support auto_renew")
+
+    def acquire(self, blocking=None, blocking_timeout=None, token=None):
+        if blocking is None:
+            blocking = self.blocking
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        if self.transaction and blocking and blocking_timeout is None:
+            self.check_in_atomic_block()
+            count_attempt()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [self.key])
+            self.local.token = token or uuid.uuid4().hex
+            return True
+        return super().acquire(blocking, blocking_timeout, token)
+
+    def check_in_atomic_block(self):
+        if not connection.in_atomic_block:
+            raise LockError("Transaction level locks need an atomic block")
+
+    def session_locks(self) -> dict:
+        """
+        Returns the keys held by the current database session, mapped to
+        their token and the monotonic time at which they expire.
+        """
+        connection.ensure_connection()
+        return _session_locks.setdefault(connection.connection, {})
+
+    def expire(self, held: dict):
+        """
+        Unlocks this key if it is held by the current session past its timeout.
+        """
+        token, expires_at = held.get(self.key, (None, None))
+        if expires_at is not None and expires_at <= mod_time.monotonic():
+            logger.warning("Lock expired, unlocking it")
+            del held[self.key]
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [self.key])
+
+    def do_acquire(self, token):
+        if self.transaction:
+            self.check_in_atomic_block()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [self.key])
+                return cursor.fetchone()[0]
+
+        held = self.session_locks()
+        self.expire(held)
+        if self.key in held:
+            logger.warning("Lock is taken by this session")
+            return False
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.key])
+            acquired = cursor.fetchone()[0]
+
+        if acquired:
+            held[self.key] = (token, self.expires_at(self.timeout))
+        return acquired
+
+    @staticmethod
+    def expires_at(timeout):
+        if not timeout:
+            return None
+        return mod_time.monotonic() + timeout
+
+    def locked(self):
+        """
+        Returns True if this key is locked by any process, otherwise False.
+        """
+        if not self.transaction:
+            self.expire(self.session_locks())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS ("
+                " SELECT 1 FROM pg_locks"
+                " WHERE locktype = 'advisory' AND granted"
+                " AND classid::bigint = %s AND objid::bigint = %s AND objsubid = 1"
+                ")",
+                [(self.key >> 32) & 0xFFFFFFFF, self.key & 0xFFFFFFFF],
+            )
+            return cursor.fetchone()[0]
+
+    def owned(self):
+        """
+        Returns True if this key is locked by this lock, otherwise False.
+        """
+        if self.local.token is None:
+            return False
+        if self.transaction:
+            return True
+        held = self.session_locks()
+        self.expire(held)
+        token, expires_at = held.get(self.key, (None, None))
+        return token == self.local.token
+
+    def do_release(self, expected_token: str):
+        if self.transaction:
+            return
+        held = self.session_locks()
+        self.expire(held)
+        token, expires_at = held.get(self.key, (None, None))
+        if token != expected_token:
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+        del held[self.key]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [self.key])
+
+    def do_extend(self, additional_time, replace_ttl):
+        held = self.session_locks()
+        self.expire(held)
+        token, expires_at = held.get(self.key, (None, None))
+        if token != self.local.token:
+            raise LockNotOwnedError("Cannot extend a lock that's no longer owned")
+        if replace_ttl:
+            expires_at = self.expires_at(additional_time)
+        else:
+            expires_at += additional_time
+        held[self.key] = (token, expires_at)
+        return True
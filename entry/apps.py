@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+
+from smart_lock.utils import close_broken_connections
 
 
 class EntryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "entry"
+
+    def ready(self):
+        request_started.connect(close_broken_connections)
@@ -0,0 +1,162 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Protocol
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from entry.advisory_lock import DjangoAdvisoryLock
+from entry.cache import read_write_lock
+from entry.instrumented_lock import InstrumentedLock
+from entry.local_lock import TwoTierLock
+from entry.read_write_lock import DjangoReadWriteLock
+
+_backend_classes = {}
+
+
+class InvalidLockBackend(KeyError):
+    """
+    Raised when no lock backend is configured under a name
+    """
+
+
+class LockBackend(Protocol):
+    """
+    Makes the locks of the entry views, one backend is configured for every
+    name of ``settings.LOCK_BACKENDS``
+    """
+
+    name: str
+
+    def lock(self, key: str, shared: bool = False):
+        ...
+
+
+def register(name: str):
+    """
+    Registers the decorated class as the lock backend ``name``, which the
+    ``BACKEND`` of ``settings.LOCK_BACKENDS`` can refer to.
+    """
+
+    def decorator(cls):
+        _backend_classes[name] = cls
+        return cls
+
+    return decorator
+
+
+class BaseLockBackend(ABC):
+    def __init__(
+        self, name: str, timeout=1, blocking_timeout=None, sleep=0.1, **options
+    ):
+        """
+        ``name`` is the name the backend is configured under, it labels the
+        metrics of its locks.
+
+        ``timeout``, ``blocking_timeout`` and ``sleep`` are passed to every
+        lock, see ``DjangoRedlock``. Any other option is passed to the locks
+        as well.
+        """
+        self.name = name
+        self.timeout = timeout
+        self.blocking_timeout = blocking_timeout
+        self.sleep = sleep
+        self.options = options
+
+    def lock(self, key: str, shared: bool = False):
+        """
+        Returns an instrumented lock on ``key``, ``shared`` indicates whether
+        other shared locks may hold it at the same time.
+        """
+        lock = self.make_lock(
+            key,
+            shared=shared,
+            timeout=self.timeout,
+            blocking_timeout=self.blocking_timeout,
+            sleep=self.sleep,
+            **self.options,
+        )
+        return InstrumentedLock(lock, self.name)
+
+    @abstractmethod
+    def make_lock(self, key: str, shared: bool, **kwargs):
+        """
+        Returns the lock on ``key`` that ``lock`` instruments.
+        """
+
+
+@register("django")
+class DjangoLockBackend(BaseLockBackend):
+    """
+    Read-write locks stored in the Lock table, exclusive locks queue on an
+    in-process lock first and are renewed when ``settings.LOCK_AUTO_RENEW``
+    is set
+    """
+
+    def make_lock(self, key: str, shared: bool, **kwargs):
+        if shared:
+            return DjangoReadWriteLock(key, shared=True, **kwargs)
+        lock = DjangoReadWriteLock(key, auto_renew=settings.LOCK_AUTO_RENEW, **kwargs)
+        return TwoTierLock(lock)
+
+
+@register("redis")
+class RedisLockBackend(BaseLockBackend):
+    """
+    Read-write locks stored in redis under the key of ``cache.lock``,
+    exclusive locks queue on an in-process lock first
+    """
+
+    def make_lock(self, key: str, shared: bool, **kwargs):
+        if shared:
+            return read_write_lock(f"lock-{key}", shared=True, **kwargs)
+        return TwoTierLock(read_write_lock(f"lock-{key}", **kwargs))
+
+
+@register("advisory")
+class AdvisoryLockBackend(BaseLockBackend):
+    """
+    PostgreSQL advisory locks, which have no shared mode, shared locks are
+    exclusive
+    """
+
+    def make_lock(self, key: str, shared: bool, **kwargs):
+        return DjangoAdvisoryLock(key, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def get_lock_backend(name: str) -> LockBackend:
+    """
+    Returns the lock backend configured under ``name`` in
+    ``settings.LOCK_BACKENDS``.
+
+    ``BACKEND`` is the name of a registered backend or the dotted path of its
+    class, ``TIMEOUT``, ``BLOCKING_TIMEOUT`` and ``SLEEP`` are passed to it
+    along with ``OPTIONS``.
+    """
+    try:
+        config = settings.LOCK_BACKENDS[name]
+    except KeyError:
+        raise InvalidLockBackend(f"No lock backend is configured as {name!r}")
+
+    path = config["BACKEND"]
+    backend_class = _backend_classes.get(path) or import_string(path)
+    return backend_class(
+        name,
+        timeout=config.get("TIMEOUT", 1),
+        blocking_timeout=config.get("BLOCKING_TIMEOUT"),
+        sleep=config.get("SLEEP", 0.1),
+        **config.get("OPTIONS", {}),
+    )
+
+
+@receiver(setting_changed)
+def reset_lock_backends(*, setting, **kwargs):
+    """
+    Forgets the configured backends when ``override_settings`` or the
+    ``settings`` fixture change ``LOCK_BACKENDS``, it only exists for tests.
+    """
+    if setting == "LOCK_BACKENDS":
+        get_lock_backend.cache_clear()
@@ -0,0 +1,98 @@
+import time as mod_time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from redis.connection import Connection
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Returns the ``fraction`` percentile of ``values``, which must be sorted,
+    with the nearest rank method.
+    """
+    rank = max(round(fraction * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(latencies: list) -> dict:
+    """
+    Returns the distribution of ``latencies``, in seconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        "rounds": len(latencies),
+        "mean": sum(latencies) / len(latencies),
+        "min": latencies[0],
+        "median": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1],
+    }
+
+
+@contextmanager
+def capture_redis_commands():
+    """
+    Collects the name of every command sent to redis inside the block,
+    commands sent in pipelines included.
+    """
+    commands = []
+    pack_command = Connection.pack_command
+
+    def capturing_pack_command(self, *args):
+        commands.append(str(args[0]).upper())
+        return pack_command(self, *args)
+
+    with patch.object(Connection, "pack_command", capturing_pack_command):
+        yield commands
+
+
+def measure(operation, rounds: int, warmup: int = 10) -> dict:
+    """
+    Calls ``operation`` ``rounds`` times and returns the distribution of its
+    latency with how many queries and redis commands one call sends.
+    """
+    for _ in range(warmup):
+        operation()
+
+    # counted apart, so that counting does not slow down the timed calls
+    with CaptureQueriesContext(connection) as queries:
+        with capture_redis_commands() as commands:
+            operation()
+
+    latencies = []
+    for _ in range(rounds):
+        started_at = mod_time.perf_counter()
+        operation()
+        latencies.append(mod_time.perf_counter() - started_at)
+
+    return {
+        **summarize(latencies),
+        "queries": len(queries),
+        "redis_commands": len(commands),
+    }
+
+
+def find_regressions(result: dict, baseline: dict, threshold: float) -> list:
+    """
+    Returns why ``result`` regressed compared to ``baseline``, its median may
+    be up to ``threshold`` slower, 0.2 being 20%, but it may not send more
+    queries or redis commands.
+    """
+    regressions = []
+    limit = baseline["median"] * (1 + threshold)
+    if result["median"] > limit:
+        regressions.append(
+            "median of {:.1f}us is over {:.1f}us, {:.0%} more than {:.1f}us".format(
+                result["median"] * 1e6,
+                limit * 1e6,
+                threshold,
+                baseline["median"] * 1e6,
+            )
+        )
+    for count in ("queries", "redis_commands"):
+        if result[count] > baseline[count]:
+            regressions.append(f"{result[count]} {count} instead of {baseline[count]}")
+    return regressions
@@ -0,0 +1,70 @@
+import pytest
+from django.core.cache import cache
+
+from entry.django_redlock import DjangoRedlock
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+LOCKS = {
+    "django": DjangoRedlock,
+    "django-upsert": lambda name, **kwargs: DjangoRedlock(name, upsert=True, **kwargs),
+    "redis": cache.lock,
+}
+
+
+@pytest.fixture(params=list(LOCKS))
+def get_lock(request):
+    return LOCKS[request.param]
+
+
+@pytest.fixture
+def held_lock(get_lock):
+    lock = get_lock("bench", timeout=10)
+    assert lock.acquire(blocking=False)
+    yield lock
+    lock.release()
+
+
+def test_uncontended_acquire_release(benchmark, get_lock):
+    lock = get_lock("bench", timeout=10)
+
+    def acquire_release():
+        assert lock.acquire(blocking=False)
+        lock.release()
+
+    benchmark(acquire_release)
+
+
+def test_contended_acquire(benchmark, get_lock, held_lock):
+    lock = get_lock("bench", timeout=10)
+
+    def contended_acquire():
+        assert not lock.acquire(blocking=False)
+
+    benchmark(contended_acquire)
+
+
+def test_extend(benchmark, held_lock):
+    benchmark(lambda: held_lock.extend(1))
+
+
+def test_reacquire(benchmark, held_lock):
+    benchmark(held_lock.reacquire)
+
+
+def test_owned(benchmark, held_lock):
+    benchmark(lambda: held_lock.owned())
+
+
+def test_locked(benchmark, held_lock):
+    benchmark(lambda: held_lock.locked())
+
+
+def test_measure(benchmark, redis_commands):
+    result = benchmark(lambda: cache.get("foo"))
+
+    assert result["rounds"] > 0
+    assert result["min"] <= result["median"] <= result["p99"] <= result["max"]
+    assert result["queries"] == 0
+    assert result["redis_commands"] == 1
+    assert redis_commands.count("GET") == result["rounds"] + 11
@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.status import HTTP_200_OK
+
+from entry.benchmark import capture_redis_commands
+from entry.cache import read_write_lock
+from entry.django_redlock import DjangoRedlock
+from entry.models import Lock
+from entry.read_write_lock import DjangoReadWriteLock
+
+# most queries and redis commands a request may send, per route and case:
+# - get: cold cache, uncontended
+# - get_cached: the value was cached by the previous get
+# - get_shared: cold cache, another reader holds the lock
+# - increment: uncontended
+# - increment_expired: the lock is held by a writer whose lock expired,
+#   redis expires its locks by itself so this case does not exist for them
+ENDPOINT_BUDGETS = {
+    ("django", "django"): {
+        "get": (7, 4),
+        "get_cached": (0, 0),
+        "get_shared": (7, 4),
+        "increment": (11, 3),
+        "increment_expired": (13, 3),
+    },
+    ("django", "redis"): {
+        "get": (2, 6),
+        "get_cached": (0, 0),
+        "get_shared": (2, 6),
+        "increment": (3, 5),
+    },
+    ("redis", "django"): {
+        "get": (5, 1),
+        "get_cached": (5, 1),
+        "get_shared": (5, 1),
+        "increment": (8, 1),
+        "increment_expired": (10, 1),
+    },
+    ("redis", "redis"): {
+        "get": (0, 3),
+        "get_cached": (0, 3),
+        "get_shared": (0, 3),
+        "increment": (0, 3),
+    },
+}
+
+# most queries a DjangoRedlock method may send, without and with upsert, none
+# of them may send redis commands
+METHOD_BUDGETS = {
+    "acquire": (1, 1),
+    "acquire_contended": (2, 1),
+    "acquire_expired": (2, 1),
+    "release": (2, 2),
+    "extend": (2, 2),
+    "reacquire": (2, 2),
+    "owned": (1, 1),
+    "locked": (1, 1),
+}
+
+
+@contextmanager
+def budget(queries: int, redis_commands: int):
+    """
+    Fails when the block sends more than ``queries`` queries or more than
+    ``redis_commands`` redis commands.
+    """
+    with CaptureQueriesContext(connection) as captured:
+        with capture_redis_commands() as commands:
+            yield
+    sent = "\n".join(query["sql"] for query in captured)
+    assert len(captured) <= queries, f"{len(captured)} queries:\n{sent}"
+    assert len(commands) <= redis_commands, f"{len(commands)} commands: {commands}"
+
+
+def endpoint_cases():
+    for (storage, lock), budgets in ENDPOINT_BUDGETS.items():
+        for case, (queries, redis_commands) in budgets.items():
+            yield pytest.param(
+                storage,
+                lock,
+                case,
+                queries,
+                redis_commands,
+                id=f"{storage}-{lock}-{case}",
+            )
+
+
+def hold_lock(lock: str, key: str, **kwargs):
+    if lock == "django":
+        held = DjangoReadWriteLock(key, timeout=10, **kwargs)
+    else:
+        held = read_write_lock(f"lock-{key}", timeout=10, **kwargs)
+    assert held.acquire(blocking=False)
+    return held
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize(
+    "storage, lock, case, queries, redis_commands", list(endpoint_cases())
+)
+def test_endpoint_budget(client, storage, lock, case, queries, redis_commands):
+    url = f"/entry/{storage}/{lock}/lock/test/"
+    method = client.post if case.startswith("increment") else client.get
+    if case == "get_cached":
+        client.get(url)
+    elif case == "get_shared":
+        hold_lock(lock, "test", shared=True)
+    elif case == "increment_expired":
+        hold_lock(lock, "test")
+        Lock.objects.update(expires_at=datetime.now() - timedelta(seconds=1))
+
+    with budget(queries, redis_commands):
+        response = method(url)
+
+    assert response.status_code == HTTP_200_OK
+
+
+def prepare(method: str, lock: DjangoRedlock):
+    """
+    Puts ``lock`` in the state its ``method`` is measured in.
+    """
+    if method == "acquire":
+        return
+    if method in ("acquire_contended", "acquire_expired"):
+        holder = DjangoRedlock(lock.name, timeout=10)
+        assert holder.acquire(blocking=False)
+        if method == "acquire_expired":
+            Lock.objects.update(expires_at=datetime.now() - timedelta(seconds=1))
+        return
+    assert lock.acquire(blocking=False)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("upsert", [False, True], ids=["default", "upsert"])
+@pytest.mark.parametrize("method", list(METHOD_BUDGETS))
+def test_lock_method_budget(method: str, upsert: bool):
+    lock = DjangoRedlock("test", timeout=10, upsert=upsert)
+    prepare(method, lock)
+    call = {
+        "acquire": lambda: lock.acquire(blocking=False),
+        "acquire_contended": lambda: lock.acquire(blocking=False),
+        "acquire_expired": lambda: lock.acquire(blocking=False),
+        "release": lock.release,
+        "extend": lambda: lock.extend(1),
+        "reacquire": lock.reacquire,
+        "owned": lock.owned,
+        "locked": lock.locked,
+    }[method]
+
+    with budget(METHOD_BUDGETS[method][upsert], 0):
+        call()
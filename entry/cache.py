@@ -1,5 +1,127 @@
+import asyncio
+import time as mod_time
+import weakref
+from functools import lru_cache
+
+from django.conf import settings
 from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+
+from entry.read_write_lock import SERVER_TIME, RedisReadWriteLock
+
+# asyncio connections are bound to the loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+
+# KEYS[1] is the key of a redis-py lock, KEYS[2] the counter and KEYS[3] the
+# readers of a RedisReadWriteLock on the same key. Both scripts return false
+# while a writer holds the lock, the increment also while any reader does,
+# expired readers are trimmed first like the acquire scripts of the lock do
+LOCKED_INCR_SCRIPT = (
+    """
+if redis.call('exists', KEYS[1]) == 1 then
+    return false
+end
+"""
+    + SERVER_TIME
+    + """
+redis.call('zremrangebyscore', KEYS[3], '-inf', now)
+if redis.call('zcard', KEYS[3]) > 0 then
+    return false
+end
+return redis.call('incr', KEYS[2])
+"""
+)
+
+LOCKED_GET_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return false
+end
+return redis.call('get', KEYS[2]) or 0
+"""
 
 
 def increment_entry(key: str) -> None:
     cache.incr(key, ignore_key_check=True)
+
+
+def increment_entries(counts: dict) -> dict:
+    """
+    Adds every delta in ``counts`` to its key in one pipeline and returns the
+    new values by key.
+    """
+    keys = sorted(counts)
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    for key in keys:
+        pipeline.incrby(cache.make_key(key), counts[key])
+    return dict(zip(keys, pipeline.execute()))
+
+
+@lru_cache(maxsize=None)
+def get_script(source: str):
+    """
+    Registers ``source`` once per process, it is then run with EVALSHA.
+    """
+    return get_redis_connection("default").register_script(source)
+
+
+def run_unlocked(source: str, key: str, sleep=0.1, blocking_timeout=None) -> int:
+    """
+    Runs the script ``source`` on ``key`` in one round trip as soon as no
+    client holds ``lock-{key}``, the lock taken by ``cache.lock`` and
+    ``read_write_lock``.
+    """
+    script = get_script(source)
+    lock_name = cache.make_key(f"lock-{key}")
+    keys = [lock_name, cache.make_key(key), f"{lock_name}:readers"]
+    stop_trying_at = None
+    if blocking_timeout is not None:
+        stop_trying_at = mod_time.monotonic() + blocking_timeout
+    while True:
+        value = script(keys=keys)
+        if value is not None:
+            return int(value)
+        next_try_at = mod_time.monotonic() + sleep
+        if stop_trying_at is not None and next_try_at > stop_trying_at:
+            raise LockError("Unable to acquire lock within the time specified")
+        mod_time.sleep(sleep)
+
+
+def read_write_lock(key: str, **kwargs) -> RedisReadWriteLock:
+    """
+    Read-write version of ``cache.lock``, using the same redis key.
+    """
+    client = get_redis_connection("default")
+    return RedisReadWriteLock(client, cache.make_key(key), **kwargs)
+
+
+def get_async_client() -> Redis:
+    """
+    Returns an asyncio client for the server of the default cache, one per
+    event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = Redis.from_url(settings.CACHES["default"]["LOCATION"])
+        _async_clients[loop] = client
+    return client
+
+
+def async_lock(key: str, **kwargs):
+    """
+    Asyncio version of ``cache.lock``, using the same redis key.
+    """
+    return get_async_client().lock(cache.make_key(key), **kwargs)
+
+
+async def async_get(key: str, default: int = 0) -> int:
+    value = await get_async_client().get(cache.make_key(key))
+    if value is None:
+        return default
+    return int(value)
+
+
+async def async_incr(key: str) -> int:
+    return await get_async_client().incr(cache.make_key(key))
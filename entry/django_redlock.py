@@ -1,18 +1,123 @@
+import asyncio
+import hashlib
 import logging
+import select
 import threading
 import time as mod_time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import wraps
 from types import SimpleNamespace
 
-from django.db import IntegrityError
-from django.db.transaction import atomic
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.db.transaction import atomic, set_rollback
 from redis.exceptions import LockError, LockNotOwnedError
 
-from entry.models import Lock
+from entry.lease_watchdog import watchdog
+from entry.models import Lock, LockWaiter, expiry
+from smart_lock.metrics import count_attempt, current_backend, current_view, registry
 
 logger = logging.getLogger(__name__)
 
+_reentrant = threading.local()
+
+
+class LockState(threading.local):
+    """
+    Thread local state of a lock, every thread starts from ``defaults``
+    """
+
+    def __init__(self, **defaults):
+        self.__dict__.update(defaults)
+
+
+_db_executor = None
+_db_executor_lock = threading.Lock()
+
+# subqueries see the table as it was before the statement, so this is the
+# token that held the lock before it was taken, NULL if it was free
+PREVIOUS_TOKEN_SQL = """
+SELECT previous.token FROM entry_lock previous WHERE previous.name = entry_lock.name
+"""
+
+TAKE_OVER_LOCK_SQL = """
+UPDATE entry_lock
+SET token = %s, timeout = %s, created_at = %s, expires_at = %s
+WHERE name = %s AND (token = %s OR expires_at <= %s)
+RETURNING ({previous_token})
+"""
+
+UPSERT_LOCK_SQL = """
+INSERT INTO entry_lock (name, token, created_at, timeout, expires_at)
+VALUES {values}
+ON CONFLICT (name) DO UPDATE
+SET token = EXCLUDED.token,
+    created_at = EXCLUDED.created_at,
+    timeout = EXCLUDED.timeout,
+    expires_at = EXCLUDED.expires_at
+WHERE entry_lock.token = EXCLUDED.token
+   OR entry_lock.expires_at <= EXCLUDED.created_at
+RETURNING name, ({previous_token})
+"""
+
+
+def upsert_locks(names, token: str, timeout) -> list:
+    """
+    Takes, renews or steals the expired locks ``names`` with one statement and
+    returns the names that were taken.
+    """
+    now = datetime.now()
+    expires_at = expiry(timeout, now)
+    values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(names))
+    params = [
+        param for name in names for param in (name, token, now, timeout, expires_at)
+    ]
+    sql = UPSERT_LOCK_SQL.format(values=values, previous_token=PREVIOUS_TOKEN_SQL)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        taken = cursor.fetchall()
+    count_steals((previous for name, previous in taken), token)
+    return [name for name, previous in taken]
+
+
+def count_steals(previous_tokens, token: str):
+    """
+    Counts the locks taken from another token, they had expired.
+    """
+    steals = sum(1 for previous in previous_tokens if previous not in (None, token))
+    if steals:
+        registry.inc(
+            "lock_steals_total",
+            steals,
+            backend=current_backend.get(),
+            view=current_view.get(),
+        )
+
+
+def reentrant_holds() -> dict:
+    """
+    Returns the reentrant locks held by the current thread, mapped to their
+    token and how many times they are held.
+    """
+    try:
+        return _reentrant.holds
+    except AttributeError:
+        _reentrant.holds = {}
+        return _reentrant.holds
+
+
+def lock_channel(name: str) -> str:
+    """
+    Returns the channel used to notify waiters that the lock ``name`` was
+    released, hashed so that it is always a valid identifier.
+    """
+    return "lock_" + hashlib.blake2b(name.encode(), digest_size=16).hexdigest()
+
 
 class DjangoRedlock:
     """
@@ -27,6 +132,11 @@ class DjangoRedlock:
         blocking=True,
         blocking_timeout=None,
         thread_local=True,
+        upsert=False,
+        notify=False,
+        fair=False,
+        reentrant=False,
+        auto_renew=False,
     ):
         """
         Create a new Lock instance named ``name`` using the Redis client
@@ -77,6 +187,38 @@ class DjangoRedlock:
         the token set by the thread that acquired the lock. Our assumption
         is that these cases aren't common and as such default to using
         thread local storage.
+
+        ``upsert`` indicates whether each acquire attempt should take, renew or
+        steal an expired lock with a single ``INSERT ... ON CONFLICT DO UPDATE``
+        statement instead of the create / get / select for update sequence.
+        Every attempt then costs exactly one query and no exception is raised
+        when the lock is already taken. Defaults to False.
+
+        ``notify`` indicates whether blocked acquirers should ``LISTEN`` on a
+        channel of their own lock and ``release`` should ``NOTIFY`` it, so
+        that waiters wake up as soon as the lock is released instead of at
+        the end of their ``sleep``. Sleeping is kept as a fallback for locks
+        that expire and for connections inside a transaction, which do not
+        receive notifications. Defaults to False.
+
+        ``fair`` indicates whether the lock is granted in the order in which
+        blocking acquirers started waiting for it. Each of them takes a ticket,
+        a ``LockWaiter`` row, and only tries to take the lock when no live
+        ticket is older than its own. A ticket that is not refreshed within
+        ``waiter_expiry`` seconds is considered abandoned and skipped.
+        Non-blocking acquires fail while anybody is waiting. Defaults to False.
+
+        ``reentrant`` indicates whether a thread that already holds the lock,
+        through this instance or another reentrant one with the same name,
+        acquires it again without any query. Holds are counted per thread and
+        only the outermost release deletes the lock. Nested acquires do not
+        renew the lock. Defaults to False.
+
+        ``auto_renew`` indicates whether the lock is renewed for ``timeout``
+        seconds every ``LOCK_RENEW_INTERVAL`` seconds while it is held, by a
+        watchdog thread that renews all the locks of the process with a single
+        query. ``lease_lost`` tells whether the watchdog failed to renew it.
+        Defaults to False.
         """
         self.name = name
         self.timeout = timeout
@@ -84,8 +226,15 @@ class DjangoRedlock:
         self.blocking = blocking
         self.blocking_timeout = blocking_timeout
         self.thread_local = bool(thread_local)
-        self.local = threading.local() if self.thread_local else SimpleNamespace()
-        self.local.token = None
+        self.upsert = bool(upsert)
+        self.notify = bool(notify)
+        self.channel = lock_channel(name)
+        self.fair = bool(fair)
+        self.reentrant = bool(reentrant)
+        self.auto_renew = bool(auto_renew)
+        self.local = (LockState if self.thread_local else SimpleNamespace)(
+            token=None, listening=False, ticket=None, depth=0, lease=None
+        )
 
     def __enter__(self):
         if self.acquire():
@@ -111,6 +260,8 @@ class DjangoRedlock:
         object with the default encoding. If a token isn't specified, a UUID
         will be generated.
         """
+        if self.reentrant and self.enter_hold():
+            return True
         sleep = self.sleep
         if token is None:
             token = uuid.uuid4().hex
@@ -121,26 +272,147 @@ class DjangoRedlock:
         stop_trying_at = None
         if blocking_timeout is not None:
             stop_trying_at = mod_time.monotonic() + blocking_timeout
-        while True:
-            if self.do_acquire(token):
-                self.local.token = token
-                return True
-            if not blocking:
-                return False
-            next_try_at = mod_time.monotonic() + sleep
-            if stop_trying_at is not None and next_try_at > stop_trying_at:
-                return False
+        if self.fair and blocking:
+            self.local.ticket = self.take_ticket(token)
+        try:
+            while True:
+                count_attempt()
+                if self.do_acquire(token):
+                    self.local.token = token
+                    if self.reentrant:
+                        reentrant_holds()[self.reentrant_key] = [token, 1]
+                        self.local.depth = 1
+                    if self.auto_renew and self.timeout:
+                        self.local.lease = watchdog.add(self.name, token)
+                    return True
+                if not blocking:
+                    return False
+                next_try_at = mod_time.monotonic() + sleep
+                if stop_trying_at is not None and next_try_at > stop_trying_at:
+                    return False
+                self.wait(sleep)
+        finally:
+            if self.local.listening:
+                self.unlisten()
+            if self.local.ticket is not None:
+                self.leave_queue()
+
+    @property
+    def reentrant_key(self):
+        return type(self), self.name
+
+    def enter_hold(self) -> bool:
+        """
+        Counts one more hold if the current thread already holds the lock.
+        """
+        hold = reentrant_holds().get(self.reentrant_key)
+        if hold is None:
+            return False
+        hold[1] += 1
+        self.local.token = hold[0]
+        self.local.depth += 1
+        return True
+
+    def leave_hold(self, token: str) -> bool:
+        """
+        Forgets one hold of the current thread, returns True while it still
+        holds the lock.
+        """
+        holds = reentrant_holds()
+        hold = holds.get(self.reentrant_key)
+        self.local.depth = max(self.local.depth - 1, 0)
+        if hold is None or hold[0] != token:
+            return False
+        hold[1] -= 1
+        if hold[1]:
+            if not self.local.depth:
+                self.local.token = None
+            return True
+        del holds[self.reentrant_key]
+        return False
+
+    def wait(self, sleep):
+        """
+        Waits up to ``sleep`` seconds before the next acquire attempt.
+        """
+        if not self.notify or connection.in_atomic_block:
             mod_time.sleep(sleep)
+        elif not self.local.listening:
+            # try again straight away, the lock could have been released
+            # before we started listening
+            self.listen()
+        else:
+            self.wait_for_release(sleep)
+
+    def listen(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        connection.connection.notifies.clear()
+        self.local.listening = True
+
+    def unlisten(self):
+        self.local.listening = False
+        with connection.cursor() as cursor:
+            cursor.execute(f"UNLISTEN {self.channel}")
+
+    def wait_for_release(self, sleep):
+        pg_connection = connection.connection
+        pg_connection.poll()
+        if not pg_connection.notifies:
+            select.select([pg_connection], [], [], sleep)
+            pg_connection.poll()
+        pg_connection.notifies.clear()
+
+    @property
+    def waiter_expiry(self) -> float:
+        return max(3 * self.sleep, 1)
+
+    def take_ticket(self, token: str) -> int:
+        return LockWaiter.objects.create(name=self.name, token=token).pk
+
+    def leave_queue(self):
+        ticket, self.local.ticket = self.local.ticket, None
+        LockWaiter.objects.filter(pk=ticket).delete()
+
+    def is_next_in_line(self) -> bool:
+        """
+        Returns True if no live waiter queued before this one.
+        """
+        ticket = self.local.ticket
+        if ticket is not None:
+            # keep our ticket alive
+            LockWaiter.objects.filter(pk=ticket).update(seen_at=datetime.now())
+        first = (
+            LockWaiter.objects.filter(
+                name=self.name,
+                seen_at__gte=datetime.now() - timedelta(seconds=self.waiter_expiry),
+            )
+            .order_by("id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        return first is None or first == ticket
 
     def do_acquire(self, token):
+        if self.fair and not self.is_next_in_line():
+            return False
         if self.timeout:
             timeout = self.timeout
         else:
             timeout = None
+        if self.upsert:
+            return self.upsert_lock(token, timeout)
         if self.create_lock_or_renew_it(token, timeout):
             return True
         return False
 
+    def upsert_lock(self, token: str, timeout: int) -> bool:
+        """
+        Takes the lock if it is free, renews it if ``token`` already holds it
+        or steals it if it expired, all in one statement.
+        """
+        return bool(upsert_locks([self.name], token, timeout))
+
     def create_lock_or_renew_it(self, token: str, timeout: int):
         success = False
 
@@ -153,25 +425,18 @@ class DjangoRedlock:
         except IntegrityError:
             logger.warning("Lock already exists")
 
-            try:
-                if self.owned():
-                    with atomic():
-                        lock = Lock.objects.select_for_update().get(name=self.name)
-
-                        if (
-                            lock.timeout is not None
-                            and lock.created_at + timedelta(milliseconds=lock.timeout)
-                            > datetime.now()
-                        ):
-                            # lock expired,
-                            # save it again to update timeout and created_at
-                            lock.timeout = timeout
-                            lock.save()
-                            success = True
-                        else:
-                            logger.warning("Lock is taken by somebody else")
-            except Lock.DoesNotExist:
-                logger.warning("Lock got deleted before")
+            # renew it if the token holds it already, or take it over if expired
+            now = datetime.now()
+            sql = TAKE_OVER_LOCK_SQL.format(previous_token=PREVIOUS_TOKEN_SQL)
+            params = [token, timeout, now, expiry(timeout, now)]
+            params += [self.name, token, now]
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                taken = cursor.fetchall()
+            count_steals((previous for previous, in taken), token)
+            success = bool(taken)
+            if not success:
+                logger.warning("Lock is taken by somebody else")
 
         return success
 
@@ -181,37 +446,42 @@ class DjangoRedlock:
         """
         return Lock.objects.filter(name=self.name).exists()
 
+    @property
+    def lease_lost(self) -> bool:
+        """
+        Returns True if the watchdog could not renew the lock held.
+        """
+        lease = self.local.lease
+        return lease is not None and lease.lost
+
     def owned(self):
         """
         Returns True if this key is locked by this lock, otherwise False.
         """
-        try:
-            lock = Lock.objects.get(name=self.name)
-
-            within_timeout = (
-                lock.timeout is not None
-                and lock.created_at + timedelta(milliseconds=lock.timeout)
-                > datetime.now()
-            )
-            no_timeout = lock.timeout is None
-
-            # token is set,
-            # lock token is the same as thread local one and (timeout is not set, or we are within timeout)  # noqa: E501
-            return (
-                self.local.token is not None
-                and lock.token == self.local.token
-                and (within_timeout or no_timeout)
-            )
-        except Lock.DoesNotExist:
+        if self.local.token is None:
             return False
+        return (
+            Lock.objects.alive().filter(name=self.name, token=self.local.token).exists()
+        )
 
     def release(self):
         "Releases the already acquired lock"
         expected_token = self.local.token
         if expected_token is None:
             raise LockError("Cannot release an unlocked lock")
+        if self.reentrant and self.leave_hold(expected_token):
+            return
         self.local.token = None
+        if self.local.lease is not None:
+            watchdog.remove(self.local.lease)
+            self.local.lease = None
         self.do_release(expected_token)
+        if self.notify:
+            self.notify_waiters()
+
+    def notify_waiters(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [self.channel])
 
     def do_release(self, expected_token: str):
         with atomic():
@@ -282,3 +552,256 @@ class DjangoRedlock:
 
     def do_reacquire(self):
         return self.do_extend(self.timeout, replace_ttl=True)
+
+
+class DjangoMultiLock(DjangoRedlock):
+    """
+    Lock on a group of names using Django's ORM, either all of them are
+    acquired or none is
+    """
+
+    def __init__(
+        self,
+        names,
+        timeout=None,
+        sleep=0.1,
+        blocking=True,
+        blocking_timeout=None,
+        thread_local=True,
+    ):
+        """
+        Create a new lock on every name of ``names``, the other arguments are
+        the same as ``DjangoRedlock``.
+
+        Each acquire attempt claims all the names with one multi-row upsert,
+        stealing expired locks like ``upsert`` does, and rolls it back unless
+        every name was claimed. Release deletes all of them with one query.
+        """
+        self.names = sorted(set(names))
+        super().__init__(
+            ",".join(self.names),
+            timeout=timeout,
+            sleep=sleep,
+            blocking=blocking,
+            blocking_timeout=blocking_timeout,
+            thread_local=thread_local,
+        )
+
+    def do_acquire(self, token):
+        with atomic():
+            taken = upsert_locks(self.names, token, self.timeout or None)
+            if len(taken) != len(self.names):
+                set_rollback(True)
+                return False
+        return True
+
+    def locked(self):
+        """
+        Returns True if any of the names is locked by any process, otherwise
+        False.
+        """
+        return Lock.objects.filter(name__in=self.names).exists()
+
+    def owned(self):
+        """
+        Returns True if all the names are locked by this lock, otherwise False.
+        """
+        if self.local.token is None:
+            return False
+        locks = Lock.objects.alive().filter(name__in=self.names, token=self.local.token)
+        return locks.count() == len(self.names)
+
+    def do_release(self, expected_token: str):
+        deleted, _ = Lock.objects.filter(
+            name__in=self.names, token=expected_token
+        ).delete()
+        if deleted != len(self.names):
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+
+    def do_extend(self, additional_time, replace_ttl):
+        now = datetime.now()
+        if replace_ttl:
+            timeout = additional_time
+            expires_at = expiry(additional_time, now)
+        else:
+            timeout = F("timeout") + additional_time
+            expires_at = RawSQL(
+                "%s + (timeout + %s) * INTERVAL '1 second'", [now, additional_time]
+            )
+        updated = Lock.objects.filter(
+            name__in=self.names, token=self.local.token
+        ).update(timeout=timeout, created_at=now, expires_at=expires_at)
+        if updated != len(self.names):
+            raise LockNotOwnedError("Cannot extend a lock that's no longer owned")
+        return True
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool running the queries of asynchronous code, each of
+    its threads keeps a connection, so its size caps them.
+    """
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_DB_THREADS,
+                thread_name_prefix="async-db",
+            )
+        return _db_executor
+
+
+def run_in_executor(function):
+    """
+    Runs ``function`` on the shared thread pool instead of a thread dedicated
+    to the request, it must not rely on an open transaction.
+    """
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            # request signals are not sent in the pool threads
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False, executor=get_db_executor())
+
+
+class AsyncDjangoRedlock:
+    """
+    Asyncio version of DjangoRedlock, queries run on a thread pool and waiting
+    for the lock happens in the event loop
+    """
+
+    def __init__(
+        self,
+        name,
+        timeout=None,
+        sleep=0.1,
+        blocking=True,
+        blocking_timeout=None,
+        upsert=False,
+        fair=False,
+    ):
+        """
+        Takes the same arguments as ``DjangoRedlock``.
+
+        The token is not kept in thread local storage, the queries of a
+        single acquire can run on different threads of the pool, so an
+        instance must not be shared between tasks. LISTEN/NOTIFY wakeups are
+        not available, waiters sleep with ``asyncio.sleep``.
+        """
+        self.lock = DjangoRedlock(
+            name,
+            timeout=timeout,
+            sleep=sleep,
+            blocking=blocking,
+            blocking_timeout=blocking_timeout,
+            thread_local=False,
+            upsert=upsert,
+            fair=fair,
+        )
+        self.name = name
+        self.timeout = timeout
+        self.sleep = sleep
+        self.blocking = blocking
+        self.blocking_timeout = blocking_timeout
+        self.local = self.lock.local
+
+    async def __aenter__(self):
+        if await self.acquire():
+            return self
+        raise LockError("Unable to acquire lock within the time specified")
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.release()
+
+    async def acquire(self, blocking=None, blocking_timeout=None, token=None):
+        """
+        Use Django's ORM to hold a shared, distributed lock named ``name``.
+        Returns True once the lock is acquired.
+
+        If ``blocking`` is False, always return immediately. If the lock
+        was acquired, return True, otherwise return False.
+
+        ``blocking_timeout`` specifies the maximum number of seconds to
+        wait trying to acquire the lock.
+
+        ``token`` specifies the token value to be used. If a token isn't
+        specified, a UUID will be generated.
+        """
+        loop = asyncio.get_running_loop()
+        sleep = self.sleep
+        if token is None:
+            token = uuid.uuid4().hex
+        if blocking is None:
+            blocking = self.blocking
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        stop_trying_at = None
+        if blocking_timeout is not None:
+            stop_trying_at = loop.time() + blocking_timeout
+        if self.lock.fair and blocking:
+            self.local.ticket = await run_in_executor(self.lock.take_ticket)(token)
+        try:
+            while True:
+                if await run_in_executor(self.lock.do_acquire)(token):
+                    self.local.token = token
+                    return True
+                if not blocking:
+                    return False
+                next_try_at = loop.time() + sleep
+                if stop_trying_at is not None and next_try_at > stop_trying_at:
+                    return False
+                await asyncio.sleep(sleep)
+        finally:
+            if self.local.ticket is not None:
+                await run_in_executor(self.lock.leave_queue)()
+
+    async def locked(self):
+        """
+        Returns True if this key is locked by any process, otherwise False.
+        """
+        return await run_in_executor(self.lock.locked)()
+
+    async def owned(self):
+        """
+        Returns True if this key is locked by this lock, otherwise False.
+        """
+        return await run_in_executor(self.lock.owned)()
+
+    async def release(self):
+        "Releases the already acquired lock"
+        expected_token = self.local.token
+        if expected_token is None:
+            raise LockError("Cannot release an unlocked lock")
+        self.local.token = None
+        await run_in_executor(self.lock.do_release)(expected_token)
+
+    async def extend(self, additional_time, replace_ttl=False):
+        """
+        Adds more time to an already acquired lock.
+
+        ``additional_time`` can be specified as an integer or a float, both
+        representing the number of seconds to add.
+
+        ``replace_ttl`` if False (the default), add `additional_time` to
+        the lock's existing ttl. If True, replace the lock's ttl with
+        `additional_time`.
+        """
+        if self.local.token is None:
+            raise LockError("Cannot extend an unlocked lock")
+        if self.timeout is None:
+            raise LockError("Cannot extend a lock with no timeout")
+        return await run_in_executor(self.lock.do_extend)(additional_time, replace_ttl)
+
+    async def reacquire(self):
+        """
+        Resets a TTL of an already acquired lock back to a timeout value.
+        """
+        if self.local.token is None:
+            raise LockError("Cannot reacquire an unlocked lock")
+        if self.timeout is None:
+            raise LockError("Cannot reacquire a lock with no timeout")
+        return await run_in_executor(self.lock.do_reacquire)()
@@ -0,0 +1,75 @@
+import time as mod_time
+
+from redis.exceptions import LockError
+
+from entry.django_redlock import LockState
+from smart_lock.metrics import current_attempts, current_backend, current_view, registry
+
+
+class InstrumentedLock:
+    """
+    Records how long a lock is waited for, held and released, how many
+    attempts it took and whether it timed out
+    """
+
+    def __init__(self, lock, backend: str):
+        """
+        Wraps ``lock``, a ``DjangoRedlock``, a redis-py ``Lock`` or a
+        ``TwoTierLock`` around one of them, its metrics are labelled with
+        ``backend`` and the view of the current request. Retries are counted
+        for the locks that call ``count_attempt``, redis-py's own ``Lock``
+        does not.
+        """
+        self.lock = lock
+        self.backend = backend
+        self.local = LockState(acquired_at=None)
+
+    def __getattr__(self, name):
+        return getattr(self.lock, name)
+
+    def __enter__(self):
+        if self.acquire():
+            return self
+        raise LockError("Unable to acquire lock within the time specified")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @property
+    def labels(self) -> dict:
+        return {"backend": self.backend, "view": current_view.get()}
+
+    def acquire(self, blocking=None, blocking_timeout=None, token=None):
+        attempts = [0]
+        reset_attempts = current_attempts.set(attempts)
+        reset_backend = current_backend.set(self.backend)
+        started_at = mod_time.perf_counter()
+        acquired = False
+        try:
+            acquired = self.lock.acquire(blocking, blocking_timeout, token)
+        finally:
+            current_attempts.reset(reset_attempts)
+            current_backend.reset(reset_backend)
+            acquired_at = mod_time.perf_counter()
+            labels = self.labels
+            registry.observe("lock_acquire_seconds", acquired_at - started_at, **labels)
+            if attempts[0] > 1:
+                registry.inc("lock_retries_total", attempts[0] - 1, **labels)
+            if not acquired:
+                registry.inc("lock_timeouts_total", **labels)
+        if acquired:
+            self.local.acquired_at = acquired_at
+        return acquired
+
+    def release(self):
+        started_at = mod_time.perf_counter()
+        try:
+            self.lock.release()
+        finally:
+            released_at = mod_time.perf_counter()
+            labels = self.labels
+            if self.local.acquired_at is not None:
+                held = started_at - self.local.acquired_at
+                registry.observe("lock_hold_seconds", held, **labels)
+                self.local.acquired_at = None
+            registry.observe("lock_release_seconds", released_at - started_at, **labels)
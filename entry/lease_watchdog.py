@@ -0,0 +1,101 @@
+import logging
+import threading
+import time as mod_time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+RENEW_LOCKS_SQL = """
+UPDATE entry_lock
+SET created_at = %s,
+    expires_at = %s + timeout * INTERVAL '1 second'
+WHERE timeout IS NOT NULL
+  AND expires_at > %s
+  AND (name, token) IN (VALUES {values})
+RETURNING name, token
+"""
+
+
+class Lease:
+    """
+    Lock renewed by the watchdog, ``lost`` is set once it could not be renewed
+    """
+
+    __slots__ = ("name", "token", "lost")
+
+    def __init__(self, name: str, token: str):
+        self.name = name
+        self.token = token
+        self.lost = False
+
+
+class LeaseWatchdog:
+    """
+    Renews every held lock of this process with one query per tick, from a
+    daemon thread that runs while there is anything to renew
+    """
+
+    def __init__(self):
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, name: str, token: str) -> Lease:
+        lease = Lease(name, token)
+        with self.lock:
+            self.leases[(name, token)] = lease
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="lease-watchdog", daemon=True
+                )
+                self.thread.start()
+        return lease
+
+    def remove(self, lease: Lease):
+        with self.lock:
+            self.leases.pop((lease.name, lease.token), None)
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.leases:
+                        self.thread = None
+                        return
+                    leases = list(self.leases.values())
+                try:
+                    self.renew(leases)
+                except Exception:
+                    logger.exception("Renewal of the leases failed")
+                    connection.close()
+                mod_time.sleep(settings.LOCK_RENEW_INTERVAL)
+        finally:
+            connection.close()
+
+    def renew(self, leases: list):
+        """
+        Renews ``leases`` for their timeout and flags the ones that are no
+        longer held.
+        """
+        now = datetime.now()
+        values = ", ".join(["(%s, %s)"] * len(leases))
+        params = [now, now, now]
+        params += [param for lease in leases for param in (lease.name, lease.token)]
+        with connection.cursor() as cursor:
+            cursor.execute(RENEW_LOCKS_SQL.format(values=values), params)
+            renewed = set(cursor.fetchall())
+
+        with self.lock:
+            for lease in leases:
+                key = (lease.name, lease.token)
+                # released locks are not renewed either
+                if key not in renewed and key in self.leases:
+                    logger.warning("Lock %s was lost before it was renewed", lease.name)
+                    lease.lost = True
+                    del self.leases[key]
+
+
+watchdog = LeaseWatchdog()
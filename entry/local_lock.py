@@ -0,0 +1,122 @@
+import threading
+import time as mod_time
+import weakref
+
+from redis.exceptions import LockError
+
+# one lock per name for the whole process, dropped once no lock uses it
+_local_locks = weakref.WeakValueDictionary()
+_registry_lock = threading.Lock()
+
+
+class LocalLock:
+    """
+    Process wide lock of a name, ``threading.Lock`` can not be weakly
+    referenced so it is wrapped
+    """
+
+    __slots__ = ("lock", "__weakref__")
+
+    def __init__(self, reentrant=False):
+        self.lock = threading.RLock() if reentrant else threading.Lock()
+
+
+def get_local_lock(name: str, reentrant=False) -> LocalLock:
+    """
+    Returns the lock shared by every thread of this process for ``name``,
+    ``reentrant`` indicates whether the thread holding it may acquire it
+    again, reentrant and plain locks of the same name are distinct.
+    """
+    with _registry_lock:
+        local_lock = _local_locks.get((name, reentrant))
+        if local_lock is None:
+            local_lock = _local_locks[name, reentrant] = LocalLock(reentrant)
+        return local_lock
+
+
+class TwoTierLock:
+    """
+    Puts an in-process lock in front of a distributed one, threads of the same
+    process queue on it, so only one of them at a time competes for the
+    distributed lock
+    """
+
+    def __init__(self, lock):
+        """
+        Wraps ``lock``, a ``DjangoRedlock`` or any lock with the same
+        interface as the redis-py ``Lock``, the in-process lock is the one of
+        its name. The in-process lock is reentrant when ``lock`` is, a thread
+        holding both tiers would otherwise wait for itself on a nested
+        acquire.
+        """
+        self.lock = lock
+        self.local_lock = get_local_lock(
+            lock.name, reentrant=getattr(lock, "reentrant", False)
+        )
+        # acquisitions of the in-process lock to undo, more than one when
+        # reentrant
+        self.holding = 0
+
+    @property
+    def name(self):
+        return self.lock.name
+
+    def __enter__(self):
+        if self.acquire():
+            return self
+        raise LockError("Unable to acquire lock within the time specified")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def acquire(self, blocking=None, blocking_timeout=None, token=None):
+        """
+        Acquires the in-process lock, then the distributed one with the time
+        left of ``blocking_timeout``. Arguments are the same as the ones of
+        the wrapped lock.
+        """
+        if blocking is None:
+            blocking = self.lock.blocking
+        if blocking_timeout is None:
+            blocking_timeout = self.lock.blocking_timeout
+        stop_trying_at = None
+        if blocking_timeout is not None:
+            stop_trying_at = mod_time.monotonic() + blocking_timeout
+
+        timeout = -1 if blocking_timeout is None or not blocking else blocking_timeout
+        if not self.local_lock.lock.acquire(blocking, timeout):
+            return False
+
+        if stop_trying_at is not None:
+            blocking_timeout = max(stop_trying_at - mod_time.monotonic(), 0)
+        try:
+            acquired = self.lock.acquire(blocking, blocking_timeout, token)
+        except BaseException:
+            self.local_lock.lock.release()
+            raise
+        if not acquired:
+            self.local_lock.lock.release()
+        else:
+            self.holding += 1
+        return acquired
+
+    def release(self):
+        "Releases the distributed lock, then the in-process one"
+        try:
+            self.lock.release()
+        finally:
+            if self.holding:
+                self.holding -= 1
+                self.local_lock.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def owned(self):
+        return self.lock.owned()
+
+    def extend(self, additional_time, replace_ttl=False):
+        return self.lock.extend(additional_time, replace_ttl)
+
+    def reacquire(self):
+        return self.lock.reacquire()
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from entry.write_behind import flush, run_flusher
+
+
+class Command(BaseCommand):
+    help = "Flushes the pending write-behind increments to the Entry table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.WRITE_BEHIND_BATCH_SIZE,
+            help="Maximum number of keys flushed by a single upsert",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help=(
+                "Keep flushing every INTERVAL seconds instead of exiting, failed"
+                " flushes are logged and retried"
+            ),
+        )
+
+    def handle(self, *args, batch_size, interval, **options):
+        if interval is None:
+            flushed = flush(batch_size)
+            self.stdout.write(f"Flushed {flushed} keys")
+        else:
+            run_flusher(interval, batch_size)
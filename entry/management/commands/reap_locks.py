@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from entry.models import Lock, LockReader
+
+
+class Command(BaseCommand):
+    help = "Deletes expired locks and readers in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of locks deleted by a single query",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Keep reaping every INTERVAL seconds instead of exiting",
+        )
+
+    def handle(self, *args, batch_size, interval, **options):
+        while True:
+            deleted = self.reap(batch_size)
+            self.stdout.write(f"Deleted {deleted} expired locks")
+
+            if interval is None:
+                break
+            time.sleep(interval)
+
+    @staticmethod
+    def reap(batch_size: int) -> int:
+        deleted = 0
+        for model in (Lock, LockReader):
+            while True:
+                batch = model.objects.reap(batch_size)
+                deleted += batch
+                if batch < batch_size:
+                    break
+        return deleted
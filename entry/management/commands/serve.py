@@ -0,0 +1,46 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+ASGI_WORKER_CLASS = "uvicorn.workers.UvicornWorker"
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves the project with gunicorn, several worker processes keeping "
+        "their database and redis connections between requests"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--asgi",
+            action="store_true",
+            help="Serve the ASGI application with uvicorn workers, needed by "
+            "the async views",
+        )
+        parser.add_argument("--bind", help="Address to listen on, HOST:PORT")
+        parser.add_argument("--workers", type=int, help="Number of worker processes")
+        parser.add_argument(
+            "--threads",
+            type=int,
+            help="Number of threads of each WSGI worker, each of them keeps a "
+            "database connection",
+        )
+
+    def handle(self, *args, asgi, bind, workers, threads, **options):
+        argv = ["gunicorn", "--config", str(settings.BASE_DIR / "gunicorn.conf.py")]
+        if bind is not None:
+            argv += ["--bind", bind]
+        if workers is not None:
+            argv += ["--workers", str(workers)]
+        if threads is not None:
+            argv += ["--threads", str(threads)]
+        if asgi:
+            argv += ["--worker-class", ASGI_WORKER_CLASS, "smart_lock.asgi:application"]
+        else:
+            argv.append("smart_lock.wsgi:application")
+
+        self.stdout.write(" ".join(argv))
+        self.stdout.flush()
+        os.execvp(argv[0], argv)
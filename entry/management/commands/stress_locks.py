@@ -0,0 +1,122 @@
+import csv
+import logging
+
+from django.core.management.base import BaseCommand
+
+from entry.stress import BACKENDS, StressConfig, run_stress
+
+COLUMNS = (
+    "backend",
+    "contenders",
+    "names",
+    "acquisitions",
+    "timeouts",
+    "throughput",
+    "wait_p50",
+    "wait_p95",
+    "wait_p99",
+    "jain_index",
+    "violations",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Makes threads or processes compete for locks and reports throughput, "
+        "wait percentiles, fairness and violations of mutual exclusion for "
+        "every number of contenders"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backends",
+            nargs="+",
+            choices=list(BACKENDS),
+            default=list(BACKENDS),
+            help="Locks to stress",
+        )
+        parser.add_argument(
+            "--contenders",
+            nargs="+",
+            type=int,
+            default=[1, 10, 50],
+            help="Numbers of contenders to run, one run for each of them",
+        )
+        parser.add_argument(
+            "--names",
+            type=int,
+            default=1,
+            help="Number of lock names the contenders compete for",
+        )
+        parser.add_argument(
+            "--duration", type=float, default=5, help="Seconds every run lasts"
+        )
+        parser.add_argument(
+            "--hold", type=float, default=0.001, help="Seconds every lock is held"
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.01,
+            help="Seconds a contender sleeps between two attempts",
+        )
+        parser.add_argument(
+            "--blocking-timeout",
+            type=float,
+            default=1,
+            help="Seconds a contender waits for a lock before giving up",
+        )
+        parser.add_argument(
+            "--processes",
+            action="store_true",
+            help="Run every contender in a process instead of a thread",
+        )
+        parser.add_argument(
+            "--csv",
+            dest="csv_path",
+            metavar="PATH",
+            help="Write the results to PATH as well",
+        )
+
+    def handle(self, *args, backends, contenders, csv_path, **options):
+        # every failed attempt of the django locks logs a warning
+        logging.getLogger("entry.django_redlock").setLevel(logging.ERROR)
+
+        rows = []
+        self.stdout.write(
+            f"{'backend':<14}{'contenders':>11}{'acq/s':>10}{'p50 ms':>9}"
+            f"{'p95 ms':>9}{'p99 ms':>9}{'jain':>7}{'timeouts':>10}"
+            f"{'violations':>12}"
+        )
+        for backend in backends:
+            for count in contenders:
+                config = StressConfig(
+                    backend=backend,
+                    contenders=count,
+                    names=options["names"],
+                    duration=options["duration"],
+                    hold=options["hold"],
+                    sleep=options["sleep"],
+                    blocking_timeout=options["blocking_timeout"],
+                    processes=options["processes"],
+                )
+                row = run_stress(config)
+                rows.append(row)
+                self.stdout.write(
+                    f"{backend:<14}{count:>11}{row['throughput']:>10.1f}"
+                    f"{row['wait_p50'] * 1000:>9.1f}{row['wait_p95'] * 1000:>9.1f}"
+                    f"{row['wait_p99'] * 1000:>9.1f}{row['jain_index']:>7.3f}"
+                    f"{row['timeouts']:>10}{row['violations']:>12}"
+                )
+
+        if any(row["violations"] for row in rows):
+            self.stderr.write("Mutual exclusion was violated")
+        if csv_path is not None:
+            self.write_csv(csv_path, rows)
+
+    @staticmethod
+    def write_csv(path: str, rows: list):
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
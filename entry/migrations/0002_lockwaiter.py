@@ -0,0 +1,36 @@
+# Generated by Django 4.0.4 on 2026-10-17 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entry", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LockWaiter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=32)),
+                ("token", models.CharField(max_length=32)),
+                ("seen_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="lockwaiter",
+            index=models.Index(
+                fields=["name", "id"], name="entry_lockw_name_182625_idx"
+            ),
+        ),
+    ]
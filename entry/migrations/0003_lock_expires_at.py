@@ -0,0 +1,24 @@
+# Generated by Django 4.0.4 on 2026-10-17 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entry", "0002_lockwaiter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lock",
+            name="expires_at",
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.RunSQL(
+            "UPDATE entry_lock"
+            " SET expires_at = created_at + timeout * INTERVAL '1 second'"
+            " WHERE timeout IS NOT NULL",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.4 on 2026-10-17 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entry", "0003_lock_expires_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LockReader",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=32)),
+                ("token", models.CharField(max_length=32)),
+                ("expires_at", models.DateTimeField(db_index=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="lockreader",
+            index=models.Index(
+                fields=["name", "token"], name="entry_lockr_name_de5205_idx"
+            ),
+        ),
+    ]
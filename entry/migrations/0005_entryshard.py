@@ -0,0 +1,36 @@
+# Generated by Django 4.0.4 on 2026-10-17 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entry", "0004_lockreader"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EntryShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=32)),
+                ("shard", models.PositiveSmallIntegerField()),
+                ("value", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="entryshard",
+            constraint=models.UniqueConstraint(
+                fields=("key", "shard"), name="unique_shard"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.4 on 2026-10-17 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entry", "0005_entryshard"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdvisoryLease",
+            fields=[
+                ("key", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("pid", models.IntegerField()),
+                ("expires_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.RunSQL(
+            "ALTER TABLE entry_advisorylease SET UNLOGGED",
+            "ALTER TABLE entry_advisorylease SET LOGGED",
+        ),
+    ]
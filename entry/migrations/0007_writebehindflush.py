@@ -0,0 +1,23 @@
+# Generated by Django 4.0.4 on 2026-10-17 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entry", "0006_advisorylease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WriteBehindFlush",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=32, primary_key=True, serialize=False),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 4.0.4 on 2026-10-17 06:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entry", "0007_writebehindflush"),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name="AdvisoryLease",
+        ),
+    ]
@@ -1,6 +1,36 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from django.db import models
+from django.db import connection, models
+from django.db.models import Q
+
+
+def expiry(timeout, now=None):
+    """
+    Returns when a lock with ``timeout`` taken at ``now`` expires, None if it
+    never does.
+    """
+    if timeout is None:
+        return None
+    return (now or datetime.now()) + timedelta(seconds=timeout)
+
+
+class LockQuerySet(models.QuerySet):
+    def alive(self):
+        return self.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=datetime.now())
+        )
+
+    def expired(self):
+        return self.filter(expires_at__lte=datetime.now())
+
+    def reap(self, batch_size: int) -> int:
+        """
+        Deletes up to ``batch_size`` expired locks and returns how many were
+        deleted.
+        """
+        batch = self.expired().values("pk")[:batch_size]
+        deleted, _ = self.expired().filter(pk__in=batch).delete()
+        return deleted
 
 
 class Lock(models.Model):
@@ -8,6 +38,14 @@ class Lock(models.Model):
     token = models.CharField(max_length=32)
     created_at = models.DateTimeField(auto_now=True)
     timeout = models.FloatField(null=True)
+    expires_at = models.DateTimeField(null=True, db_index=True)
+
+    objects = LockQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # created_at is refreshed on every save, and the expiry with it
+        self.expires_at = expiry(self.timeout)
+        super().save(*args, **kwargs)
 
     @property
     def elapsed(self) -> float:
@@ -32,16 +70,156 @@ class Lock(models.Model):
 
     @property
     def pttl(self) -> int:
-        elapsed = int(self.elapsed * 1000)
-
-        if self.timeout is None:
+        if self.expires_at is None:
             time_to_live = -1
         else:
-            time_to_live = int(self.timeout * 1000) - elapsed
+            time_to_live = int(
+                (self.expires_at - datetime.now()).total_seconds() * 1000
+            )
 
         return time_to_live
 
 
+class EntryManager(models.Manager):
+    def get_value(self, key: str) -> int:
+        """
+        Returns the value of ``key``, 0 if it was never incremented, without
+        creating the row.
+        """
+        value = self.filter(key=key).values_list("value", flat=True).first()
+        return value or 0
+
+    def increment(self, key: str, delta: int = 1) -> int:
+        """
+        Adds ``delta`` to ``key`` with a single upsert and returns the new value,
+        no lock is needed.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO entry_entry (key, value) VALUES (%s, %s)"
+                " ON CONFLICT (key) DO UPDATE"
+                " SET value = entry_entry.value + EXCLUDED.value"
+                " RETURNING value",
+                [key, delta],
+            )
+            return cursor.fetchone()[0]
+
+    def increment_many(self, counts: dict) -> dict:
+        """
+        Adds every delta in ``counts`` to its key with a single multi-row
+        upsert and returns the new values by key.
+        """
+        if not counts:
+            return {}
+        keys = sorted(counts)
+        values = ", ".join(["(%s, %s)"] * len(keys))
+        params = [param for key in keys for param in (key, counts[key])]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO entry_entry (key, value) VALUES {values}"
+                " ON CONFLICT (key) DO UPDATE"
+                " SET value = entry_entry.value + EXCLUDED.value"
+                " RETURNING key, value",
+                params,
+            )
+            return dict(cursor.fetchall())
+
+
 class Entry(models.Model):
     key = models.CharField(primary_key=True, max_length=32)
     value = models.IntegerField(default=0)
+
+    objects = EntryManager()
+
+
+class LockWaiter(models.Model):
+    """
+    Ticket of a waiter queued for the lock ``name``, tickets are served in
+    ``id`` order.
+    """
+
+    name = models.CharField(max_length=32)
+    token = models.CharField(max_length=32)
+    seen_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["name", "id"])]
+
+
+class LockReader(models.Model):
+    """
+    Reader holding the lock ``name`` in shared mode, writers hold it in
+    ``Lock``.
+    """
+
+    name = models.CharField(max_length=32)
+    token = models.CharField(max_length=32)
+    expires_at = models.DateTimeField(null=True, db_index=True)
+
+    objects = LockQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["name", "token"])]
+
+
+class WriteBehindFlushManager(models.Manager):
+    def record(self, flush_id: str) -> bool:
+        """
+        Records that the flush ``flush_id`` is applied, in the transaction
+        applying it, and returns False if it already was.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO entry_writebehindflush (id, created_at)"
+                " VALUES (%s, now()) ON CONFLICT (id) DO NOTHING RETURNING id",
+                [flush_id],
+            )
+            return cursor.fetchone() is not None
+
+
+class WriteBehindFlush(models.Model):
+    """
+    Batch of write-behind deltas applied to the Entry table, written in the
+    transaction applying them so that a flush interrupted before redis heard
+    of it is not applied twice.
+    """
+
+    id = models.CharField(max_length=32, primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = WriteBehindFlushManager()
+
+
+class EntryShardManager(models.Manager):
+    def get_total(self, key: str) -> int:
+        """
+        Returns the value of ``key`` plus the values of all its shards with one
+        query.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT"
+                " COALESCE((SELECT value FROM entry_entry WHERE key = %s), 0)"
+                " + COALESCE("
+                "(SELECT SUM(value) FROM entry_entryshard WHERE key = %s), 0)",
+                [key, key],
+            )
+            return cursor.fetchone()[0]
+
+
+class EntryShard(models.Model):
+    """
+    Part of the value of the hot entry ``key``, shards are incremented
+    independently.
+    """
+
+    key = models.CharField(max_length=32)
+    shard = models.PositiveSmallIntegerField()
+    value = models.IntegerField(default=0)
+
+    objects = EntryShardManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key", "shard"], name="unique_shard")
+        ]
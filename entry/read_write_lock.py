@@ -0,0 +1,366 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import F
+from django.db.transaction import atomic, set_rollback
+from redis.exceptions import LockError, LockNotOwnedError
+from redis.lock import Lock as RedisLock
+
+from entry.advisory_lock import lock_key
+from entry.django_redlock import DjangoRedlock
+from entry.models import Lock, LockReader, expiry
+from smart_lock.metrics import count_attempt
+
+logger = logging.getLogger(__name__)
+
+
+class DjangoReadWriteLock(DjangoRedlock):
+    """
+    Read-write lock using Django's ORM, readers share the lock while a writer
+    holds it alone
+    """
+
+    def __init__(self, name, *args, shared=False, prefer_writers=True, **kwargs):
+        """
+        Takes the same arguments as ``DjangoRedlock``.
+
+        ``shared`` indicates whether to acquire the lock as a reader, readers
+        are rows of ``LockReader`` and any number of them can hold the lock
+        while no writer does. A writer holds it with a ``Lock`` row, exactly
+        like ``DjangoRedlock``, once no reader is left.
+
+        ``prefer_writers`` indicates whether a waiting writer keeps its
+        ``Lock`` row while the readers drain, so that new readers can not
+        acquire the lock and starve it. Otherwise the writer only takes the
+        row when there are no readers.
+
+        Readers and writers check each other under a PostgreSQL advisory
+        lock, shared for readers, held until the end of the transaction.
+        """
+        super().__init__(name, *args, **kwargs)
+        self.shared = bool(shared)
+        self.prefer_writers = bool(prefer_writers)
+        self.key = lock_key(f"{name}:rw")
+        if self.shared and self.auto_renew:
+            raise LockError("Shared locks do not support auto_renew")
+
+    @property
+    def reentrant_key(self):
+        return type(self), self.name, self.shared
+
+    def acquire(self, blocking=None, blocking_timeout=None, token=None):
+        if token is None:
+            token = uuid.uuid4().hex
+        acquired = super().acquire(blocking, blocking_timeout, token)
+        if not acquired and not self.shared and self.prefer_writers:
+            # give up the claim that kept new readers out
+            Lock.objects.filter(name=self.name, token=token).delete()
+        return acquired
+
+    def do_acquire(self, token):
+        with atomic():
+            mode = "_shared" if self.shared else ""
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT pg_advisory_xact_lock{mode}(%s)", [self.key])
+
+            if self.shared:
+                return self.add_reader(token)
+
+            if not super().do_acquire(token):
+                return False
+            if not LockReader.objects.alive().filter(name=self.name).exists():
+                return True
+            if not self.prefer_writers:
+                set_rollback(True)
+            logger.warning("Lock is shared by readers")
+            return False
+
+    def add_reader(self, token: str) -> bool:
+        if Lock.objects.alive().filter(name=self.name).exists():
+            logger.warning("Lock is taken by a writer")
+            return False
+        LockReader.objects.create(
+            name=self.name, token=token, expires_at=expiry(self.timeout or None)
+        )
+        return True
+
+    def locked(self):
+        """
+        Returns True if this key is locked by a writer or any reader,
+        otherwise False.
+        """
+        return (
+            super().locked()
+            or LockReader.objects.alive().filter(name=self.name).exists()
+        )
+
+    def owned(self):
+        if not self.shared:
+            return super().owned()
+        if self.local.token is None:
+            return False
+        return (
+            LockReader.objects.alive()
+            .filter(name=self.name, token=self.local.token)
+            .exists()
+        )
+
+    def do_release(self, expected_token: str):
+        if not self.shared:
+            return super().do_release(expected_token)
+        deleted, _ = LockReader.objects.filter(
+            name=self.name, token=expected_token
+        ).delete()
+        if not deleted:
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+
+    def do_extend(self, additional_time, replace_ttl):
+        if not self.shared:
+            return super().do_extend(additional_time, replace_ttl)
+        if replace_ttl:
+            expires_at = expiry(additional_time)
+        else:
+            expires_at = F("expires_at") + timedelta(seconds=additional_time)
+        updated = (
+            LockReader.objects.alive()
+            .filter(name=self.name, token=self.local.token)
+            .update(expires_at=expires_at)
+        )
+        if not updated:
+            raise LockNotOwnedError("Cannot extend a lock that's no longer owned")
+        return True
+
+
+# KEYS[2] is a sorted set of the readers scored by the time at which they
+# expire in milliseconds, it expires with the last of them
+SERVER_TIME = """
+local time = redis.call('time')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+
+EXPIRE_READERS = """
+local last = redis.call('zrange', KEYS[2], -1, -1, 'withscores')
+if last[2] == 'inf' then
+    redis.call('persist', KEYS[2])
+elseif last[2] then
+    redis.call('pexpireat', KEYS[2], last[2])
+end
+"""
+
+
+class RedisReadWriteLock(RedisLock):
+    """
+    Read-write version of the redis-py ``Lock``, a writer holds the key
+    ``name`` like ``Lock`` does, readers are members of ``{name}:readers``
+    """
+
+    lua_read_acquire = None
+    lua_write_acquire = None
+    lua_read_release = None
+    lua_read_extend = None
+
+    # KEYS[1] - lock name
+    # KEYS[2] - readers
+    # ARGV[1] - token
+    # ARGV[2] - milliseconds, 0 for no timeout
+    # return 1 if the lock was acquired, otherwise 0
+    LUA_READ_ACQUIRE_SCRIPT = (
+        """
+        if redis.call('exists', KEYS[1]) == 1 then
+            return 0
+        end
+        """
+        + SERVER_TIME
+        + """
+        local expires_at = '+inf'
+        if ARGV[2] ~= '0' then
+            expires_at = now + tonumber(ARGV[2])
+        end
+        redis.call('zadd', KEYS[2], expires_at, ARGV[1])
+        """
+        + EXPIRE_READERS
+        + """
+        return 1
+        """
+    )
+
+    # KEYS[1] - lock name
+    # KEYS[2] - readers
+    # ARGV[1] - token
+    # ARGV[2] - milliseconds, 0 for no timeout
+    # ARGV[3] - "1" if the lock should be claimed while readers drain
+    # return 1 if the lock was acquired, otherwise 0
+    LUA_WRITE_ACQUIRE_SCRIPT = (
+        """
+        local token = redis.call('get', KEYS[1])
+        if token and token ~= ARGV[1] then
+            return 0
+        end
+        """
+        + SERVER_TIME
+        + """
+        redis.call('zremrangebyscore', KEYS[2], '-inf', now)
+        local readers = redis.call('zcard', KEYS[2])
+        if readers > 0 and ARGV[3] == '0' then
+            return 0
+        end
+        if ARGV[2] == '0' then
+            redis.call('set', KEYS[1], ARGV[1])
+        else
+            redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[2])
+        end
+        if readers > 0 then
+            return 0
+        end
+        return 1
+        """
+    )
+
+    # KEYS[1] - lock name
+    # KEYS[2] - readers
+    # ARGV[1] - token
+    # return 1 if the lock was released, otherwise 0
+    LUA_READ_RELEASE_SCRIPT = (
+        """
+        local expires_at = redis.call('zscore', KEYS[2], ARGV[1])
+        if not expires_at then
+            return 0
+        end
+        redis.call('zrem', KEYS[2], ARGV[1])
+        """
+        + SERVER_TIME
+        + """
+        if expires_at ~= 'inf' and tonumber(expires_at) <= now then
+            return 0
+        end
+        return 1
+        """
+    )
+
+    # KEYS[1] - lock name
+    # KEYS[2] - readers
+    # ARGV[1] - token
+    # ARGV[2] - additional milliseconds
+    # ARGV[3] - "0" if the additional time should be added to the lock's
+    #           existing ttl or "1" if the existing ttl should be replaced
+    # return 1 if the locks time was extended, otherwise 0
+    LUA_READ_EXTEND_SCRIPT = (
+        """
+        local expires_at = redis.call('zscore', KEYS[2], ARGV[1])
+        if not expires_at or expires_at == 'inf' then
+            return 0
+        end
+        """
+        + SERVER_TIME
+        + """
+        expires_at = tonumber(expires_at)
+        if expires_at <= now then
+            return 0
+        end
+        if ARGV[3] == '0' then
+            expires_at = expires_at + tonumber(ARGV[2])
+        else
+            expires_at = now + tonumber(ARGV[2])
+        end
+        redis.call('zadd', KEYS[2], 'xx', expires_at, ARGV[1])
+        """
+        + EXPIRE_READERS
+        + """
+        return 1
+        """
+    )
+
+    def __init__(self, redis, name, *args, shared=False, prefer_writers=True, **kwargs):
+        """
+        Takes the same arguments as ``Lock``, ``shared`` and
+        ``prefer_writers`` are the same as ``DjangoReadWriteLock``.
+        """
+        super().__init__(redis, name, *args, **kwargs)
+        self.readers = f"{name}:readers"
+        self.shared = bool(shared)
+        self.prefer_writers = bool(prefer_writers)
+
+    def register_scripts(self):
+        super().register_scripts()
+        cls = self.__class__
+        client = self.redis
+        if cls.lua_read_acquire is None:
+            cls.lua_read_acquire = client.register_script(cls.LUA_READ_ACQUIRE_SCRIPT)
+        if cls.lua_write_acquire is None:
+            cls.lua_write_acquire = client.register_script(cls.LUA_WRITE_ACQUIRE_SCRIPT)
+        if cls.lua_read_release is None:
+            cls.lua_read_release = client.register_script(cls.LUA_READ_RELEASE_SCRIPT)
+        if cls.lua_read_extend is None:
+            cls.lua_read_extend = client.register_script(cls.LUA_READ_EXTEND_SCRIPT)
+
+    def acquire(self, blocking=None, blocking_timeout=None, token=None):
+        if token is None:
+            token = uuid.uuid1().hex.encode()
+        acquired = super().acquire(blocking, blocking_timeout, token)
+        if not acquired and not self.shared and self.prefer_writers:
+            # give up the claim that kept new readers out
+            self.lua_release(keys=[self.name], args=[token], client=self.redis)
+        return acquired
+
+    def do_acquire(self, token):
+        # the attempts are made by the loop of ``Lock.acquire``
+        count_attempt()
+        if self.timeout:
+            # convert to milliseconds
+            timeout = int(self.timeout * 1000)
+        else:
+            timeout = 0
+        keys = [self.name, self.readers]
+        if self.shared:
+            args = [token, timeout]
+            return bool(self.lua_read_acquire(keys=keys, args=args, client=self.redis))
+        args = [token, timeout, self.prefer_writers and "1" or "0"]
+        return bool(self.lua_write_acquire(keys=keys, args=args, client=self.redis))
+
+    def now(self) -> int:
+        seconds, microseconds = self.redis.time()
+        return seconds * 1000 + microseconds // 1000
+
+    def locked(self):
+        """
+        Returns True if this key is locked by a writer or any reader,
+        otherwise False.
+        """
+        return super().locked() or bool(
+            self.redis.zcount(self.readers, f"({self.now()}", "+inf")
+        )
+
+    def owned(self):
+        if not self.shared:
+            return super().owned()
+        if self.local.token is None:
+            return False
+        expires_at = self.redis.zscore(self.readers, self.local.token)
+        return expires_at is not None and expires_at > self.now()
+
+    def do_release(self, expected_token):
+        if not self.shared:
+            return super().do_release(expected_token)
+        if not self.lua_read_release(
+            keys=[self.name, self.readers], args=[expected_token], client=self.redis
+        ):
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+
+    def do_extend(self, additional_time, replace_ttl):
+        if not self.shared:
+            return super().do_extend(additional_time, replace_ttl)
+        additional_time = int(additional_time * 1000)
+        if not self.lua_read_extend(
+            keys=[self.name, self.readers],
+            args=[self.local.token, additional_time, replace_ttl and "1" or "0"],
+            client=self.redis,
+        ):
+            raise LockNotOwnedError("Cannot extend a lock that's no longer owned")
+        return True
+
+    def do_reacquire(self):
+        if not self.shared:
+            return super().do_reacquire()
+        return self.do_extend(self.timeout, replace_ttl=True)
@@ -0,0 +1,304 @@
+import logging
+import threading
+import time as mod_time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
+from types import SimpleNamespace
+
+from django.conf import settings
+from redis import Redis
+from redis.exceptions import LockError, LockNotOwnedError, RedisError
+
+from entry.django_redlock import LockState
+
+logger = logging.getLogger(__name__)
+
+# redlock recommends to account for a drift of 1% of the ttl, plus 2 ms for
+# the precision of the expiration of the keys
+CLOCK_DRIFT_FACTOR = 0.01
+CLOCK_DRIFT_MINIMUM = 0.002
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call('del', KEYS[1])
+"""
+
+EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+local expiration = redis.call('pttl', KEYS[1])
+if ARGV[3] == '0' then
+    expiration = expiration + tonumber(ARGV[2])
+else
+    expiration = tonumber(ARGV[2])
+end
+return redis.call('pexpire', KEYS[1], expiration)
+"""
+
+_executor_lock = threading.Lock()
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.REDLOCK_MAX_WORKERS,
+                thread_name_prefix="redlock",
+            )
+        return _executor
+
+
+@lru_cache(maxsize=None)
+def get_node(url: str) -> Redis:
+    return Redis.from_url(
+        url,
+        socket_timeout=settings.REDLOCK_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDLOCK_SOCKET_TIMEOUT,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_script(node: Redis, source: str):
+    return node.register_script(source)
+
+
+class Redlock:
+    """
+    Redlock algorithm over several independent redis nodes, every node is
+    contacted in parallel
+    """
+
+    def __init__(
+        self,
+        name,
+        timeout=None,
+        sleep=0.1,
+        blocking=True,
+        blocking_timeout=None,
+        thread_local=True,
+        nodes=None,
+    ):
+        """
+        Create a new Lock instance named ``name`` on the redis servers listed
+        by the ``nodes`` urls, by default ``settings.REDLOCK_NODES``.
+
+        The lock is acquired when it is set on a majority of the nodes before
+        ``timeout`` elapses, minus the allowed clock drift. The remaining time
+        is the validity of the lock, it is no longer owned once that elapses.
+        Every other argument is the same as ``DjangoRedlock``.
+        """
+        self.name = name
+        self.timeout = timeout
+        self.sleep = sleep
+        self.blocking = blocking
+        self.blocking_timeout = blocking_timeout
+        self.thread_local = bool(thread_local)
+        self.nodes = [get_node(url) for url in (nodes or settings.REDLOCK_NODES)]
+        self.quorum = len(self.nodes) // 2 + 1
+        self.local = (LockState if self.thread_local else SimpleNamespace)(
+            token=None, valid_until=None, pending=[]
+        )
+
+    def __enter__(self):
+        if self.acquire():
+            return self
+        raise LockError("Unable to acquire lock within the time specified")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def on_nodes(self, function, *args) -> list:
+        """
+        Runs ``function`` on every node concurrently and returns the futures.
+        """
+        return [get_executor().submit(function, node, *args) for node in self.nodes]
+
+    def count(self, futures: list, quorum=None) -> int:
+        """
+        Returns on how many nodes ``futures`` succeeded. When ``quorum`` is
+        given, it returns as soon as the outcome is known instead of waiting
+        for the slowest node.
+        """
+        succeeded = failed = 0
+        for future in as_completed(futures):
+            try:
+                success = future.result()
+            except RedisError:
+                logger.warning("Redis node is not available", exc_info=True)
+                success = False
+            if success:
+                succeeded += 1
+            else:
+                failed += 1
+            if quorum is not None and (
+                succeeded >= quorum or failed > len(self.nodes) - quorum
+            ):
+                break
+        return succeeded
+
+    def validity(self, elapsed: float):
+        if not self.timeout:
+            return None
+        drift = self.timeout * CLOCK_DRIFT_FACTOR + CLOCK_DRIFT_MINIMUM
+        return self.timeout - elapsed - drift
+
+    def acquire(self, blocking=None, blocking_timeout=None, token=None):
+        """
+        Use a majority of the redis nodes to hold a shared, distributed lock
+        named ``name``. Returns True once the lock is acquired.
+
+        If ``blocking`` is False, always return immediately. If the lock
+        was acquired, return True, otherwise return False.
+
+        ``blocking_timeout`` specifies the maximum number of seconds to
+        wait trying to acquire the lock.
+
+        ``token`` specifies the token value to be used. If a token isn't
+        specified, a UUID will be generated.
+        """
+        sleep = self.sleep
+        if token is None:
+            token = uuid.uuid4().hex
+        if blocking is None:
+            blocking = self.blocking
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        stop_trying_at = None
+        if blocking_timeout is not None:
+            stop_trying_at = mod_time.monotonic() + blocking_timeout
+        while True:
+            if self.do_acquire(token):
+                self.local.token = token
+                return True
+            if not blocking:
+                return False
+            next_try_at = mod_time.monotonic() + sleep
+            if stop_trying_at is not None and next_try_at > stop_trying_at:
+                return False
+            mod_time.sleep(sleep)
+
+    def do_acquire(self, token):
+        if self.timeout:
+            # convert to milliseconds
+            timeout = int(self.timeout * 1000)
+        else:
+            timeout = None
+
+        start = mod_time.monotonic()
+        futures = self.on_nodes(
+            lambda node: node.set(self.name, token, nx=True, px=timeout)
+        )
+        acquired = self.count(futures, quorum=self.quorum)
+        validity = self.validity(mod_time.monotonic() - start)
+
+        if acquired >= self.quorum and (validity is None or validity > 0):
+            self.local.valid_until = validity and start + validity
+            # the slowest nodes may still be setting the key
+            self.local.pending = futures
+            return True
+
+        # free the nodes we got, even those that answer after the outcome
+        wait(futures)
+        self.count(self.on_nodes(self.unlock, token))
+        return False
+
+    def unlock(self, node: Redis, token: str) -> bool:
+        return bool(get_script(node, RELEASE_SCRIPT)(keys=[self.name], args=[token]))
+
+    def locked(self):
+        """
+        Returns True if this key is locked on a majority of the nodes,
+        otherwise False.
+        """
+        locked = self.count(self.on_nodes(lambda node: node.exists(self.name)))
+        return locked >= self.quorum
+
+    def owned(self):
+        """
+        Returns True if this key is locked by this lock and its validity did
+        not elapse, otherwise False.
+        """
+        token = self.local.token
+        if token is None:
+            return False
+        valid_until = self.local.valid_until
+        if valid_until is not None and valid_until <= mod_time.monotonic():
+            return False
+        futures = self.on_nodes(lambda node: node.get(self.name) == token.encode())
+        return self.count(futures, quorum=self.quorum) >= self.quorum
+
+    def release(self):
+        "Releases the already acquired lock"
+        expected_token = self.local.token
+        if expected_token is None:
+            raise LockError("Cannot release an unlocked lock")
+        self.local.token = None
+        self.local.valid_until = None
+        self.do_release(expected_token)
+
+    def do_release(self, expected_token: str):
+        wait(self.local.pending)
+        self.local.pending = []
+        if self.count(self.on_nodes(self.unlock, expected_token)) < self.quorum:
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+
+    def extend(self, additional_time, replace_ttl=False):
+        """
+        Adds more time to an already acquired lock.
+
+        ``additional_time`` can be specified as an integer or a float, both
+        representing the number of seconds to add.
+
+        ``replace_ttl`` if False (the default), add `additional_time` to
+        the lock's existing ttl. If True, replace the lock's ttl with
+        `additional_time`.
+        """
+        if self.local.token is None:
+            raise LockError("Cannot extend an unlocked lock")
+        if self.timeout is None:
+            raise LockError("Cannot extend a lock with no timeout")
+        return self.do_extend(additional_time, replace_ttl)
+
+    def do_extend(self, additional_time, replace_ttl):
+        token = self.local.token
+        args = [token, int(additional_time * 1000), int(replace_ttl)]
+
+        wait(self.local.pending)
+        start = mod_time.monotonic()
+        extended = self.count(
+            self.on_nodes(
+                lambda node: get_script(node, EXTEND_SCRIPT)(
+                    keys=[self.name], args=args
+                )
+            )
+        )
+        if extended < self.quorum:
+            raise LockNotOwnedError("Cannot extend a lock that's no longer owned")
+
+        # the nodes extended the key after ``start``, the time they took only
+        # shortens the validity
+        if replace_ttl:
+            drift = additional_time * CLOCK_DRIFT_FACTOR + CLOCK_DRIFT_MINIMUM
+            self.local.valid_until = start + additional_time - drift
+        else:
+            self.local.valid_until += additional_time
+        return True
+
+    def reacquire(self):
+        """
+        Resets a TTL of an already acquired lock back to a timeout value.
+        """
+        if self.local.token is None:
+            raise LockError("Cannot reacquire an unlocked lock")
+        if self.timeout is None:
+            raise LockError("Cannot reacquire a lock with no timeout")
+        return self.do_reacquire()
+
+    def do_reacquire(self):
+        return self.do_extend(self.timeout, replace_ttl=True)
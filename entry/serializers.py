@@ -1,4 +1,4 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import CharField, ListField, ModelSerializer, Serializer
 
 from entry.models import Entry
 
@@ -7,3 +7,7 @@ class EntrySerializer(ModelSerializer):
     class Meta:
         model = Entry
         fields = ("key",)
+
+
+class BatchIncrementSerializer(Serializer):
+    keys = ListField(child=CharField(max_length=32), allow_empty=False)
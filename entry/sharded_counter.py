@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from entry.django_redlock import DjangoRedlock
+from entry.models import Entry, EntryShard
+from entry.value_cache import entry_values
+
+logger = logging.getLogger(__name__)
+
+# a hot key is split in ``shards-{key}`` shards, ``contention-{key}`` counts
+# how many increments found its lock taken in the last window
+
+
+def shard_count(key: str) -> int:
+    """
+    Returns in how many shards ``key`` is split, 1 if it is not sharded.
+    """
+    return cache.get(f"shards-{key}") or 1
+
+
+def record_contention(key: str):
+    """
+    Counts an increment of ``key`` that found its lock taken, and shards the
+    key once ``SHARDED_COUNTER_THRESHOLD`` of them happen within
+    ``SHARDED_COUNTER_WINDOW`` seconds.
+    """
+    contention_key = cache.make_key(f"contention-{key}")
+    pipeline = get_redis_connection("default").pipeline()
+    # the window starts with the first contention
+    pipeline.set(contention_key, 0, ex=settings.SHARDED_COUNTER_WINDOW, nx=True)
+    pipeline.incr(contention_key)
+    _, contended = pipeline.execute()
+    if contended >= settings.SHARDED_COUNTER_THRESHOLD:
+        if shard_count(key) == 1:
+            logger.info("Key %s is hot, sharding it", key)
+        cache.set(
+            f"shards-{key}",
+            settings.SHARDED_COUNTER_SHARDS,
+            timeout=settings.SHARDED_COUNTER_TTL,
+        )
+
+
+def lock_name(key: str, shard: int) -> str:
+    """
+    Returns the name of the lock of a shard, hashed when it does not fit in
+    the lock table.
+    """
+    name = f"{key}:{shard}"
+    if len(name) > 32:
+        name = hashlib.blake2b(name.encode(), digest_size=16).hexdigest()
+    return name
+
+
+def try_locks(targets: list):
+    """
+    Acquires the lock of the first free target among ``targets``, pairs of a
+    shard and the name of its lock, and returns it with its shard.
+    """
+    for shard, name in targets:
+        lock = DjangoRedlock(name, timeout=1, upsert=True)
+        if lock.acquire(blocking=False):
+            return lock, shard
+    return None, None
+
+
+def increment(key: str) -> int:
+    """
+    Increments ``key``, or a random free shard of it once it is hot, under the
+    lock of what is incremented and returns the value of the key.
+    """
+    shards = shard_count(key)
+    if shards == 1:
+        targets = [(None, key)]
+    else:
+        shuffled = random.sample(range(shards), shards)
+        targets = [(shard, lock_name(key, shard)) for shard in shuffled]
+
+    lock, shard = try_locks(targets)
+    if lock is None:
+        # every lock is taken, wait for one of them
+        record_contention(key)
+        shard, name = targets[0]
+        lock = DjangoRedlock(name, timeout=1, upsert=True)
+        if not lock.acquire():
+            raise LockError("Unable to acquire lock within the time specified")
+
+    try:
+        if shard is None:
+            entry, created = Entry.objects.get_or_create(key=key)
+        else:
+            entry, created = EntryShard.objects.get_or_create(key=key, shard=shard)
+        entry.value += 1
+        entry.save(update_fields=["value"])
+    finally:
+        lock.release()
+    if shard is None:
+        # the cached views read the entry under another lock
+        entry_values.delete_many([key])
+
+    return get_value(key)
+
+
+def get_value(key: str) -> int:
+    """
+    Returns the value of ``key``, the sum of the entry and all its shards.
+    """
+    return EntryShard.objects.get_total(key)
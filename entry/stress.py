@@ -0,0 +1,149 @@
+import multiprocessing
+import random
+import time as mod_time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.core.cache import cache
+from django.db import connection, connections
+from django_redis import get_redis_connection
+
+from entry.benchmark import percentile
+from entry.django_redlock import DjangoRedlock
+
+BACKENDS = {
+    "django": DjangoRedlock,
+    "django-upsert": lambda name, **kwargs: DjangoRedlock(name, upsert=True, **kwargs),
+    "redis": lambda name, **kwargs: cache.lock(f"lock-{name}", **kwargs),
+}
+
+_counters = None
+
+
+@dataclass
+class StressConfig:
+    backend: str
+    contenders: int
+    names: int = 1
+    duration: float = 5
+    hold: float = 0.001
+    sleep: float = 0.01
+    timeout: float = 10
+    blocking_timeout: float = 1
+    processes: bool = False
+
+
+@dataclass
+class ContenderResult:
+    acquisitions: int = 0
+    timeouts: int = 0
+    waits: list = field(default_factory=list)
+
+
+def jain_index(values: list) -> float:
+    """
+    Returns Jain's fairness index of ``values``, 1 when they are all the same
+    and 1 / n when one of the n values has everything.
+    """
+    squares = sum(value * value for value in values)
+    if not squares:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+def contend(config: StressConfig, counters, start_at: float) -> ContenderResult:
+    """
+    Acquires locks of random names until ``config.duration`` is over. Every
+    hold reads the counter of its name, sleeps for ``config.hold`` and writes
+    it back incremented, an increment is lost whenever two contenders hold
+    the same name at once.
+    """
+    result = ContenderResult()
+    get_lock = BACKENDS[config.backend]
+    stop_at = start_at + config.duration
+    mod_time.sleep(max(start_at - mod_time.time(), 0))
+    try:
+        while mod_time.time() < stop_at:
+            index = random.randrange(config.names)
+            lock = get_lock(
+                f"stress-{index}",
+                timeout=config.timeout,
+                sleep=config.sleep,
+                blocking_timeout=config.blocking_timeout,
+            )
+            started_at = mod_time.perf_counter()
+            acquired = lock.acquire()
+            result.waits.append(mod_time.perf_counter() - started_at)
+            if not acquired:
+                result.timeouts += 1
+                continue
+            try:
+                value = counters[index]
+                mod_time.sleep(config.hold)
+                counters[index] = value + 1
+                result.acquisitions += 1
+            finally:
+                lock.release()
+    finally:
+        connection.close()
+    return result
+
+
+def init_process(counters):
+    # shared memory is only inherited, it can not be sent to the processes
+    global _counters
+    _counters = counters
+
+
+def contend_in_process(args) -> ContenderResult:
+    config, start_at = args
+    return contend(config, _counters, start_at)
+
+
+def run_stress(config: StressConfig) -> dict:
+    """
+    Runs ``config.contenders`` threads, or processes, competing for the locks
+    and returns the throughput, wait percentiles, fairness and violations of
+    mutual exclusion.
+    """
+    # shared by the processes too, nothing guards it but the locks
+    counters = multiprocessing.Array("q", config.names, lock=False)
+    # every contender starts at the same time, not while others are spawned
+    start_at = mod_time.time() + 0.5 + 0.01 * config.contenders
+    if config.processes:
+        # forked processes must not share the connections of this one
+        connections.close_all()
+        get_redis_connection("default").connection_pool.disconnect()
+        context = multiprocessing.get_context("fork")
+        with context.Pool(
+            config.contenders, initializer=init_process, initargs=(counters,)
+        ) as pool:
+            results = pool.map(
+                contend_in_process, [(config, start_at)] * config.contenders
+            )
+    else:
+        with ThreadPoolExecutor(config.contenders) as executor:
+            results = list(
+                executor.map(
+                    contend,
+                    [config] * config.contenders,
+                    [counters] * config.contenders,
+                    [start_at] * config.contenders,
+                )
+            )
+
+    acquisitions = sum(result.acquisitions for result in results)
+    waits = sorted(wait for result in results for wait in result.waits)
+    return {
+        "backend": config.backend,
+        "contenders": config.contenders,
+        "names": config.names,
+        "acquisitions": acquisitions,
+        "timeouts": sum(result.timeouts for result in results),
+        "throughput": acquisitions / config.duration,
+        "wait_p50": percentile(waits, 0.5) if waits else 0.0,
+        "wait_p95": percentile(waits, 0.95) if waits else 0.0,
+        "wait_p99": percentile(waits, 0.99) if waits else 0.0,
+        "jain_index": jain_index([result.acquisitions for result in results]),
+        "violations": acquisitions - sum(counters),
+    }
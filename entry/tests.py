@@ -1,11 +1,78 @@
+import asyncio
+import gc
+import shutil
+import socket
+import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from functools import partial
+from io import StringIO
+from unittest.mock import patch
 
 import pytest
-from redis.exceptions import LockError, LockNotOwnedError
-from rest_framework.status import HTTP_200_OK
-
-from entry.django_redlock import DjangoRedlock
-from entry.models import Lock
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.db.transaction import atomic
+from django_redis import get_redis_connection
+from redis import Redis
+from redis.exceptions import LockError, LockNotOwnedError, RedisError
+from rest_framework.status import (
+    HTTP_200_OK,
+    HTTP_400_BAD_REQUEST,
+    HTTP_404_NOT_FOUND,
+    HTTP_408_REQUEST_TIMEOUT,
+)
+
+from entry import sharded_counter, write_behind
+from entry.advisory_lock import DjangoAdvisoryLock, lock_key
+from entry.backends import (
+    AdvisoryLockBackend,
+    BaseLockBackend,
+    DjangoLockBackend,
+    InvalidLockBackend,
+    RedisLockBackend,
+    _backend_classes,
+    get_lock_backend,
+)
+from entry.benchmark import (
+    capture_redis_commands,
+    find_regressions,
+    percentile,
+    summarize,
+)
+from entry.cache import (
+    LOCKED_GET_SCRIPT,
+    LOCKED_INCR_SCRIPT,
+    read_write_lock,
+    run_unlocked,
+)
+from entry.django_redlock import (
+    AsyncDjangoRedlock,
+    DjangoMultiLock,
+    DjangoRedlock,
+    reentrant_holds,
+)
+from entry.instrumented_lock import InstrumentedLock
+from entry.lease_watchdog import Lease, watchdog
+from entry.local_lock import TwoTierLock, _local_locks, get_local_lock
+from entry.models import (
+    Entry,
+    EntryShard,
+    Lock,
+    LockReader,
+    LockWaiter,
+    WriteBehindFlush,
+)
+from entry.read_write_lock import DjangoReadWriteLock
+from entry.redlock import Redlock
+from entry.stress import BACKENDS, StressConfig, jain_index, run_stress
+from entry.value_cache import LocalCache, entry_values
+from entry.views import DjangoEntryDjangoLockBatchView
+from smart_lock.metrics import registry, view_label
 
 
 @pytest.mark.django_db
@@ -34,6 +101,19 @@ class TestLock:
         lock = self.get_lock("foo", thread_local=False)
         self._test_lock_token(lock)
 
+    @pytest.mark.parametrize("options", [{}, {"reentrant": True}, {"auto_renew": True}])
+    def test_lock_shared_between_threads(self, options):
+        lock = self.get_lock("foo", timeout=5, **options)
+
+        def acquire_and_release():
+            assert lock.acquire(blocking=False)
+            assert lock.owned()
+            lock.release()
+            return lock.locked()
+
+        assert run_in_thread(acquire_and_release) is False
+        assert lock.local.token is None
+
     def _test_lock_token(self, lock: DjangoRedlock):
         assert lock.acquire(blocking=False, token="test")
 
@@ -92,6 +172,57 @@ class TestLock:
         assert 8 < db_lock.ttl <= 10
         lock.release()
 
+    def test_timeout_sets_expires_at(self):
+        lock = self.get_lock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+
+        db_lock = Lock.objects.get(name="foo")
+        lifetime = db_lock.expires_at - db_lock.created_at
+        assert timedelta(seconds=9) < lifetime <= timedelta(seconds=10)
+        lock.release()
+
+    def test_acquire_takes_over_expired_lock(self):
+        Lock.objects.create(name="foo", token="bar", timeout=10)
+        Lock.objects.filter(name="foo").update(
+            expires_at=datetime.now() - timedelta(seconds=1)
+        )
+
+        lock = self.get_lock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+        assert lock.owned() is True
+        assert 8 < Lock.objects.get(name="foo").ttl <= 10
+        lock.release()
+
+    def test_taking_over_expired_lock_is_counted_as_steal(self):
+        Lock.objects.create(name="foo", token="bar", timeout=10)
+        Lock.objects.filter(name="foo").update(
+            expires_at=datetime.now() - timedelta(seconds=1)
+        )
+
+        lock = self.get_lock("foo", timeout=10)
+        with view_label("FooView"):
+            assert lock.acquire(blocking=False)
+
+        assert registry.total("lock_steals_total", view="FooView") == 1
+        lock.release()
+
+    def test_renewing_lock_is_not_counted_as_steal(self):
+        lock = self.get_lock("foo", timeout=10)
+        assert lock.acquire(blocking=False, token="bar")
+        assert self.get_lock("foo", timeout=10).acquire(blocking=False, token="bar")
+
+        assert registry.total("lock_steals_total") == 0
+        lock.release()
+
+    def test_expired_lock_is_not_owned(self):
+        lock = self.get_lock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+        Lock.objects.filter(name="foo").update(
+            expires_at=datetime.now() - timedelta(seconds=1)
+        )
+
+        assert lock.owned() is False
+
     def test_float_timeout(self):
         lock = self.get_lock("foo", timeout=9.5)
         assert lock.acquire(blocking=False)
@@ -253,76 +384,2240 @@ class TestLock:
         with pytest.raises(LockNotOwnedError):
             lock.reacquire()
 
+    def test_not_reentrant_by_default(self):
+        lock = self.get_lock("foo")
+        assert lock.acquire(blocking=False)
+        assert not lock.acquire(blocking=False)
+        lock.release()
+
+    def test_reentrant(self, django_assert_num_queries):
+        lock = self.get_lock("foo", reentrant=True)
+        other = self.get_lock("foo", reentrant=True)
+        assert lock.acquire(blocking=False)
+
+        with django_assert_num_queries(0):
+            assert lock.acquire(blocking=False)
+            assert other.acquire(blocking=False)
+            assert other.local.token == lock.local.token
+            other.release()
+            lock.release()
+
+        assert lock.owned()
+        assert other.local.token is None
+        lock.release()
+        assert not Lock.objects.filter(name="foo").exists()
+        assert reentrant_holds() == {}
+
+    def test_reentrant_context_manager(self):
+        lock = self.get_lock("foo", reentrant=True)
+        with lock:
+            with lock:
+                assert lock.owned()
+            assert lock.owned()
+        assert not lock.locked()
+
+    def test_reentrant_holds_are_per_thread(self):
+        lock = self.get_lock("foo", reentrant=True)
+        assert lock.acquire(blocking=False)
+        assert run_in_thread(reentrant_holds) == {}
+        lock.release()
+
 
 @pytest.mark.django_db
-class TestViews:
-    @pytest.mark.parametrize(
-        "entry, lock",
-        [
-            ("django", "django"),
-            ("django", "redis"),
-            ("redis", "django"),
-            ("redis", "redis"),
-        ],
-    )
-    def test_get_entry_no_entry_exists(self, client, entry: str, lock: str):
-        key = "test"
-        response = client.get(f"/entry/{entry}/{lock}/lock/{key}/")
+class TestUpsertLock(TestLock):
+    def get_lock(self, *args, **kwargs):
+        return DjangoRedlock(*args, upsert=True, **kwargs)
 
-        assert response.status_code == HTTP_200_OK
+    def test_acquire_is_a_single_query(self, django_assert_num_queries):
+        lock1 = self.get_lock("foo", timeout=10)
+        lock2 = self.get_lock("foo", timeout=10)
 
-        assert response.json() == {"key": "test", "value": 0}
+        with django_assert_num_queries(1):
+            assert lock1.acquire(blocking=False)
 
-    @pytest.mark.parametrize(
-        "entry, lock",
-        [
-            ("django", "django"),
-            ("django", "redis"),
-            ("redis", "django"),
-            ("redis", "redis"),
-        ],
-    )
-    def test_increment_entry(self, client, entry: str, lock: str):
-        key = "test"
+        with django_assert_num_queries(1):
+            assert not lock2.acquire(blocking=False)
 
-        response = client.post(f"/entry/{entry}/{lock}/lock/{key}/")
+        lock1.release()
 
-        assert response.status_code == HTTP_200_OK
+    def test_acquire_steals_expired_lock(self):
+        Lock.objects.create(name="foo", token="bar", timeout=10)
+        Lock.objects.filter(name="foo").update(
+            expires_at=datetime.now() - timedelta(seconds=1)
+        )
 
-        assert response.json() == {"key": "test", "value": 1}
+        lock = self.get_lock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
 
-        response = client.get(f"/entry/{entry}/{lock}/lock/{key}/")
+        db_lock = Lock.objects.get(name="foo")
+        assert db_lock.token == lock.local.token
+        assert 8 < db_lock.ttl <= 10
+        lock.release()
 
-        assert response.status_code == HTTP_200_OK
+    def test_acquire_renews_same_token(self):
+        lock = self.get_lock("foo", timeout=10)
+        assert lock.acquire(blocking=False, token="test")
 
-        assert response.json() == {"key": "test", "value": 1}
+        Lock.objects.filter(name="foo").update(timeout=5)
 
-    @pytest.mark.parametrize(
-        "entry, lock",
-        [
-            ("django", "django"),
-            ("django", "redis"),
-            ("redis", "django"),
-            ("redis", "redis"),
-        ],
-    )
-    def test_increment_entry_twice(self, client, entry: str, lock: str):
-        key = "test"
+        assert lock.acquire(blocking=False, token="test")
+        db_lock = Lock.objects.get(name="foo")
+        assert 8 < db_lock.ttl <= 10
+        lock.release()
 
-        response = client.post(f"/entry/{entry}/{lock}/lock/{key}/")
 
-        assert response.status_code == HTTP_200_OK
+def run_in_thread(function):
+    """
+    Runs ``function`` in another thread, and so with another database session.
+    """
+    result = {}
 
-        assert response.json() == {"key": "test", "value": 1}
+    def target():
+        try:
+            result["value"] = function()
+        except Exception as e:
+            result["error"] = e
+        finally:
+            connections.close_all()
 
-        response = client.post(f"/entry/{entry}/{lock}/lock/{key}/")
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
 
-        assert response.status_code == HTTP_200_OK
 
-        assert response.json() == {"key": "test", "value": 2}
+@pytest.mark.django_db
+class TestAdvisoryLock:
+    def get_lock(self, *args, **kwargs):
+        return DjangoAdvisoryLock(*args, **kwargs)
 
-        response = client.get(f"/entry/{entry}/{lock}/lock/{key}/")
+    def test_lock(self):
+        lock = self.get_lock("foo")
+        assert lock.acquire(blocking=False)
+        assert lock.locked() is True
+        assert not Lock.objects.exists()
+        lock.release()
+        assert lock.locked() is False
+        assert lock.local.token is None
 
-        assert response.status_code == HTTP_200_OK
+    def test_lock_key_is_stable(self):
+        assert lock_key("foo") == lock_key("foo")
+        assert lock_key("foo") != lock_key("bar")
+        assert -(2**63) <= lock_key("foo") < 2**63
 
-        assert response.json() == {"key": "test", "value": 2}
+    def test_owned(self):
+        lock = self.get_lock("foo")
+        assert lock.owned() is False
+        lock.acquire(blocking=False)
+        assert lock.owned() is True
+        lock.release()
+        assert lock.owned() is False
+
+    def test_competing_locks(self):
+        lock1 = self.get_lock("foo")
+        lock2 = self.get_lock("foo")
+        assert lock1.acquire(blocking=False)
+        assert not lock2.acquire(blocking=False)
+        lock1.release()
+        assert lock2.acquire(blocking=False)
+        assert not lock1.acquire(blocking=False)
+        lock2.release()
+
+    def test_competing_sessions(self):
+        lock = self.get_lock("foo")
+        assert lock.acquire(blocking=False)
+        assert not run_in_thread(lambda: self.get_lock("foo").acquire(blocking=False))
+        assert run_in_thread(lambda: self.get_lock("foo").locked())
+        lock.release()
+        assert run_in_thread(lambda: self.get_lock("foo").acquire(blocking=False))
+
+    def test_blocking_timeout(self):
+        lock1 = self.get_lock("foo")
+        assert lock1.acquire(blocking=False)
+        bt = 0.4
+        sleep = 0.1
+        lock2 = self.get_lock("foo", sleep=sleep, blocking_timeout=bt)
+        start = time.monotonic()
+        assert not lock2.acquire()
+        assert bt > (time.monotonic() - start) > bt - sleep
+        lock1.release()
+
+    def test_context_manager(self):
+        with self.get_lock("foo", blocking_timeout=0.2) as lock:
+            assert lock.owned()
+
+        assert lock.locked() is False
+
+    def test_timeout_expires_lock(self):
+        lock1 = self.get_lock("foo", timeout=0.1)
+        assert lock1.acquire(blocking=False)
+        time.sleep(0.15)
+        assert lock1.owned() is False
+
+        lock2 = self.get_lock("foo", timeout=10)
+        assert lock2.acquire(blocking=False)
+        with pytest.raises(LockNotOwnedError):
+            lock1.release()
+        lock2.release()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_expired_lock_of_other_session_is_held_until_it_ends(self):
+        acquired = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            lock = self.get_lock("foo", timeout=0.1)
+            assert lock.acquire(blocking=False)
+            acquired.set()
+            # a hung holder, it never touches the lock again before it expired
+            done.wait(5)
+            return True
+
+        with ThreadPoolExecutor(1) as executor:
+            holder = executor.submit(run_in_thread, hold)
+            assert acquired.wait(5)
+            lock = self.get_lock("foo", timeout=10, sleep=0.05, blocking_timeout=0.3)
+            assert not lock.acquire()
+            done.set()
+            # the holder's connection is closed once it returns
+            assert holder.result()
+
+        assert lock.acquire(blocking=False)
+        lock.release()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_unexpired_lock_of_other_session_is_kept(self):
+        acquired = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            lock = self.get_lock("foo", timeout=10)
+            assert lock.acquire(blocking=False)
+            acquired.set()
+            done.wait(5)
+            return lock.owned()
+
+        with ThreadPoolExecutor(1) as executor:
+            holder = executor.submit(run_in_thread, hold)
+            assert acquired.wait(5)
+            lock = self.get_lock("foo", sleep=0.05, blocking_timeout=0.2)
+            assert not lock.acquire()
+            done.set()
+            assert holder.result() is True
+
+    def test_releasing_unlocked_lock_raises_error(self):
+        lock = self.get_lock("foo")
+        with pytest.raises(LockError):
+            lock.release()
+
+    def test_extend_lock(self):
+        lock = self.get_lock("foo", timeout=0.1)
+        assert lock.acquire(blocking=False)
+        assert lock.extend(10)
+        time.sleep(0.15)
+        assert lock.owned() is True
+        lock.release()
+
+    def test_reacquire_lock(self):
+        lock = self.get_lock("foo", timeout=0.1)
+        assert lock.acquire(blocking=False)
+        time.sleep(0.05)
+        assert lock.reacquire()
+        time.sleep(0.07)
+        assert lock.owned() is True
+        lock.release()
+
+    def test_extending_expired_lock_raises_error(self):
+        lock = self.get_lock("foo", timeout=0.1)
+        assert lock.acquire(blocking=False)
+        time.sleep(0.15)
+        with pytest.raises(LockNotOwnedError):
+            lock.extend(10)
+
+    def test_transaction_lock(self):
+        with atomic():
+            lock = self.get_lock("foo", transaction=True)
+            assert lock.acquire()
+            assert lock.owned() is True
+            assert run_in_thread(lambda: self.get_lock("foo").locked())
+            lock.release()
+            assert lock.owned() is False
+            # transaction level locks are held until the transaction ends
+            assert lock.locked() is True
+
+    @pytest.mark.django_db(transaction=True)
+    def test_transaction_lock_released_on_commit(self):
+        with atomic():
+            assert self.get_lock("foo", transaction=True).acquire(blocking=False)
+            assert not run_in_thread(
+                lambda: self.get_lock("foo").acquire(blocking=False)
+            )
+
+        assert self.get_lock("foo").locked() is False
+
+    @pytest.mark.django_db(transaction=True)
+    def test_transaction_lock_needs_atomic_block(self):
+        lock = self.get_lock("foo", transaction=True)
+        with pytest.raises(LockError):
+            lock.acquire(blocking=False)
+
+    def test_transaction_lock_with_timeout_raises_error(self):
+        with pytest.raises(LockError):
+            self.get_lock("foo", transaction=True, timeout=1)
+
+
+@pytest.mark.django_db
+class TestNotifyLock(TestLock):
+    def get_lock(self, *args, **kwargs):
+        return DjangoRedlock(*args, notify=True, **kwargs)
+
+    @pytest.mark.django_db(transaction=True)
+    def test_waiter_wakes_up_on_release(self):
+        # released by another thread
+        lock = self.get_lock("foo", thread_local=False)
+        assert lock.acquire(blocking=False)
+
+        def wait_for_lock():
+            waiter = self.get_lock("foo", sleep=5, blocking_timeout=10)
+            start = time.monotonic()
+            assert waiter.acquire()
+            waiter.release()
+            return time.monotonic() - start
+
+        timer = threading.Timer(0.2, run_in_thread, [lock.release])
+        timer.start()
+        elapsed = run_in_thread(wait_for_lock)
+        timer.join()
+
+        # woken up by the notification, long before the 5 seconds of sleep
+        assert 0.2 <= elapsed < 2
+
+    def test_channel_is_an_identifier(self):
+        lock = self.get_lock('foo "bar"')
+        assert lock.channel.isidentifier()
+        assert lock.channel != self.get_lock("foo").channel
+
+
+@pytest.mark.django_db
+class TestFairLock(TestLock):
+    def get_lock(self, *args, **kwargs):
+        return DjangoRedlock(*args, fair=True, **kwargs)
+
+    def test_waiter_ahead_blocks_newcomer(self):
+        LockWaiter.objects.create(name="foo", token="bar")
+
+        lock = self.get_lock("foo")
+        assert not lock.acquire(blocking=False)
+        assert not lock.acquire(blocking_timeout=0.2)
+        assert LockWaiter.objects.filter(name="foo").count() == 1
+
+    def test_abandoned_waiter_is_skipped(self):
+        waiter = LockWaiter.objects.create(name="foo", token="bar")
+        LockWaiter.objects.filter(pk=waiter.pk).update(
+            seen_at=datetime.now() - timedelta(seconds=60)
+        )
+
+        lock = self.get_lock("foo")
+        assert lock.acquire(blocking=False)
+        lock.release()
+
+    def test_ticket_is_removed(self):
+        lock = self.get_lock("foo")
+        assert lock.acquire(blocking_timeout=0.2)
+        assert not LockWaiter.objects.exists()
+        lock.release()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_lock_is_granted_in_ticket_order(self):
+        holder = self.get_lock("foo", thread_local=False)
+        assert holder.acquire(blocking=False)
+        order = []
+
+        def wait_for_lock(name):
+            lock = self.get_lock("foo", sleep=0.05, blocking_timeout=5)
+            assert lock.acquire()
+            order.append(name)
+            lock.release()
+
+        threads = []
+        for name in ["first", "second", "third"]:
+            thread = threading.Thread(
+                target=run_in_thread, args=[lambda n=name: wait_for_lock(n)]
+            )
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.2)
+
+        run_in_thread(holder.release)
+        for thread in threads:
+            thread.join()
+
+        assert order == ["first", "second", "third"]
+
+
+@pytest.mark.django_db
+class TestReadWriteLock:
+    def get_lock(self, *args, **kwargs):
+        return DjangoReadWriteLock(*args, **kwargs)
+
+    def test_readers_share_the_lock(self):
+        reader1 = self.get_lock("foo", timeout=10, shared=True)
+        reader2 = self.get_lock("foo", timeout=10, shared=True)
+        writer = self.get_lock("foo", timeout=10)
+
+        assert reader1.acquire(blocking=False)
+        assert reader2.acquire(blocking=False)
+        assert reader1.owned()
+        assert reader2.locked()
+        assert LockReader.objects.filter(name="foo").count() == 2
+
+        assert not writer.acquire(blocking=False)
+        assert writer.locked()
+
+        reader1.release()
+        assert not writer.acquire(blocking=False)
+        reader2.release()
+        assert not LockReader.objects.exists()
+
+        assert writer.acquire(blocking=False)
+        assert not reader1.acquire(blocking=False)
+        writer.release()
+        assert reader1.acquire(blocking=False)
+        reader1.release()
+
+    def test_writer_claim_keeps_readers_out(self):
+        reader = self.get_lock("foo", timeout=10, shared=True)
+        writer = self.get_lock("foo", timeout=10)
+        assert reader.acquire(blocking=False)
+
+        assert not writer.do_acquire("writer")
+        assert Lock.objects.filter(name="foo", token="writer").exists()
+        assert not self.get_lock("foo", shared=True).acquire(blocking=False)
+
+        reader.release()
+        assert writer.do_acquire("writer")
+
+    def test_writer_gives_up_its_claim(self):
+        reader = self.get_lock("foo", timeout=10, shared=True)
+        writer = self.get_lock("foo", timeout=10)
+        assert reader.acquire(blocking=False)
+
+        assert not writer.acquire(blocking_timeout=0.2)
+        assert not Lock.objects.filter(name="foo").exists()
+        assert self.get_lock("foo", shared=True).acquire(blocking=False)
+
+    def test_no_writer_preference(self):
+        reader = self.get_lock("foo", timeout=10, shared=True)
+        writer = self.get_lock("foo", timeout=10, prefer_writers=False)
+        assert reader.acquire(blocking=False)
+
+        assert not writer.do_acquire("writer")
+        assert not Lock.objects.filter(name="foo").exists()
+        assert self.get_lock("foo", shared=True).acquire(blocking=False)
+
+    def test_expired_readers_are_ignored(self):
+        reader = self.get_lock("foo", timeout=10, shared=True)
+        assert reader.acquire(blocking=False)
+        LockReader.objects.update(expires_at=datetime.now() - timedelta(seconds=1))
+
+        assert not reader.owned()
+        writer = self.get_lock("foo", timeout=10)
+        assert writer.acquire(blocking=False)
+        writer.release()
+
+    def test_extend_reader(self):
+        reader = self.get_lock("foo", timeout=10, shared=True)
+        assert reader.acquire(blocking=False)
+        expires_at = LockReader.objects.get().expires_at
+
+        assert reader.extend(10)
+        assert LockReader.objects.get().expires_at == expires_at + timedelta(seconds=10)
+        assert reader.reacquire()
+        assert LockReader.objects.get().expires_at < expires_at + timedelta(seconds=1)
+
+        LockReader.objects.all().delete()
+        with pytest.raises(LockNotOwnedError):
+            reader.extend(10)
+        with pytest.raises(LockNotOwnedError):
+            reader.release()
+
+
+class TestRedisReadWriteLock:
+    def get_lock(self, *args, **kwargs):
+        return read_write_lock("foo", *args, **kwargs)
+
+    def test_readers_share_the_lock(self):
+        reader1 = self.get_lock(timeout=10, shared=True)
+        reader2 = self.get_lock(timeout=10, shared=True)
+        writer = self.get_lock(timeout=10)
+
+        assert reader1.acquire(blocking=False)
+        assert reader2.acquire(blocking=False)
+        assert reader1.owned()
+        assert reader2.locked()
+        assert not cache.lock("foo").locked()
+
+        assert not writer.acquire(blocking=False)
+        reader1.release()
+        reader2.release()
+
+        assert writer.acquire(blocking=False)
+        assert writer.owned()
+        assert not reader1.acquire(blocking=False)
+        writer.release()
+        assert reader1.acquire(blocking=False)
+        reader1.release()
+        assert not reader1.locked()
+
+    def test_readers_without_timeout(self):
+        reader = self.get_lock(shared=True)
+        assert reader.acquire(blocking=False)
+        assert reader.owned()
+        assert reader.redis.pttl(reader.readers) == -1
+
+        reader.release()
+        assert not reader.redis.exists(reader.readers)
+
+    def test_readers_expire(self):
+        reader = self.get_lock(timeout=0.1, shared=True)
+        assert reader.acquire(blocking=False)
+        assert 0 < reader.redis.pttl(reader.readers) <= 100
+
+        time.sleep(0.1)
+        assert not reader.owned()
+        writer = self.get_lock(timeout=10)
+        assert writer.acquire(blocking=False)
+        writer.release()
+
+    def test_writer_claim_keeps_readers_out(self):
+        reader = self.get_lock(timeout=10, shared=True)
+        writer = self.get_lock(timeout=10)
+        assert reader.acquire(blocking=False)
+
+        assert not writer.do_acquire(b"writer")
+        assert not self.get_lock(shared=True).acquire(blocking=False)
+
+        reader.release()
+        assert writer.do_acquire(b"writer")
+
+    def test_writer_gives_up_its_claim(self):
+        reader = self.get_lock(timeout=10, shared=True)
+        writer = self.get_lock(timeout=10)
+        assert reader.acquire(blocking=False)
+
+        assert not writer.acquire(blocking_timeout=0.2)
+        assert not cache.lock("foo").locked()
+        assert self.get_lock(shared=True).acquire(blocking=False)
+
+    def test_no_writer_preference(self):
+        reader = self.get_lock(timeout=10, shared=True)
+        writer = self.get_lock(timeout=10, prefer_writers=False)
+        assert reader.acquire(blocking=False)
+
+        assert not writer.do_acquire(b"writer")
+        assert self.get_lock(shared=True).acquire(blocking=False)
+
+    def test_extend_reader(self):
+        reader = self.get_lock(timeout=10, shared=True)
+        assert reader.acquire(blocking=False)
+
+        assert reader.extend(10)
+        assert 10000 < reader.redis.pttl(reader.readers) <= 20000
+        assert reader.reacquire()
+        assert reader.redis.pttl(reader.readers) <= 10000
+
+        reader.redis.delete(reader.readers)
+        with pytest.raises(LockNotOwnedError):
+            reader.extend(10)
+        with pytest.raises(LockNotOwnedError):
+            reader.release()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestLeaseWatchdog:
+    @pytest.fixture(autouse=True)
+    def renew_often(self, settings):
+        settings.LOCK_RENEW_INTERVAL = 0.05
+        yield
+        # the watchdog stops once nothing is left to renew
+        thread = watchdog.thread
+        if thread is not None:
+            thread.join()
+
+    def test_lock_is_renewed_while_held(self):
+        lock = DjangoRedlock("foo", timeout=0.3, auto_renew=True)
+        assert lock.acquire(blocking=False)
+
+        time.sleep(0.6)
+        assert lock.owned()
+        assert not lock.lease_lost
+        lock.release()
+        assert not watchdog.leases
+
+    def test_lock_expires_without_auto_renew(self):
+        lock = DjangoRedlock("foo", timeout=0.3)
+        assert lock.acquire(blocking=False)
+
+        time.sleep(0.4)
+        assert not lock.owned()
+        assert watchdog.thread is None
+
+    def test_all_locks_are_renewed_by_one_query(self, django_assert_num_queries):
+        locks = [DjangoRedlock(f"foo-{i}", timeout=10) for i in range(3)]
+        leases = []
+        for lock in locks:
+            assert lock.acquire(blocking=False)
+            leases.append(Lease(lock.name, lock.local.token))
+        Lock.objects.update(expires_at=datetime.now() + timedelta(seconds=1))
+
+        with django_assert_num_queries(1):
+            watchdog.renew(leases)
+
+        assert all(lock.ttl >= 9 for lock in Lock.objects.all())
+        for lock in locks:
+            lock.release()
+
+    def test_lost_lease_is_flagged(self):
+        lock = DjangoRedlock("foo", timeout=10, auto_renew=True)
+        assert lock.acquire(blocking=False)
+        Lock.objects.filter(name="foo").update(token="other")
+
+        time.sleep(0.2)
+        assert lock.lease_lost
+        assert not watchdog.leases
+        with pytest.raises(LockNotOwnedError):
+            lock.release()
+
+    def test_unsupported_locks(self):
+        with pytest.raises(LockError):
+            DjangoAdvisoryLock("foo", auto_renew=True)
+        with pytest.raises(LockError):
+            DjangoReadWriteLock("foo", shared=True, auto_renew=True)
+
+
+@pytest.mark.django_db
+class TestMultiLock:
+    def get_lock(self, *args, **kwargs):
+        return DjangoMultiLock(*args, **kwargs)
+
+    def test_lock(self):
+        lock = self.get_lock(["foo", "bar", "foo"])
+        assert lock.acquire(blocking=False)
+
+        db_locks = Lock.objects.order_by("name")
+        assert [db_lock.name for db_lock in db_locks] == ["bar", "foo"]
+        assert {db_lock.token for db_lock in db_locks} == {lock.local.token}
+        assert lock.owned() is True
+        assert lock.locked() is True
+        lock.release()
+
+        assert not Lock.objects.exists()
+        assert lock.owned() is False
+        assert lock.locked() is False
+
+    def test_competing_locks(self):
+        single = DjangoRedlock("bar")
+        assert single.acquire(blocking=False)
+
+        lock = self.get_lock(["foo", "bar"])
+        assert not lock.acquire(blocking=False)
+        # foo was rolled back
+        assert list(Lock.objects.values_list("name", flat=True)) == ["bar"]
+
+        single.release()
+        assert lock.acquire(blocking=False)
+        assert not self.get_lock(["foo", "baz"]).acquire(blocking=False)
+        lock.release()
+
+    def test_acquire_is_a_single_statement(self, django_assert_num_queries):
+        lock = self.get_lock(["foo", "bar", "baz"])
+
+        # the savepoint around the upsert, and its release
+        with django_assert_num_queries(3):
+            assert lock.acquire(blocking=False)
+
+        with django_assert_num_queries(1):
+            lock.release()
+
+    def test_acquire_steals_expired_locks(self):
+        Lock.objects.create(name="foo", token="bar", timeout=10)
+        Lock.objects.filter(name="foo").update(
+            expires_at=datetime.now() - timedelta(seconds=1)
+        )
+
+        lock = self.get_lock(["foo", "bar"], timeout=10)
+        assert lock.acquire(blocking=False)
+        assert lock.owned() is True
+        assert registry.total("lock_steals_total") == 1
+        lock.release()
+
+    def test_blocking_timeout(self):
+        lock1 = self.get_lock(["foo", "bar"])
+        assert lock1.acquire(blocking=False)
+        bt = 0.4
+        sleep = 0.1
+        lock2 = self.get_lock(["bar", "baz"], sleep=sleep, blocking_timeout=bt)
+        start = time.monotonic()
+        assert not lock2.acquire()
+        assert bt > (time.monotonic() - start) > bt - sleep
+        lock1.release()
+
+    def test_context_manager(self):
+        with self.get_lock(["foo", "bar"], blocking_timeout=0.2) as lock:
+            assert Lock.objects.filter(token=lock.local.token).count() == 2
+
+        assert not Lock.objects.exists()
+
+    def test_releasing_lock_no_longer_owned_raises_error(self):
+        lock = self.get_lock(["foo", "bar"])
+        assert lock.acquire(blocking=False)
+        Lock.objects.filter(name="foo").update(token="a")
+
+        with pytest.raises(LockNotOwnedError):
+            lock.release()
+        assert lock.local.token is None
+
+    def test_extend_lock(self):
+        lock = self.get_lock(["foo", "bar"], timeout=10)
+        assert lock.acquire(blocking=False)
+        assert lock.extend(10)
+
+        for db_lock in Lock.objects.all():
+            assert 16000 < db_lock.pttl <= 20000
+        lock.release()
+
+    def test_reacquire_lock(self):
+        lock = self.get_lock(["foo", "bar"], timeout=10)
+        assert lock.acquire(blocking=False)
+        Lock.objects.update(timeout=5)
+
+        assert lock.reacquire()
+        for db_lock in Lock.objects.all():
+            assert 8000 < db_lock.pttl <= 10000
+        lock.release()
+
+    def test_extending_lock_no_longer_owned_raises_error(self):
+        lock = self.get_lock(["foo", "bar"], timeout=10)
+        assert lock.acquire(blocking=False)
+        Lock.objects.filter(name="bar").delete()
+
+        with pytest.raises(LockNotOwnedError):
+            lock.extend(10)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestAsyncLock:
+    def get_lock(self, *args, **kwargs):
+        return AsyncDjangoRedlock(*args, **kwargs)
+
+    def test_lock(self):
+        lock = self.get_lock("foo")
+        assert async_to_sync(lock.acquire)(blocking=False)
+
+        db_lock = Lock.objects.get(name="foo")
+        assert db_lock.token == lock.local.token
+        assert async_to_sync(lock.owned)() is True
+        assert async_to_sync(lock.locked)() is True
+        async_to_sync(lock.release)()
+
+        assert not Lock.objects.filter(name="foo").exists()
+        assert async_to_sync(lock.owned)() is False
+
+    def test_competing_locks(self):
+        lock1 = self.get_lock("foo")
+        lock2 = self.get_lock("foo")
+        assert async_to_sync(lock1.acquire)(blocking=False)
+        assert not async_to_sync(lock2.acquire)(blocking=False)
+        async_to_sync(lock1.release)()
+        assert async_to_sync(lock2.acquire)(blocking=False)
+        async_to_sync(lock2.release)()
+
+    def test_blocking_timeout(self):
+        lock1 = self.get_lock("foo")
+        assert async_to_sync(lock1.acquire)(blocking=False)
+        bt = 0.4
+        sleep = 0.1
+        lock2 = self.get_lock("foo", sleep=sleep, blocking_timeout=bt)
+        start = time.monotonic()
+        assert not async_to_sync(lock2.acquire)()
+        assert bt > (time.monotonic() - start) > bt - sleep
+        async_to_sync(lock1.release)()
+
+    def test_waiters_share_the_event_loop(self):
+        async def contend():
+            holder = self.get_lock("foo")
+            assert await holder.acquire(blocking=False)
+            waiters = [
+                self.get_lock("foo", sleep=0.05, blocking_timeout=0.3)
+                for _ in range(20)
+            ]
+            results = await asyncio.gather(*(waiter.acquire() for waiter in waiters))
+            await holder.release()
+            return results
+
+        assert async_to_sync(contend)() == [False] * 20
+
+    def test_context_manager(self):
+        async def use_lock():
+            async with self.get_lock("foo", blocking_timeout=0.2) as lock:
+                return await lock.owned()
+
+        assert async_to_sync(use_lock)() is True
+        assert not Lock.objects.filter(name="foo").exists()
+
+    def test_context_manager_raises_when_locked_not_acquired(self):
+        Lock.objects.create(name="foo", token="bar")
+
+        async def use_lock():
+            async with self.get_lock("foo", blocking_timeout=0.1):
+                pass
+
+        with pytest.raises(LockError):
+            async_to_sync(use_lock)()
+
+    def test_extend_lock(self):
+        lock = self.get_lock("foo", timeout=10)
+        assert async_to_sync(lock.acquire)(blocking=False)
+        assert async_to_sync(lock.extend)(10)
+        assert 16000 < Lock.objects.get(name="foo").pttl <= 20000
+        assert async_to_sync(lock.reacquire)()
+        assert 8000 < Lock.objects.get(name="foo").pttl <= 10000
+        async_to_sync(lock.release)()
+
+    def test_releasing_unlocked_lock_raises_error(self):
+        lock = self.get_lock("foo")
+        with pytest.raises(LockError):
+            async_to_sync(lock.release)()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestAsyncViews:
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("redis", "django"),
+            ("redis", "redis"),
+        ],
+    )
+    def test_get_entry_no_entry_exists(self, client, entry: str, lock: str):
+        key = "test"
+        response = client.get(f"/entry/async/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 0}
+
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("redis", "django"),
+            ("redis", "redis"),
+        ],
+    )
+    def test_increment_entry_twice(self, client, entry: str, lock: str):
+        key = "test"
+
+        response = client.post(f"/entry/async/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 1}
+
+        response = client.post(f"/entry/async/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 2}
+
+        response = client.get(f"/entry/async/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 2}
+
+
+@pytest.mark.django_db
+class TestViews:
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("django", "advisory"),
+            ("redis", "django"),
+            ("redis", "redis"),
+            ("redis", "advisory"),
+            ("redis", "script"),
+        ],
+    )
+    def test_get_entry_no_entry_exists(self, client, entry: str, lock: str):
+        key = "test"
+        response = client.get(f"/entry/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 0}
+
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("django", "advisory"),
+            ("redis", "django"),
+            ("redis", "redis"),
+            ("redis", "advisory"),
+            ("redis", "script"),
+        ],
+    )
+    def test_increment_entry(self, client, entry: str, lock: str):
+        key = "test"
+
+        response = client.post(f"/entry/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 1}
+
+        response = client.get(f"/entry/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 1}
+
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("django", "advisory"),
+            ("redis", "django"),
+            ("redis", "redis"),
+            ("redis", "advisory"),
+        ],
+    )
+    def test_lock_metrics(self, client, entry: str, lock: str):
+        client.get(f"/entry/{entry}/{lock}/lock/test/")
+        client.post(f"/entry/{entry}/{lock}/lock/test/")
+
+        labels = {"backend": lock, "view": f"EntryView:{entry}/{lock}"}
+        assert registry.total("lock_acquire_seconds", **labels) == 2
+        assert registry.total("lock_hold_seconds", **labels) == 2
+        assert registry.total("lock_release_seconds", **labels) == 2
+
+    def test_timeouts_are_counted(self, client):
+        with patch.object(DjangoReadWriteLock, "acquire", return_value=False):
+            response = client.post("/entry/django/django/lock/test/")
+
+        assert response.status_code == HTTP_408_REQUEST_TIMEOUT
+        view = "EntryView:django/django"
+        assert registry.total("request_timeouts_total", view=view) == 1
+        assert registry.total("lock_timeouts_total", view=view) == 1
+
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("django", "advisory"),
+            ("redis", "django"),
+            ("redis", "redis"),
+            ("redis", "advisory"),
+            ("redis", "script"),
+        ],
+    )
+    def test_increment_entry_twice(self, client, entry: str, lock: str):
+        key = "test"
+
+        response = client.post(f"/entry/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 1}
+
+        response = client.post(f"/entry/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 2}
+
+        response = client.get(f"/entry/{entry}/{lock}/lock/{key}/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 2}
+
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("redis", "django"),
+            ("redis", "redis"),
+        ],
+    )
+    def test_get_entry_shares_the_lock(self, client, entry: str, lock: str):
+        key = "test"
+        if lock == "django":
+            reader = DjangoReadWriteLock(key, timeout=10, shared=True)
+        else:
+            reader = read_write_lock(f"lock-{key}", timeout=10, shared=True)
+
+        with reader:
+            response = client.get(f"/entry/{entry}/{lock}/lock/{key}/")
+            assert response.status_code == HTTP_200_OK
+            assert reader.owned()
+
+
+@pytest.mark.django_db
+class TestLockBackends:
+    def test_backends_are_configured_by_settings(self):
+        assert isinstance(get_lock_backend("django"), DjangoLockBackend)
+        assert isinstance(get_lock_backend("redis"), RedisLockBackend)
+        assert isinstance(get_lock_backend("advisory"), AdvisoryLockBackend)
+
+        with pytest.raises(InvalidLockBackend):
+            get_lock_backend("foo")
+
+    def test_locks_take_the_settings_of_their_backend(self, settings):
+        settings.LOCK_BACKENDS = {
+            "slow": {
+                "BACKEND": "redis",
+                "TIMEOUT": 5,
+                "BLOCKING_TIMEOUT": 2,
+                "SLEEP": 0.5,
+            },
+            "dotted": {"BACKEND": "entry.backends.DjangoLockBackend"},
+        }
+
+        lock = get_lock_backend("slow").lock("foo")
+        assert isinstance(lock.lock, TwoTierLock)
+        assert lock.lock.lock.timeout == 5
+        assert lock.lock.lock.blocking_timeout == 2
+        assert lock.lock.lock.sleep == 0.5
+
+        lock = get_lock_backend("dotted").lock("foo", shared=True)
+        assert isinstance(lock.lock, DjangoReadWriteLock)
+        assert lock.lock.shared
+        assert lock.lock.timeout == 1
+        assert lock.lock.blocking_timeout is None
+
+    def test_views_serve_every_backend(self, client, settings):
+        settings.LOCK_BACKENDS = {"fast": {"BACKEND": "django", "TIMEOUT": 0.5}}
+
+        response = client.post("/entry/redis/fast/lock/test/")
+
+        assert response.status_code == HTTP_200_OK
+        assert response.json() == {"key": "test", "value": 1}
+        labels = {"backend": "fast", "view": "EntryView:redis/fast"}
+        assert registry.total("lock_acquire_seconds", **labels) == 1
+
+        response = client.post("/entry/redis/django/lock/test/")
+        assert response.status_code == HTTP_404_NOT_FOUND
+        response = client.post("/entry/foo/fast/lock/test/")
+        assert response.status_code == HTTP_404_NOT_FOUND
+
+    def test_blocking_timeout(self, client, settings):
+        settings.LOCK_BACKENDS = {
+            "redis": {"BACKEND": "redis", "BLOCKING_TIMEOUT": 0.1, "SLEEP": 0.01}
+        }
+        held = read_write_lock("lock-test", timeout=10)
+        assert held.acquire(blocking=False)
+
+        response = client.post("/entry/redis/redis/lock/test/")
+
+        assert response.status_code == HTTP_408_REQUEST_TIMEOUT
+
+    def test_backend_without_make_lock_fails_when_configured(self, settings):
+        class IncompleteLockBackend(BaseLockBackend):
+            pass
+
+        settings.LOCK_BACKENDS = {"incomplete": {"BACKEND": "incomplete"}}
+
+        with patch.dict(_backend_classes, incomplete=IncompleteLockBackend):
+            with pytest.raises(TypeError):
+                get_lock_backend("incomplete")
+
+    @pytest.mark.parametrize("lock", ["redis", "advisory"])
+    def test_mixed_backends_do_not_cache_over_each_other(self, client, lock: str):
+        client.post("/entry/django/django/lock/test/")
+        client.get("/entry/django/django/lock/test/")
+        save = Entry.save
+        interleaved = {}
+
+        def save_then_interleave(entry, *args, **kwargs):
+            save(entry, *args, **kwargs)
+            if not interleaved:
+                # a writer under the django lock is not excluded by the
+                # other lock, it commits a newer value
+                interleaved["response"] = None
+                interleaved["response"] = client.post("/entry/django/django/lock/test/")
+
+        with patch.object(
+            Entry, "save", autospec=True, side_effect=save_then_interleave
+        ):
+            response = client.post(f"/entry/django/{lock}/lock/test/")
+
+        assert response.json() == {"key": "test", "value": 2}
+        assert interleaved["response"].json() == {"key": "test", "value": 3}
+        assert entry_values.get("test") is None
+        response = client.get("/entry/django/django/lock/test/")
+        assert response.json() == {"key": "test", "value": 3}
+
+
+@pytest.mark.django_db
+class TestAtomicViews:
+    def test_get_entry_no_entry_exists(self, client):
+        response = client.get("/entry/django/atomic/test/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 0}
+        assert not Entry.objects.exists()
+
+    def test_increment_entry_twice(self, client, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            response = client.post("/entry/django/atomic/test/")
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == {"key": "test", "value": 1}
+
+        response = client.post("/entry/django/atomic/test/")
+
+        assert response.json() == {"key": "test", "value": 2}
+
+        response = client.get("/entry/django/atomic/test/")
+
+        assert response.json() == {"key": "test", "value": 2}
+        assert Entry.objects.get(key="test").value == 2
+
+
+@pytest.mark.django_db
+class TestWriteBehind:
+    def test_increments_stay_in_redis_until_flushed(self, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            assert write_behind.increment("foo") == 1
+        assert write_behind.increment("foo") == 2
+        assert write_behind.increment("bar") == 1
+
+        assert not Entry.objects.exists()
+        assert write_behind.get_value("foo") == 2
+
+        assert write_behind.flush() == 2
+        assert dict(Entry.objects.values_list("key", "value")) == {"foo": 2, "bar": 1}
+        assert "pending-foo" not in cache
+        assert not get_redis_connection("default").exists(
+            cache.make_key(write_behind.DIRTY_KEYS)
+        )
+
+        assert write_behind.increment("foo") == 3
+        assert write_behind.get_value("foo") == 3
+        assert write_behind.flush() == 1
+        assert Entry.objects.get(key="foo").value == 3
+
+    def test_flush_in_batches(self):
+        for index in range(5):
+            write_behind.increment(f"key-{index}")
+
+        assert write_behind.flush(batch_size=2) == 5
+        assert Entry.objects.count() == 5
+        assert write_behind.flush(batch_size=2) == 0
+
+    def test_increments_do_not_read_the_table(self, django_assert_num_queries):
+        write_behind.increment("foo")
+        write_behind.flush()
+
+        with django_assert_num_queries(0):
+            assert write_behind.increment("foo") == 2
+            assert write_behind.get_value("foo") == 2
+
+    def test_increments_during_a_flush_stay_pending(self):
+        write_behind.increment("foo")
+        increment_many = Entry.objects.increment_many
+        values = []
+
+        def increment_meanwhile(counts):
+            # another process increments the key, the claimed delta counts
+            values.append(write_behind.increment("foo"))
+            result = increment_many(counts)
+            values.append(write_behind.get_value("foo"))
+            return result
+
+        with patch.object(
+            Entry.objects, "increment_many", side_effect=increment_meanwhile
+        ):
+            assert write_behind.flush() == 1
+
+        assert values == [2, 2]
+        assert Entry.objects.get(key="foo").value == 1
+        assert cache.get("pending-foo") == 1
+        assert write_behind.get_value("foo") == 2
+        assert write_behind.flush() == 1
+        assert Entry.objects.get(key="foo").value == 2
+
+    def test_read_overlapping_a_flush_is_retried(self):
+        write_behind.increment("foo")
+        cache.delete("flushed-foo")
+        get_value = Entry.objects.get_value
+        calls = []
+
+        def flush_meanwhile(key):
+            value = get_value(key)
+            if not calls:
+                write_behind.flush()
+            calls.append(value)
+            return value
+
+        with patch.object(Entry.objects, "get_value", side_effect=flush_meanwhile):
+            assert write_behind.get_value("foo") == 1
+
+        assert calls == [0, 1]
+
+    def test_flush_interrupted_after_commit_is_not_applied_twice(self):
+        write_behind.increment("foo")
+
+        with patch.object(entry_values, "delete_many", side_effect=RedisError):
+            with pytest.raises(RedisError):
+                write_behind.flush()
+
+        assert Entry.objects.get(key="foo").value == 1
+        assert write_behind.get_value("foo") == 1
+        assert WriteBehindFlush.objects.exists()
+
+        assert write_behind.flush() == 1
+        assert Entry.objects.get(key="foo").value == 1
+        assert write_behind.get_value("foo") == 1
+        assert not WriteBehindFlush.objects.exists()
+        assert not get_redis_connection("default").exists(
+            cache.make_key(write_behind.UNFINISHED_FLUSHES)
+        )
+
+    def test_flush_interrupted_before_commit_is_applied_once(self):
+        write_behind.increment("foo")
+
+        with patch.object(Entry.objects, "increment_many", side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                write_behind.flush()
+
+        assert not Entry.objects.exists()
+        assert write_behind.get_value("foo") == 1
+        assert write_behind.increment("foo") == 2
+
+        assert write_behind.flush() == 2
+        assert Entry.objects.get(key="foo").value == 2
+        assert write_behind.get_value("foo") == 2
+
+    def test_one_flush_at_a_time(self):
+        write_behind.increment("foo")
+        with cache.lock(write_behind.FLUSH_LOCK):
+            assert write_behind.flush() == 0
+        assert write_behind.flush() == 1
+
+    def test_flush_entries_command(self):
+        write_behind.increment("foo")
+
+        out = StringIO()
+        call_command("flush_entries", stdout=out)
+
+        assert out.getvalue() == "Flushed 1 keys\n"
+        assert Entry.objects.get(key="foo").value == 1
+
+    def test_flush_entries_command_keeps_flushing(self, settings):
+        command = "entry.management.commands.flush_entries"
+        with patch(f"{command}.run_flusher") as run_flusher:
+            call_command("flush_entries", "--interval", "0.5", stdout=StringIO())
+
+        run_flusher.assert_called_once_with(0.5, settings.WRITE_BEHIND_BATCH_SIZE)
+
+    def test_flusher_survives_failed_flushes(self):
+        flushes = []
+
+        def fail_once(batch_size):
+            flushes.append(batch_size)
+            if len(flushes) == 1:
+                raise RedisError
+            if len(flushes) == 2:
+                raise KeyboardInterrupt
+
+        with patch.object(write_behind, "flush", side_effect=fail_once):
+            with pytest.raises(KeyboardInterrupt):
+                write_behind.run_flusher(0, 10)
+
+        assert flushes == [10, 10]
+
+    def test_load_waiting_for_an_interrupted_flush_times_out(self, client, settings):
+        settings.WRITE_BEHIND_LOAD_TIMEOUT = 0.05
+        write_behind.increment("foo")
+        with patch.object(write_behind, "apply_flush", side_effect=RedisError):
+            with pytest.raises(RedisError):
+                write_behind.flush()
+        # the claimed delta still counts while the flush is unfinished
+        assert write_behind.get_value("foo") == 1
+        cache.delete("flushed-foo")
+
+        with pytest.raises(LockError):
+            write_behind.get_value("foo")
+        response = client.get("/entry/django/write-behind/foo/")
+        assert response.status_code == HTTP_408_REQUEST_TIMEOUT
+
+        assert write_behind.flush() == 1
+        assert write_behind.get_value("foo") == 1
+        assert Entry.objects.get(key="foo").value == 1
+
+    def test_views(self, client):
+        response = client.post("/entry/django/write-behind/test/")
+        assert response.json() == {"key": "test", "value": 1}
+
+        write_behind.flush()
+        response = client.post("/entry/django/write-behind/test/")
+        assert response.json() == {"key": "test", "value": 2}
+
+        response = client.get("/entry/django/write-behind/test/")
+        assert response.json() == {"key": "test", "value": 2}
+
+
+class TestLocalCache:
+    def test_least_recently_used_is_evicted(self):
+        local = LocalCache(maxsize=2, ttl=10)
+        local.set("a", 1)
+        local.set("b", 2)
+        assert local.get("a") == 1
+        local.set("c", 3)
+
+        assert local.get("b") is None
+        assert local.get("a") == 1
+        assert local.get("c") == 3
+        assert (local.hits, local.misses) == (3, 1)
+
+    def test_earlier_generations_are_not_cached_over_later_ones(self):
+        local = LocalCache(maxsize=2, ttl=10)
+        local.set("a", 1, generation=1)
+        local.delete("a", generation=2)
+        local.set("a", 1, generation=1)
+        assert local.get("a") is None
+
+        local.set("a", 2, generation=2)
+        assert local.get("a") == 2
+
+    def test_values_expire(self):
+        local = LocalCache(maxsize=2, ttl=0.1)
+        local.set("a", 1)
+        assert local.get("a") == 1
+        time.sleep(0.1)
+        assert local.get("a") is None
+        assert not local.values
+
+
+@pytest.mark.django_db
+class TestEntryValueCache:
+    @pytest.mark.parametrize("lock", ["django", "redis"])
+    def test_get_skips_lock_and_database_on_hit(
+        self, client, django_assert_num_queries, lock: str
+    ):
+        client.post(f"/entry/django/{lock}/lock/test/")
+        client.get(f"/entry/django/{lock}/lock/test/")
+
+        with django_assert_num_queries(0):
+            response = client.get(f"/entry/django/{lock}/lock/test/")
+        assert response.json() == {"key": "test", "value": 1}
+        assert entry_values.stats()["local_hits"] == 1
+
+    @pytest.mark.parametrize("lock", ["django", "redis"])
+    def test_get_fills_the_cache_on_miss(self, client, lock: str):
+        Entry.objects.create(key="test", value=5)
+
+        response = client.get(f"/entry/django/{lock}/lock/test/")
+        assert response.json() == {"key": "test", "value": 5}
+        assert entry_values.stats() == {
+            "local_hits": 0,
+            "local_misses": 1,
+            "redis_hits": 0,
+            "redis_misses": 1,
+        }
+        assert cache.get("value-test") == 5
+        assert entry_values.get("test") == 5
+
+    def test_redis_tier_is_shared(self, client):
+        client.post("/entry/django/django/lock/test/")
+        client.get("/entry/django/django/lock/test/")
+        # another process, with an empty local tier
+        entry_values.local.clear()
+
+        response = client.get("/entry/django/django/lock/test/")
+        assert response.json() == {"key": "test", "value": 1}
+        assert entry_values.stats()["redis_hits"] == 1
+        assert entry_values.local.get("test") == 1
+
+    def test_writes_invalidate(self, client):
+        client.post("/entry/django/django/lock/test/")
+        assert entry_values.get("test") is None
+        client.get("/entry/django/django/lock/test/")
+        assert entry_values.get("test") == 1
+
+        client.post("/entry/django/atomic/test/")
+        assert entry_values.get("test") is None
+        response = client.get("/entry/django/django/lock/test/")
+        assert response.json() == {"key": "test", "value": 2}
+
+    @pytest.mark.parametrize("writer", ["atomic", "sharded", "write-behind"])
+    def test_write_during_a_miss_is_not_cached_over(self, client, writer: str):
+        Entry.objects.create(key="test", value=1)
+        get_or_create = Entry.objects.get_or_create
+        written = []
+
+        def write_meanwhile(**kwargs):
+            # the reader read the row, then a writer without its lock commits
+            result = get_or_create(**kwargs)
+            if not written:
+                written.append(writer)
+                if writer == "atomic":
+                    client.post("/entry/django/atomic/test/")
+                elif writer == "sharded":
+                    sharded_counter.increment("test")
+                else:
+                    write_behind.increment("test")
+                    write_behind.flush()
+            return result
+
+        with patch.object(Entry.objects, "get_or_create", side_effect=write_meanwhile):
+            response = client.get("/entry/django/django/lock/test/")
+
+        assert response.json() == {"key": "test", "value": 1}
+        assert entry_values.get("test") is None
+        response = client.get("/entry/django/django/lock/test/")
+        assert response.json() == {"key": "test", "value": 2}
+
+    def test_batch_invalidates_the_cache(self, client):
+        client.get("/entry/django/django/lock/a/")
+        client.post(
+            "/entry/django/django/batch/",
+            {"keys": ["a", "b", "a"]},
+            content_type="application/json",
+        )
+        assert entry_values.get("a") is None
+        assert entry_values.get("b") is None
+
+        response = client.get("/entry/django/django/lock/a/")
+        assert response.json() == {"key": "a", "value": 2}
+
+    def test_write_during_a_local_fill_is_not_cached_over(self, client):
+        Entry.objects.create(key="test", value=1)
+        local_set = entry_values.local.set
+        written = []
+
+        def write_meanwhile(key, value, generation=0):
+            if not written:
+                # the miss stored the value in redis, then a writer of this
+                # process invalidates it before the local tier is filled
+                written.append(key)
+                client.post("/entry/django/django/lock/test/")
+            local_set(key, value, generation)
+
+        with patch.object(entry_values.local, "set", side_effect=write_meanwhile):
+            response = client.get("/entry/django/django/lock/test/")
+
+        assert response.json() == {"key": "test", "value": 1}
+        assert entry_values.local.get("test") is None
+        response = client.get("/entry/django/django/lock/test/")
+        assert response.json() == {"key": "test", "value": 2}
+
+    def test_stats_view(self, client):
+        client.get("/entry/django/django/lock/test/")
+        client.get("/entry/django/django/lock/test/")
+
+        response = client.get("/entry/cache/stats/")
+        assert response.json() == {
+            "local_hits": 1,
+            "local_misses": 1,
+            "redis_hits": 0,
+            "redis_misses": 1,
+        }
+
+
+@pytest.mark.django_db
+class TestShardedCounter:
+    def test_cold_key_is_not_sharded(self):
+        assert sharded_counter.increment("foo") == 1
+        assert sharded_counter.increment("foo") == 2
+
+        assert Entry.objects.get(key="foo").value == 2
+        assert not EntryShard.objects.exists()
+
+    def test_hot_key_is_split_in_shards(self):
+        Entry.objects.create(key="foo", value=3)
+        cache.set("shards-foo", 4)
+
+        for _ in range(20):
+            sharded_counter.increment("foo")
+
+        assert sharded_counter.get_value("foo") == 23
+        assert Entry.objects.get(key="foo").value == 3
+        assert set(EntryShard.objects.values_list("shard", flat=True)) <= {0, 1, 2, 3}
+        assert sum(EntryShard.objects.values_list("value", flat=True)) == 20
+
+    def test_increment_takes_a_free_shard(self):
+        cache.set("shards-foo", 3)
+        for shard in (0, 2):
+            assert DjangoRedlock(sharded_counter.lock_name("foo", shard)).acquire()
+
+        for _ in range(3):
+            sharded_counter.increment("foo")
+
+        assert list(EntryShard.objects.values_list("shard", "value")) == [(1, 3)]
+
+    def test_contention_shards_the_key(self, settings):
+        settings.SHARDED_COUNTER_THRESHOLD = 2
+        settings.SHARDED_COUNTER_SHARDS = 4
+        lock = DjangoRedlock("foo", timeout=0.1)
+
+        assert lock.acquire()
+        assert sharded_counter.increment("foo") == 1
+        assert sharded_counter.shard_count("foo") == 1
+
+        assert lock.acquire()
+        assert sharded_counter.increment("foo") == 2
+        assert sharded_counter.shard_count("foo") == 4
+        assert 0 < cache.ttl("contention-foo") <= settings.SHARDED_COUNTER_WINDOW
+
+    def test_long_keys_fit_in_the_lock_table(self):
+        key = "k" * 32
+        assert sharded_counter.lock_name("foo", 1) == "foo:1"
+        assert len(sharded_counter.lock_name(key, 1)) == 32
+        assert sharded_counter.lock_name(key, 1) != sharded_counter.lock_name(key, 2)
+
+    def test_views(self, client):
+        response = client.post("/entry/django/sharded/test/")
+        assert response.json() == {"key": "test", "value": 1}
+
+        cache.set("shards-test", 2)
+        response = client.post("/entry/django/sharded/test/")
+        assert response.json() == {"key": "test", "value": 2}
+
+        response = client.get("/entry/django/sharded/test/")
+        assert response.json() == {"key": "test", "value": 2}
+
+
+@pytest.mark.django_db
+class TestBatchViews:
+    @pytest.mark.parametrize(
+        "entry, lock",
+        [
+            ("django", "django"),
+            ("django", "redis"),
+            ("redis", "django"),
+            ("redis", "redis"),
+        ],
+    )
+    def test_increment_entries(self, client, entry: str, lock: str):
+        response = client.post(
+            f"/entry/{entry}/{lock}/batch/",
+            {"keys": ["foo", "bar", "foo"]},
+            content_type="application/json",
+        )
+
+        assert response.status_code == HTTP_200_OK
+
+        assert response.json() == [
+            {"key": "bar", "value": 1},
+            {"key": "foo", "value": 2},
+        ]
+
+        response = client.post(
+            f"/entry/{entry}/{lock}/batch/",
+            {"keys": ["foo"]},
+            content_type="application/json",
+        )
+
+        assert response.json() == [{"key": "foo", "value": 3}]
+
+        response = client.get(f"/entry/{entry}/{lock}/lock/bar/")
+
+        assert response.json() == {"key": "bar", "value": 1}
+
+    def test_increment_entries_is_a_single_query(
+        self, client, django_assert_num_queries
+    ):
+        # one savepoint, the upsert and the release of the savepoint
+        with django_assert_num_queries(3):
+            client.post(
+                "/entry/django/redis/batch/",
+                {"keys": ["foo", "bar", "baz"]},
+                content_type="application/json",
+            )
+
+    def test_locked_key_times_out(self, client):
+        Lock.objects.create(name="foo", token="bar")
+
+        with patch.object(
+            DjangoEntryDjangoLockBatchView,
+            "get_locks",
+            staticmethod(lambda keys: DjangoMultiLock(keys, blocking_timeout=0.1)),
+        ):
+            response = client.post(
+                "/entry/django/django/batch/",
+                {"keys": ["foo", "bar"]},
+                content_type="application/json",
+            )
+
+        assert response.status_code == HTTP_408_REQUEST_TIMEOUT
+        assert list(Lock.objects.values_list("name", flat=True)) == ["foo"]
+        view = "DjangoEntryDjangoLockBatchView"
+        assert registry.total("request_timeouts_total", view=view) == 1
+
+    def test_redis_locks_are_released_when_one_is_taken(self, client):
+        held = cache.lock("lock-foo")
+        assert held.acquire(blocking=False)
+
+        with patch("entry.views.cache.lock", partial(cache.lock, blocking_timeout=0.1)):
+            response = client.post(
+                "/entry/redis/redis/batch/",
+                {"keys": ["foo", "bar"]},
+                content_type="application/json",
+            )
+
+        assert response.status_code == HTTP_408_REQUEST_TIMEOUT
+        # bar was locked first and released
+        assert not cache.lock("lock-bar").locked()
+        held.release()
+
+    def test_empty_batch_is_rejected(self, client):
+        response = client.post(
+            "/entry/django/django/batch/",
+            {"keys": []},
+            content_type="application/json",
+        )
+
+        assert response.status_code == HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestReapLocks:
+    def test_reap_locks(self):
+        past = datetime.now() - timedelta(seconds=1)
+        for index in range(5):
+            Lock.objects.create(name=f"expired-{index}", token="a", timeout=1)
+        Lock.objects.filter(name__startswith="expired").update(expires_at=past)
+        Lock.objects.create(name="alive", token="a", timeout=10)
+        Lock.objects.create(name="forever", token="a")
+        LockReader.objects.create(name="expired", token="a", expires_at=past)
+
+        out = StringIO()
+        call_command("reap_locks", batch_size=2, stdout=out)
+
+        assert out.getvalue() == "Deleted 6 expired locks\n"
+        assert not LockReader.objects.exists()
+        assert sorted(Lock.objects.values_list("name", flat=True)) == [
+            "alive",
+            "forever",
+        ]
+
+    def test_reap_is_bounded(self):
+        past = datetime.now() - timedelta(seconds=1)
+        for index in range(3):
+            Lock.objects.create(name=f"expired-{index}", token="a", timeout=1)
+        Lock.objects.update(expires_at=past)
+
+        assert Lock.objects.reap(2) == 2
+        assert Lock.objects.reap(2) == 1
+        assert Lock.objects.reap(2) == 0
+
+
+class TestScriptLock:
+    def test_script_waits_for_redis_lock(self):
+        lock = cache.lock("lock-foo", timeout=10)
+        assert lock.acquire(blocking=False)
+
+        with pytest.raises(LockError):
+            run_unlocked(LOCKED_INCR_SCRIPT, "foo", blocking_timeout=0.2)
+        with pytest.raises(LockError):
+            run_unlocked(LOCKED_GET_SCRIPT, "foo", blocking_timeout=0.2)
+
+        lock.release()
+        assert run_unlocked(LOCKED_INCR_SCRIPT, "foo") == 1
+        assert run_unlocked(LOCKED_GET_SCRIPT, "foo") == 1
+
+    def test_increment_waits_for_readers(self):
+        reader = read_write_lock("lock-foo", timeout=10, shared=True)
+        assert reader.acquire(blocking=False)
+
+        with pytest.raises(LockError):
+            run_unlocked(LOCKED_INCR_SCRIPT, "foo", blocking_timeout=0.2)
+        # readers share the lock with each other
+        assert run_unlocked(LOCKED_GET_SCRIPT, "foo") == 0
+
+        reader.release()
+        assert run_unlocked(LOCKED_INCR_SCRIPT, "foo") == 1
+
+    def test_increment_ignores_expired_readers(self):
+        reader = read_write_lock("lock-foo", timeout=0.1, shared=True)
+        assert reader.acquire(blocking=False)
+        time.sleep(0.15)
+
+        assert run_unlocked(LOCKED_INCR_SCRIPT, "foo", blocking_timeout=0.2) == 1
+
+    def test_script_shares_counter_with_cache(self):
+        cache.incr("foo", ignore_key_check=True)
+
+        assert run_unlocked(LOCKED_INCR_SCRIPT, "foo") == 2
+        assert cache.get("foo") == 2
+
+    def test_script_is_run_with_evalsha(self):
+        run_unlocked(LOCKED_GET_SCRIPT, "foo")
+
+        with patch.object(Redis, "execute_command", autospec=True) as execute:
+            execute.return_value = 0
+            run_unlocked(LOCKED_GET_SCRIPT, "foo")
+
+        assert [c.args[1] for c in execute.call_args_list] == ["EVALSHA"]
+
+
+@pytest.mark.django_db
+class TestInstrumentedLock:
+    def test_acquire_and_release_are_recorded(self):
+        lock = InstrumentedLock(DjangoRedlock("foo", timeout=10), "django")
+        with view_label("FooView"):
+            with lock:
+                assert lock.owned() is True
+
+        labels = {"backend": "django", "view": "FooView"}
+        assert registry.total("lock_acquire_seconds", **labels) == 1
+        assert registry.total("lock_hold_seconds", **labels) == 1
+        assert registry.total("lock_release_seconds", **labels) == 1
+        assert registry.total("lock_retries_total") == 0
+        assert registry.total("lock_timeouts_total") == 0
+
+    def test_retries_and_timeouts_are_counted(self):
+        held = DjangoRedlock("foo", timeout=10)
+        assert held.acquire(blocking=False)
+
+        lock = InstrumentedLock(
+            DjangoRedlock("foo", sleep=0.01, blocking_timeout=0.1), "django"
+        )
+        with pytest.raises(LockError):
+            with lock:
+                pass
+
+        assert registry.total("lock_retries_total", backend="django") > 1
+        assert registry.total("lock_timeouts_total", backend="django") == 1
+        assert registry.total("lock_hold_seconds") == 0
+        held.release()
+
+    def test_attempts_of_wrapped_lock_are_counted(self):
+        held = cache.lock("lock-foo", timeout=10)
+        assert held.acquire(blocking=False)
+
+        redis_lock = read_write_lock("lock-foo", sleep=0.01)
+        lock = InstrumentedLock(TwoTierLock(redis_lock), "redis")
+        assert not lock.acquire(blocking_timeout=0.05)
+
+        assert registry.total("lock_retries_total", backend="redis") > 1
+        assert registry.total("lock_timeouts_total", backend="redis") == 1
+        # the lock is left as it was
+        assert "do_acquire" not in vars(redis_lock)
+        held.release()
+
+    def test_failing_acquire_is_recorded(self):
+        lock = InstrumentedLock(DjangoRedlock("foo"), "django")
+        with patch.object(DjangoRedlock, "do_acquire", side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                lock.acquire()
+
+        assert registry.total("lock_acquire_seconds") == 1
+        assert registry.total("lock_timeouts_total") == 1
+        assert "do_acquire" not in vars(lock.lock)
+
+    def test_lock_shared_between_threads(self):
+        lock = InstrumentedLock(DjangoRedlock("foo", timeout=10, sleep=0.01), "django")
+        acquired = threading.Event()
+
+        def hold():
+            try:
+                with lock:
+                    acquired.set()
+                    time.sleep(0.1)
+            finally:
+                connections.close_all()
+
+        def wait():
+            try:
+                assert acquired.wait(5)
+                with lock:
+                    pass
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(hold), executor.submit(wait)]
+        for future in futures:
+            future.result()
+
+        assert registry.total("lock_acquire_seconds", backend="django") == 2
+        assert registry.total("lock_hold_seconds", backend="django") == 2
+        assert registry.total("lock_retries_total", backend="django") > 1
+        assert registry.total("lock_timeouts_total") == 0
+
+    def test_steals_are_labelled_with_the_backend(self):
+        Lock.objects.create(name="foo", token="bar", timeout=10)
+        Lock.objects.filter(name="foo").update(
+            expires_at=datetime.now() - timedelta(seconds=1)
+        )
+
+        lock = InstrumentedLock(DjangoRedlock("foo", timeout=10), "fast")
+        assert lock.acquire(blocking=False)
+
+        assert registry.total("lock_steals_total", backend="fast") == 1
+        lock.release()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestTwoTierLock:
+    def test_local_locks_are_shared_and_dropped(self):
+        local_lock = get_local_lock("foo")
+        assert get_local_lock("foo") is local_lock
+        assert get_local_lock("bar") is not local_lock
+
+        assert get_local_lock("foo", reentrant=True) is not local_lock
+
+        del local_lock
+        gc.collect()
+        assert ("foo", False) not in _local_locks
+
+    def test_reentrant_lock_can_be_nested(self):
+        outer = TwoTierLock(DjangoRedlock("foo", timeout=10, reentrant=True))
+        inner = TwoTierLock(
+            DjangoRedlock("foo", timeout=10, reentrant=True, blocking_timeout=0.5)
+        )
+        with outer:
+            with inner:
+                assert inner.owned()
+                with outer:
+                    assert outer.owned()
+            assert outer.owned()
+            assert not run_in_thread(
+                lambda: TwoTierLock(DjangoRedlock("foo", reentrant=True)).acquire(
+                    blocking=False
+                )
+            )
+
+        assert not outer.locked()
+        assert not outer.local_lock.lock._is_owned()
+
+    def test_lock(self):
+        lock = TwoTierLock(DjangoRedlock("foo"))
+        with lock:
+            assert Lock.objects.filter(name="foo").exists()
+            assert lock.owned()
+            assert lock.locked()
+            assert lock.local_lock.lock.locked()
+        assert not Lock.objects.filter(name="foo").exists()
+        assert not lock.local_lock.lock.locked()
+
+    def test_waiters_queue_in_process(self):
+        lock = TwoTierLock(DjangoRedlock("foo"))
+        assert lock.acquire(blocking=False)
+
+        other = TwoTierLock(DjangoRedlock("foo"))
+        with patch.object(DjangoRedlock, "do_acquire") as do_acquire:
+            assert not other.acquire(blocking=False)
+            assert not other.acquire(blocking_timeout=0.2)
+        do_acquire.assert_not_called()
+
+        lock.release()
+        assert other.acquire(blocking=False)
+        other.release()
+
+    def test_local_lock_released_when_distributed_lock_fails(self):
+        lock = DjangoRedlock("foo")
+        assert lock.acquire(blocking=False)
+
+        other = TwoTierLock(DjangoRedlock("foo"))
+        assert not other.acquire(blocking_timeout=0.2)
+        assert not other.local_lock.lock.locked()
+        with pytest.raises(LockError):
+            other.release()
+        lock.release()
+
+    def test_one_thread_per_process_polls(self):
+        def increment():
+            with TwoTierLock(DjangoRedlock("foo", timeout=10)):
+                entry, created = Entry.objects.get_or_create(key="foo")
+                entry.value += 1
+                entry.save(update_fields=["value"])
+
+        def target():
+            try:
+                increment()
+            finally:
+                connections.close_all()
+
+        do_acquire = DjangoRedlock.do_acquire
+        with patch.object(
+            DjangoRedlock, "do_acquire", autospec=True, side_effect=do_acquire
+        ) as patched:
+            threads = [threading.Thread(target=target) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert Entry.objects.get(key="foo").value == 10
+        assert patched.call_count == 10
+
+    def test_redis_lock(self):
+        lock = TwoTierLock(cache.lock("lock-foo", timeout=10))
+        assert lock.acquire(blocking=False)
+        assert not TwoTierLock(cache.lock("lock-foo")).acquire(blocking=False)
+        assert lock.extend(10)
+        lock.release()
+        assert not cache.lock("lock-foo").locked()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def redis_servers(tmp_path):
+    """
+    Starts three independent redis servers and yields their processes and urls.
+    """
+    if shutil.which("redis-server") is None:
+        pytest.skip("redis-server is not installed")
+    processes, urls = [], []
+    for index in range(3):
+        port = free_port()
+        command = ["redis-server", "--port", str(port), "--save", ""]
+        command += ["--dir", str(tmp_path)]
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+        urls.append(f"redis://localhost:{port}/0")
+    for url in urls:
+        client = Redis.from_url(url)
+        for attempt in range(50):
+            try:
+                client.ping()
+                break
+            except RedisError:
+                time.sleep(0.1)
+    yield processes, urls
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+class TestRedlock:
+    def test_lock(self):
+        lock = Redlock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+        wait(lock.local.pending)
+
+        token = lock.local.token.encode()
+        assert [node.get("foo") for node in lock.nodes] == [token] * 3
+        assert 0 < lock.local.valid_until - time.monotonic() < 10
+        assert lock.locked()
+        assert lock.owned()
+
+        lock.release()
+        assert [node.get("foo") for node in lock.nodes] == [None] * 3
+        assert not lock.locked()
+        assert not lock.owned()
+
+    def test_competing_locks(self):
+        lock = Redlock("foo", timeout=10)
+        other = Redlock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+        assert not other.acquire(blocking=False)
+        assert not other.acquire(blocking_timeout=0.2)
+        lock.release()
+        assert other.acquire(blocking=False)
+        other.release()
+
+    def test_minority_is_freed(self):
+        lock = Redlock("foo", timeout=10)
+        lock.nodes[0].set("foo", "other")
+        lock.nodes[1].set("foo", "other")
+
+        assert not lock.acquire(blocking=False)
+        assert lock.nodes[0].get("foo") == b"other"
+        assert lock.nodes[2].get("foo") is None
+
+    def test_majority_is_enough(self):
+        lock = Redlock("foo", timeout=10)
+        lock.nodes[0].set("foo", "other")
+
+        assert lock.acquire(blocking=False)
+        assert lock.owned()
+        lock.release()
+        assert lock.nodes[0].get("foo") == b"other"
+
+    def test_not_owned_after_validity(self):
+        lock = Redlock("foo", timeout=0.2)
+        assert lock.acquire(blocking=False)
+        time.sleep(0.2)
+        assert not lock.owned()
+        with pytest.raises(LockNotOwnedError):
+            lock.release()
+
+    def test_no_validity_left(self):
+        lock = Redlock("foo", timeout=0.001)
+        assert not lock.acquire(blocking=False)
+        assert not lock.locked()
+
+    def test_extend(self):
+        lock = Redlock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+        valid_until = lock.local.valid_until
+
+        assert lock.extend(10)
+        assert all(10000 < node.pttl("foo") <= 20000 for node in lock.nodes)
+        assert lock.local.valid_until > valid_until + 9
+
+        assert lock.reacquire()
+        assert all(node.pttl("foo") <= 10000 for node in lock.nodes)
+        lock.release()
+
+    def test_lock_shared_between_threads(self):
+        lock = Redlock("foo", timeout=10)
+
+        def acquire_and_release():
+            assert lock.acquire(blocking=False)
+            assert lock.owned()
+            lock.release()
+            return lock.locked()
+
+        assert run_in_thread(acquire_and_release) is False
+
+    def test_extend_validity_starts_before_the_round_trip(self):
+        lock = Redlock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+        valid_until = lock.local.valid_until
+        on_nodes = lock.on_nodes
+
+        def slowly_on_nodes(function, *args):
+            futures = on_nodes(function, *args)
+            wait(futures)
+            time.sleep(0.2)
+            return futures
+
+        with patch.object(lock, "on_nodes", side_effect=slowly_on_nodes):
+            assert lock.extend(10)
+            assert lock.local.valid_until == valid_until + 10
+
+            started_at = time.monotonic()
+            assert lock.reacquire()
+            assert lock.local.valid_until <= started_at + 10 - 0.1
+        lock.release()
+
+    def test_extend_not_owned(self):
+        lock = Redlock("foo", timeout=10)
+        assert lock.acquire(blocking=False)
+        for node in lock.nodes[:2]:
+            node.set("foo", "other")
+
+        with pytest.raises(LockNotOwnedError):
+            lock.extend(10)
+        with pytest.raises(LockNotOwnedError):
+            lock.release()
+
+    def test_latency_bounded_by_quorum(self):
+        lock = Redlock("foo", timeout=10)
+        slow_node = lock.nodes[2]
+        set_value = Redis.set
+
+        def set_slowly(node, *args, **kwargs):
+            if node is slow_node:
+                time.sleep(0.5)
+            return set_value(node, *args, **kwargs)
+
+        with patch.object(Redis, "set", autospec=True, side_effect=set_slowly):
+            start = time.monotonic()
+            assert lock.acquire(blocking=False)
+            assert time.monotonic() - start < 0.4
+            lock.release()
+        assert slow_node.get("foo") is None
+
+    def test_independent_servers(self, redis_servers):
+        processes, urls = redis_servers
+        lock = Redlock("foo", timeout=10, nodes=urls)
+        assert lock.acquire(blocking=False)
+        lock.release()
+
+        processes[0].kill()
+        processes[0].wait()
+        assert lock.acquire(blocking=False)
+        assert lock.owned()
+        lock.release()
+
+        processes[1].kill()
+        processes[1].wait()
+        assert not lock.acquire(blocking=False)
+        assert not lock.locked()
+
+
+class TestBenchmark:
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        assert percentile(values, 0.5) == 50
+        assert percentile(values, 0.99) == 99
+        assert percentile(values, 1) == 100
+        assert percentile([7], 0.5) == 7
+
+    def test_summarize(self):
+        summary = summarize([0.3, 0.1, 0.2])
+
+        assert summary["rounds"] == 3
+        assert summary["min"] == 0.1
+        assert summary["median"] == 0.2
+        assert summary["max"] == 0.3
+        assert summary["mean"] == pytest.approx(0.2)
+
+    def test_find_regressions(self):
+        baseline = {"median": 0.001, "queries": 2, "redis_commands": 0}
+
+        faster = {"median": 0.0011, "queries": 2, "redis_commands": 0}
+        assert find_regressions(faster, baseline, 0.2) == []
+
+        slower = {"median": 0.0013, "queries": 3, "redis_commands": 0}
+        assert find_regressions(slower, baseline, 0.2) == [
+            "median of 1300.0us is over 1200.0us, 20% more than 1000.0us",
+            "3 queries instead of 2",
+        ]
+
+    def test_redis_commands_of_pipelines_are_captured(self):
+        with capture_redis_commands() as commands:
+            cache.set("foo", 1)
+            pipeline = get_redis_connection("default").pipeline()
+            pipeline.incr("bar")
+            pipeline.get("bar")
+            pipeline.execute()
+
+        assert commands == ["SET", "MULTI", "INCRBY", "GET", "EXEC"]
+
+
+class NoLock:
+    def __init__(self, name, **kwargs):
+        pass
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+
+@pytest.mark.django_db(transaction=True)
+class TestStress:
+    def test_jain_index(self):
+        assert jain_index([5, 5, 5, 5]) == 1
+        assert jain_index([8, 0, 0, 0]) == 0.25
+        assert jain_index([0, 0]) == 1
+
+    @pytest.mark.parametrize("backend", ["django", "django-upsert", "redis"])
+    def test_locks_are_exclusive(self, backend: str):
+        config = StressConfig(backend, contenders=4, names=2, duration=0.3)
+        result = run_stress(config)
+
+        assert result["acquisitions"] > 0
+        assert result["violations"] == 0
+        assert 0.25 <= result["jain_index"] <= 1
+        assert result["wait_p50"] <= result["wait_p99"]
+
+    def test_violations_are_detected(self):
+        config = StressConfig("none", contenders=4, duration=0.3, hold=0.01)
+        with patch.dict(BACKENDS, {"none": NoLock}):
+            result = run_stress(config)
+
+        assert result["violations"] > 0
+
+    def test_processes(self):
+        config = StressConfig("redis", contenders=2, duration=0.3, processes=True)
+        result = run_stress(config)
+
+        assert result["acquisitions"] > 0
+        assert result["violations"] == 0
+
+    def test_command(self, tmp_path):
+        out = StringIO()
+        path = tmp_path / "stress.csv"
+        call_command(
+            "stress_locks",
+            "--backends",
+            "redis",
+            "--contenders",
+            "1",
+            "2",
+            "--duration",
+            "0.2",
+            "--csv",
+            str(path),
+            stdout=out,
+        )
+
+        lines = out.getvalue().splitlines()
+        assert lines[0].split() == [
+            "backend",
+            "contenders",
+            "acq/s",
+            "p50",
+            "ms",
+            "p95",
+            "ms",
+            "p99",
+            "ms",
+            "jain",
+            "timeouts",
+            "violations",
+        ]
+        assert [line.split()[:2] for line in lines[1:]] == [
+            ["redis", "1"],
+            ["redis", "2"],
+        ]
+        rows = path.read_text().splitlines()
+        assert rows[0].startswith("backend,contenders,names,acquisitions")
+        assert len(rows) == 3
+
+
+class TestServe:
+    @pytest.mark.parametrize(
+        "args, expected",
+        [
+            ([], ["smart_lock.wsgi:application"]),
+            (
+                ["--bind", "0.0.0.0:8000", "--workers", "3", "--threads", "8"],
+                [
+                    "--bind",
+                    "0.0.0.0:8000",
+                    "--workers",
+                    "3",
+                    "--threads",
+                    "8",
+                    "smart_lock.wsgi:application",
+                ],
+            ),
+            (
+                ["--asgi"],
+                [
+                    "--worker-class",
+                    "uvicorn.workers.UvicornWorker",
+                    "smart_lock.asgi:application",
+                ],
+            ),
+        ],
+    )
+    def test_command(self, settings, args: list, expected: list):
+        with patch("os.execvp") as execvp:
+            call_command("serve", *args, stdout=StringIO())
+
+        config = str(settings.BASE_DIR / "gunicorn.conf.py")
+        execvp.assert_called_once_with(
+            "gunicorn", ["gunicorn", "--config", config, *expected]
+        )
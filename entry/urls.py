@@ -1,21 +1,57 @@
 from django.urls import path
 
 from entry.views import (
-    DjangoEntryDjangoLockView,
-    DjangoEntryRedisLockView,
-    RedisEntryDjangoLockView,
-    RedisEntryRedisLockView,
+    AsyncDjangoEntryDjangoLockView,
+    AsyncDjangoEntryRedisLockView,
+    AsyncRedisEntryDjangoLockView,
+    AsyncRedisEntryRedisLockView,
+    DjangoEntryAtomicView,
+    DjangoEntryDjangoLockBatchView,
+    DjangoEntryRedisLockBatchView,
+    DjangoEntryShardedView,
+    DjangoEntryWriteBehindView,
+    EntryCacheStatsView,
+    EntryView,
+    RedisEntryDjangoLockBatchView,
+    RedisEntryRedisLockBatchView,
+    RedisEntryScriptLockView,
 )
 
 app_name = "entry"
 
 urlpatterns = [
-    # django model, django redlock
-    path("django/django/lock/<str:key>/", DjangoEntryDjangoLockView.as_view()),
-    # django model, django redlock
-    path("django/redis/lock/<str:key>/", DjangoEntryRedisLockView.as_view()),
-    # redis model, django redlock
-    path("redis/django/lock/<str:key>/", RedisEntryDjangoLockView.as_view()),
-    # redis model, redis redlock
-    path("redis/redis/lock/<str:key>/", RedisEntryRedisLockView.as_view()),
+    # django model, no lock, atomic upsert
+    path("django/atomic/<str:key>/", DjangoEntryAtomicView.as_view()),
+    # django model, hot keys split in shards locked by django redlock
+    path("django/sharded/<str:key>/", DjangoEntryShardedView.as_view()),
+    # django model, increments counted in redis and flushed in batches
+    path("django/write-behind/<str:key>/", DjangoEntryWriteBehindView.as_view()),
+    # redis model, lock checked and counter incremented by one lua script
+    path("redis/script/lock/<str:key>/", RedisEntryScriptLockView.as_view()),
+    # django or redis model, any lock backend of settings.LOCK_BACKENDS
+    path("<str:storage>/<str:lock>/lock/<str:key>/", EntryView.as_view()),
+    # batches of keys, locked in order
+    path("django/django/batch/", DjangoEntryDjangoLockBatchView.as_view()),
+    path("django/redis/batch/", DjangoEntryRedisLockBatchView.as_view()),
+    path("redis/django/batch/", RedisEntryDjangoLockBatchView.as_view()),
+    path("redis/redis/batch/", RedisEntryRedisLockBatchView.as_view()),
+    # hits and misses of the cache of the django entry values
+    path("cache/stats/", EntryCacheStatsView.as_view()),
+    # asyncio views, for ASGI
+    path(
+        "async/django/django/lock/<str:key>/",
+        AsyncDjangoEntryDjangoLockView.as_view(),
+    ),
+    path(
+        "async/django/redis/lock/<str:key>/",
+        AsyncDjangoEntryRedisLockView.as_view(),
+    ),
+    path(
+        "async/redis/django/lock/<str:key>/",
+        AsyncRedisEntryDjangoLockView.as_view(),
+    ),
+    path(
+        "async/redis/redis/lock/<str:key>/",
+        AsyncRedisEntryRedisLockView.as_view(),
+    ),
 ]
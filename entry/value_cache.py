@@ -0,0 +1,210 @@
+import threading
+import time as mod_time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from entry.cache import get_script
+
+
+class LocalCache:
+    """
+    Least recently used values of this process, each kept for ``ttl`` seconds
+    along with the generation it was read at
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self.lock:
+            value, expires_at, generation = self.values.get(key, (None, None, 0))
+            if expires_at is not None and expires_at <= mod_time.monotonic():
+                del self.values[key]
+                value = None
+            if value is None:
+                self.misses += 1
+                return None
+            self.values.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value, generation: int = 0):
+        """
+        Caches ``value`` read at ``generation``, unless a later generation of
+        ``key`` is already cached. A None ``value`` forgets ``key``.
+        """
+        now = mod_time.monotonic()
+        with self.lock:
+            cached = self.values.get(key)
+            if cached is not None and cached[1] > now and cached[2] > generation:
+                return
+            self.values[key] = (value, now + self.ttl, generation)
+            self.values.move_to_end(key)
+            while len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+
+    def delete(self, key: str, generation: int = 0):
+        """
+        Forgets ``key``, values read before ``generation`` are not cached
+        again.
+        """
+        self.set(key, None, generation)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# every key has a generation, bumped by every write, a value read from the
+# table on a miss is only cached if the generation did not move since the miss
+
+# KEYS[1] - value
+# KEYS[2] - generation
+# ARGV[1] - value read
+# ARGV[2] - generation at the miss, empty when there was none
+# ARGV[3] - milliseconds the value is kept
+STORE_SCRIPT = """
+if (redis.call('get', KEYS[2]) or '') ~= ARGV[2] then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[3])
+return 1
+"""
+
+# KEYS - pairs of a value and its generation
+# ARGV[1] - milliseconds the generations are kept
+INVALIDATE_SCRIPT = """
+local generations = {}
+for i = 1, #KEYS, 2 do
+    generations[#generations + 1] = redis.call('incr', KEYS[i + 1])
+    redis.call('pexpire', KEYS[i + 1], ARGV[1])
+    redis.call('del', KEYS[i])
+end
+return generations
+"""
+
+
+class EntryValueCache:
+    """
+    Read-through cache of ``Entry.value``, in this process first and then in
+    redis
+    """
+
+    def __init__(self):
+        self.local = LocalCache(settings.ENTRY_CACHE_SIZE, settings.ENTRY_CACHE_TTL)
+        self.lock = threading.Lock()
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    @staticmethod
+    def redis_key(key: str) -> str:
+        return f"value-{key}"
+
+    @staticmethod
+    def generation_key(key: str) -> str:
+        return f"generation-{key}"
+
+    @staticmethod
+    def redis_ttl() -> int:
+        return int(settings.ENTRY_CACHE_REDIS_TTL * 1000)
+
+    def lookup(self, key: str) -> Tuple[Optional[int], int]:
+        """
+        Returns the cached value of ``key``, None on a miss of both tiers, and
+        the generation of ``key`` when it was read from redis or missed.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            return value, 0
+        value, generation = get_redis_connection("default").mget(
+            cache.make_key(self.redis_key(key)),
+            cache.make_key(self.generation_key(key)),
+        )
+        generation = int(generation or 0)
+        with self.lock:
+            if value is None:
+                self.redis_misses += 1
+                return None, generation
+            self.redis_hits += 1
+        value = int(value)
+        self.local.set(key, value, generation)
+        return value, generation
+
+    def get(self, key: str) -> Optional[int]:
+        """
+        Returns the cached value of ``key``, None on a miss of both tiers.
+        """
+        value, generation = self.lookup(key)
+        return value
+
+    def get_or_load(self, key: str, load: Callable[[], int]) -> int:
+        """
+        Returns the cached value of ``key``, on a miss of both tiers the value
+        returned by ``load`` is cached, unless ``key`` was written since the
+        miss.
+        """
+        value, generation = self.lookup(key)
+        if value is not None:
+            return value
+        value = load()
+        stored = get_script(STORE_SCRIPT)(
+            keys=[
+                cache.make_key(self.redis_key(key)),
+                cache.make_key(self.generation_key(key)),
+            ],
+            args=[value, generation or "", self.redis_ttl()],
+        )
+        if stored:
+            self.local.set(key, value, generation)
+        return value
+
+    def delete_many(self, keys):
+        """
+        Forgets ``keys`` after they were written, whichever lock the writer
+        held. The local tiers of other processes keep them for
+        ``ENTRY_CACHE_TTL`` at most.
+        """
+        if not keys:
+            return
+        redis_keys = []
+        for key in keys:
+            redis_keys += [
+                cache.make_key(self.redis_key(key)),
+                cache.make_key(self.generation_key(key)),
+            ]
+        generations = get_script(INVALIDATE_SCRIPT)(
+            keys=redis_keys, args=[self.redis_ttl()]
+        )
+        for key, generation in zip(keys, generations):
+            self.local.delete(key, generation)
+
+    def stats(self) -> dict:
+        return {
+            "local_hits": self.local.hits,
+            "local_misses": self.local.misses,
+            "redis_hits": self.redis_hits,
+            "redis_misses": self.redis_misses,
+        }
+
+    def clear(self):
+        """
+        Empties the local tier and resets the counters, redis is left as is.
+        """
+        self.local.clear()
+        with self.lock:
+            self.redis_hits = 0
+            self.redis_misses = 0
+
+
+entry_values = EntryValueCache()
@@ -1,13 +1,36 @@
+from collections import Counter
+from contextlib import ExitStack, contextmanager
 from typing import Protocol
 
 from django.core.cache import cache
+from django.db.transaction import atomic
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
 from redis.exceptions import LockError
 from rest_framework.response import Response
-from rest_framework.status import HTTP_200_OK, HTTP_408_REQUEST_TIMEOUT
+from rest_framework.status import (
+    HTTP_200_OK,
+    HTTP_400_BAD_REQUEST,
+    HTTP_408_REQUEST_TIMEOUT,
+)
 from rest_framework.views import APIView
 
-from entry.django_redlock import DjangoRedlock
+from entry import sharded_counter, write_behind
+from entry.backends import LockBackend, get_lock_backend
+from entry.cache import (
+    LOCKED_GET_SCRIPT,
+    LOCKED_INCR_SCRIPT,
+    async_get,
+    async_incr,
+    async_lock,
+    increment_entries,
+    run_unlocked,
+)
+from entry.django_redlock import AsyncDjangoRedlock, DjangoMultiLock, run_in_executor
+from entry.instrumented_lock import InstrumentedLock
 from entry.models import Entry
+from entry.serializers import BatchIncrementSerializer
+from entry.value_cache import entry_values
+from smart_lock.metrics import registry, view_label
 
 
 class BaseViewProtocol(Protocol):
@@ -21,6 +44,16 @@ class BaseViewProtocol(Protocol):
 
 
 class BaseView(APIView, BaseViewProtocol):
+    def dispatch(self, request, *args, **kwargs):
+        with view_label(self.get_view_label()):
+            return super().dispatch(request, *args, **kwargs)
+
+    def get_view_label(self) -> str:
+        """
+        Returns the ``view`` label of the metrics recorded by the requests.
+        """
+        return type(self).__name__
+
     def get(self, request, *args, **kwargs):
         key = kwargs["key"]
 
@@ -30,6 +63,7 @@ class BaseView(APIView, BaseViewProtocol):
             status = HTTP_200_OK
             data = {"key": key, "value": value}
         except LockError:
+            registry.inc("request_timeouts_total", view=self.get_view_label())
             status = HTTP_408_REQUEST_TIMEOUT
             data = {"detail": "request timeout"}
 
@@ -44,75 +78,323 @@ class BaseView(APIView, BaseViewProtocol):
             status = HTTP_200_OK
             data = {"key": key, "value": value}
         except LockError:
+            registry.inc("request_timeouts_total", view=self.get_view_label())
             status = HTTP_408_REQUEST_TIMEOUT
             data = {"detail": "request timeout"}
 
         return Response(data, status=status)
 
 
-class DjangoEntryDjangoLockView(BaseView):
+class DjangoEntryAtomicView(BaseView):
     @staticmethod
     def get_entry_value(key: str) -> int:
-        with DjangoRedlock(key, timeout=1):
-            entry, created = Entry.objects.get_or_create(key=key)
-
-        return entry.value
+        return Entry.objects.get_value(key)
 
     @staticmethod
     def increment_entry(key: str) -> int:
-        with DjangoRedlock(key, timeout=1):
-            entry, created = Entry.objects.get_or_create(key=key)
-            entry.value += 1
-            entry.save(update_fields=["value"])
-
-        return entry.value
+        value = Entry.objects.increment(key)
+        entry_values.delete_many([key])
+        return value
 
 
-class DjangoEntryRedisLockView(BaseView):
+class DjangoEntryShardedView(BaseView):
     @staticmethod
     def get_entry_value(key: str) -> int:
-        with cache.lock(f"lock-{key}", timeout=1):
-            entry, created = Entry.objects.get_or_create(key=key)
+        return sharded_counter.get_value(key)
+
+    @staticmethod
+    def increment_entry(key: str) -> int:
+        return sharded_counter.increment(key)
 
-        return entry.value
+
+class DjangoEntryWriteBehindView(BaseView):
+    @staticmethod
+    def get_entry_value(key: str) -> int:
+        return write_behind.get_value(key)
 
     @staticmethod
     def increment_entry(key: str) -> int:
-        with cache.lock(f"lock-{key}", timeout=1):
+        return write_behind.increment(key)
+
+
+class DjangoEntryStorage:
+    """
+    Entries in the Entry table, their values are cached by ``entry_values``
+    """
+
+    @staticmethod
+    def get_entry_value(key: str, backend: LockBackend) -> int:
+        def load() -> int:
+            with backend.lock(key, shared=True):
+                entry, created = Entry.objects.get_or_create(key=key)
+            return entry.value
+
+        return entry_values.get_or_load(key, load)
+
+    @staticmethod
+    def increment_entry(key: str, backend: LockBackend) -> int:
+        with backend.lock(key):
             entry, created = Entry.objects.get_or_create(key=key)
             entry.value += 1
             entry.save(update_fields=["value"])
+            entry_values.delete_many([key])
 
         return entry.value
 
 
-class RedisEntryDjangoLockView(BaseView):
+class RedisEntryStorage:
+    """
+    Entries in the default cache
+    """
+
     @staticmethod
-    def get_entry_value(key: str) -> int:
-        with DjangoRedlock(key, timeout=1):
-            value = cache.get(key, default=0)
+    def get_entry_value(key: str, backend: LockBackend) -> int:
+        with backend.lock(key, shared=True):
+            return cache.get(key, default=0)
 
-        return value
+    @staticmethod
+    def increment_entry(key: str, backend: LockBackend) -> int:
+        with backend.lock(key):
+            return cache.incr(key, ignore_key_check=True)
+
+
+ENTRY_STORAGES = {"django": DjangoEntryStorage, "redis": RedisEntryStorage}
+
+
+class EntryView(BaseView):
+    """
+    Reads and increments the entries of a storage of ``ENTRY_STORAGES`` under
+    the locks of a backend of ``settings.LOCK_BACKENDS``, both named by the URL
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        try:
+            self.storage = ENTRY_STORAGES[kwargs["storage"]]
+            self.backend = get_lock_backend(kwargs["lock"])
+        except KeyError:
+            raise Http404
+
+    def get_view_label(self) -> str:
+        return f"{type(self).__name__}:{self.kwargs['storage']}/{self.kwargs['lock']}"
+
+    def get_entry_value(self, key: str) -> int:
+        return self.storage.get_entry_value(key, self.backend)
+
+    def increment_entry(self, key: str) -> int:
+        return self.storage.increment_entry(key, self.backend)
+
+
+class RedisEntryScriptLockView(BaseView):
+    @staticmethod
+    def get_entry_value(key: str) -> int:
+        return run_unlocked(LOCKED_GET_SCRIPT, key)
 
     @staticmethod
     def increment_entry(key: str) -> int:
-        with DjangoRedlock(key, timeout=1):
-            value = cache.incr(key, ignore_key_check=True)
+        return run_unlocked(LOCKED_INCR_SCRIPT, key)
 
-        return value
 
+class BaseBatchViewProtocol(Protocol):
+    @staticmethod
+    def get_locks(keys: list):
+        ...
 
-class RedisEntryRedisLockView(BaseView):
     @staticmethod
-    def get_entry_value(key: str) -> int:
-        with cache.lock(f"lock-{key}", timeout=1):
-            value = cache.get(key, default=0)
+    def increment_entries(counts: dict) -> dict:
+        ...
+
+
+class BaseBatchView(APIView, BaseBatchViewProtocol):
+    def dispatch(self, request, *args, **kwargs):
+        with view_label(type(self).__name__):
+            return super().dispatch(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs) -> Response:
+        serializer = BatchIncrementSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=HTTP_400_BAD_REQUEST)
+
+        counts = Counter(serializer.validated_data["keys"])
+
+        try:
+            # always lock in the same order, so batches can not deadlock
+            with self.get_locks(sorted(counts)):
+                values = self.increment_entries(counts)
+
+            status = HTTP_200_OK
+            data = [{"key": key, "value": values[key]} for key in sorted(values)]
+        except LockError:
+            registry.inc("request_timeouts_total", view=type(self).__name__)
+            status = HTTP_408_REQUEST_TIMEOUT
+            data = {"detail": "request timeout"}
+
+        return Response(data, status=status)
 
-        return value
 
+@contextmanager
+def redis_locks(keys: list):
+    """
+    Takes a redis lock on every key, one after the other.
+    """
+    with ExitStack() as stack:
+        for key in keys:
+            stack.enter_context(cache.lock(f"lock-{key}", timeout=1))
+        yield
+
+
+class DjangoEntryDjangoLockBatchView(BaseBatchView):
     @staticmethod
-    def increment_entry(key: str) -> int:
-        with cache.lock(f"lock-{key}", timeout=1):
-            value = cache.incr(key, ignore_key_check=True)
+    def get_locks(keys: list):
+        return InstrumentedLock(DjangoMultiLock(keys, timeout=1), "django")
 
-        return value
+    @staticmethod
+    def increment_entries(counts: dict) -> dict:
+        with atomic():
+            values = Entry.objects.increment_many(counts)
+        entry_values.delete_many(list(values))
+        return values
+
+
+class DjangoEntryRedisLockBatchView(BaseBatchView):
+    @staticmethod
+    def get_locks(keys: list):
+        return redis_locks(keys)
+
+    @staticmethod
+    def increment_entries(counts: dict) -> dict:
+        with atomic():
+            values = Entry.objects.increment_many(counts)
+        entry_values.delete_many(list(values))
+        return values
+
+
+class RedisEntryDjangoLockBatchView(BaseBatchView):
+    @staticmethod
+    def get_locks(keys: list):
+        return InstrumentedLock(DjangoMultiLock(keys, timeout=1), "django")
+
+    @staticmethod
+    def increment_entries(counts: dict) -> dict:
+        return increment_entries(counts)
+
+
+class RedisEntryRedisLockBatchView(BaseBatchView):
+    @staticmethod
+    def get_locks(keys: list):
+        return redis_locks(keys)
+
+    @staticmethod
+    def increment_entries(counts: dict) -> dict:
+        return increment_entries(counts)
+
+
+class AsyncBaseViewProtocol(Protocol):
+    @staticmethod
+    async def get_entry_value(key: str) -> int:
+        ...
+
+    @staticmethod
+    async def increment_entry(key: str) -> int:
+        ...
+
+
+class AsyncBaseView(AsyncBaseViewProtocol):
+    """
+    Waits for locks in the event loop, so a waiting request holds no thread
+    """
+
+    @classmethod
+    def as_view(cls):
+        # class based views can not be asynchronous before Django 4.1
+        async def view(request, *args, **kwargs):
+            handlers = {"GET": cls.get_entry_value, "POST": cls.increment_entry}
+            if request.method not in handlers:
+                return HttpResponseNotAllowed(list(handlers))
+
+            key = kwargs["key"]
+
+            try:
+                with view_label(cls.__name__):
+                    value = await handlers[request.method](key)
+
+                status = HTTP_200_OK
+                data = {"key": key, "value": value}
+            except LockError:
+                registry.inc("request_timeouts_total", view=cls.__name__)
+                status = HTTP_408_REQUEST_TIMEOUT
+                data = {"detail": "request timeout"}
+
+            return JsonResponse(data, status=status)
+
+        return view
+
+
+@run_in_executor
+def get_django_entry_value(key: str) -> int:
+    entry, created = Entry.objects.get_or_create(key=key)
+
+    return entry.value
+
+
+@run_in_executor
+def increment_django_entry(key: str) -> int:
+    entry, created = Entry.objects.get_or_create(key=key)
+    entry.value += 1
+    entry.save(update_fields=["value"])
+    entry_values.delete_many([key])
+
+    return entry.value
+
+
+class AsyncDjangoEntryDjangoLockView(AsyncBaseView):
+    @staticmethod
+    async def get_entry_value(key: str) -> int:
+        async with AsyncDjangoRedlock(key, timeout=1):
+            return await get_django_entry_value(key)
+
+    @staticmethod
+    async def increment_entry(key: str) -> int:
+        async with AsyncDjangoRedlock(key, timeout=1):
+            return await increment_django_entry(key)
+
+
+class AsyncDjangoEntryRedisLockView(AsyncBaseView):
+    @staticmethod
+    async def get_entry_value(key: str) -> int:
+        async with async_lock(f"lock-{key}", timeout=1):
+            return await get_django_entry_value(key)
+
+    @staticmethod
+    async def increment_entry(key: str) -> int:
+        async with async_lock(f"lock-{key}", timeout=1):
+            return await increment_django_entry(key)
+
+
+class AsyncRedisEntryDjangoLockView(AsyncBaseView):
+    @staticmethod
+    async def get_entry_value(key: str) -> int:
+        async with AsyncDjangoRedlock(key, timeout=1):
+            return await async_get(key)
+
+    @staticmethod
+    async def increment_entry(key: str) -> int:
+        async with AsyncDjangoRedlock(key, timeout=1):
+            return await async_incr(key)
+
+
+class AsyncRedisEntryRedisLockView(AsyncBaseView):
+    @staticmethod
+    async def get_entry_value(key: str) -> int:
+        async with async_lock(f"lock-{key}", timeout=1):
+            return await async_get(key)
+
+    @staticmethod
+    async def increment_entry(key: str) -> int:
+        async with async_lock(f"lock-{key}", timeout=1):
+            return await async_incr(key)
+
+
+class EntryCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs) -> Response:
+        return Response(entry_values.stats())
@@ -0,0 +1,329 @@
+import logging
+import math
+import threading
+import time as mod_time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.transaction import atomic
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from entry.cache import get_script
+from entry.models import Entry, WriteBehindFlush
+from entry.value_cache import entry_values
+
+logger = logging.getLogger(__name__)
+
+# increments are counted in ``pending-{key}`` and the key is added to the
+# dirty set. A flush claims the pending deltas into the hash of its id and
+# into ``claimed-{key}`` under its id, adds the id to the unfinished flushes,
+# applies its hash to the Entry table in the transaction recording the id,
+# then stores the new values in ``flushed-{key}`` and forgets its claims. The
+# value of a key is always its flushed value, plus its pending delta, plus its
+# claimed deltas, every step of a flush keeps that sum, and a flush
+# interrupted anywhere is finished by the next one without applying anything
+# twice
+DIRTY_KEYS = "dirty-entries"
+FLUSH_LOCK = "lock-flush-entries"
+FLUSH_EPOCH = "flush-epoch"
+UNFINISHED_FLUSHES = "unfinished-flushes"
+
+# KEYS[1] - flushed value
+# KEYS[2] - pending delta
+# KEYS[3] - dirty set
+# KEYS[4] - claimed deltas
+# ARGV[1] - entry key
+# ARGV[2] - delta to add, 0 to only read
+# returns the value of the key, false when its flushed value is not loaded
+VALUE_SCRIPT = """
+local flushed = redis.call('get', KEYS[1])
+if not flushed then
+    return false
+end
+local pending
+if ARGV[2] == '0' then
+    pending = tonumber(redis.call('get', KEYS[2]) or 0)
+else
+    pending = redis.call('incrby', KEYS[2], ARGV[2])
+    redis.call('sadd', KEYS[3], ARGV[1])
+end
+local value = tonumber(flushed) + pending
+for _, delta in ipairs(redis.call('hvals', KEYS[4])) do
+    value = value + tonumber(delta)
+end
+return value
+"""
+
+# KEYS[1] - flushed value
+# KEYS[2] - flush epoch
+# KEYS[3] - unfinished flushes
+# ARGV[1] - value read from the Entry table
+# ARGV[2] - flush epoch before it was read
+# ARGV[3] - milliseconds the flushed value is kept
+# stores the value read unless a flush ran or is running since it was read
+LOAD_SCRIPT = """
+if (redis.call('get', KEYS[2]) or '') ~= ARGV[2] then
+    return 0
+end
+if redis.call('scard', KEYS[3]) > 0 then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[3])
+return 1
+"""
+
+# KEYS[1] - dirty set
+# KEYS[2] - unfinished flushes
+# KEYS[3] - flush hash
+# KEYS[4..] - pairs of a pending delta and the claimed deltas of its key
+# ARGV[1] - flush id
+# ARGV[2..] - entry keys, in the same order as their pairs
+# moves the pending deltas into the flush hash and the claimed deltas, and
+# forgets the dirty keys
+CLAIM_SCRIPT = """
+for i = 4, #KEYS, 2 do
+    local key = ARGV[(i - 4) / 2 + 2]
+    local delta = redis.call('get', KEYS[i])
+    redis.call('del', KEYS[i])
+    redis.call('srem', KEYS[1], key)
+    if delta and delta ~= '0' then
+        redis.call('hset', KEYS[3], key, delta)
+        redis.call('hset', KEYS[i + 1], ARGV[1], delta)
+    end
+end
+if redis.call('exists', KEYS[3]) == 1 then
+    redis.call('sadd', KEYS[2], ARGV[1])
+end
+"""
+
+# KEYS[1] - unfinished flushes
+# KEYS[2] - flush hash
+# KEYS[3] - flush epoch
+# KEYS[4..] - pairs of a flushed value and the claimed deltas of its key
+# ARGV[1] - flush id
+# ARGV[2] - milliseconds the flushed values are kept
+# ARGV[3..] - values of the entries once flushed, in the same order
+FINISH_SCRIPT = """
+for i = 4, #KEYS, 2 do
+    redis.call('set', KEYS[i], ARGV[(i - 4) / 2 + 3], 'px', ARGV[2])
+    redis.call('hdel', KEYS[i + 1], ARGV[1])
+end
+redis.call('del', KEYS[2])
+redis.call('srem', KEYS[1], ARGV[1])
+return redis.call('incr', KEYS[3])
+"""
+
+_flusher_lock = threading.Lock()
+_flusher = None
+
+
+def pending_key(key: str) -> str:
+    return cache.make_key(f"pending-{key}")
+
+
+def flushed_key(key: str) -> str:
+    return cache.make_key(f"flushed-{key}")
+
+
+def claimed_key(key: str) -> str:
+    return cache.make_key(f"claimed-{key}")
+
+
+def flush_key(flush_id: str) -> str:
+    return cache.make_key(f"flush-{flush_id}")
+
+
+def base_ttl() -> int:
+    return int(settings.WRITE_BEHIND_BASE_TTL * 1000)
+
+
+def get_value(key: str) -> int:
+    """
+    Returns the flushed value of ``key`` plus its pending delta.
+    """
+    return run_value_script(key, 0)
+
+
+def increment(key: str) -> int:
+    """
+    Increments ``key`` in redis only, marks it dirty and returns its value.
+    """
+    if settings.WRITE_BEHIND_FLUSH_THREAD:
+        start_flusher()
+    return run_value_script(key, 1)
+
+
+def run_value_script(key: str, delta: int) -> int:
+    """
+    Adds ``delta`` to ``key`` and returns its value in one round trip, its
+    row is only read when its flushed value is not in redis.
+    """
+    script = get_script(VALUE_SCRIPT)
+    keys = [
+        flushed_key(key),
+        pending_key(key),
+        cache.make_key(DIRTY_KEYS),
+        claimed_key(key),
+    ]
+    while True:
+        value = script(keys=keys, args=[key, delta])
+        if value is not None:
+            return int(value)
+        load_flushed_value(key)
+
+
+def load_flushed_value(key: str):
+    """
+    Reads the row of ``key`` into its flushed value in redis, the read is
+    retried when a flush overlaps with it. Raises ``LockError`` when no read
+    succeeded within ``WRITE_BEHIND_LOAD_TIMEOUT`` seconds, an interrupted
+    flush is only finished by the next one.
+    """
+    client = get_redis_connection("default")
+    script = get_script(LOAD_SCRIPT)
+    epoch_key = cache.make_key(FLUSH_EPOCH)
+    unfinished_key = cache.make_key(UNFINISHED_FLUSHES)
+    stop_trying_at = mod_time.monotonic() + settings.WRITE_BEHIND_LOAD_TIMEOUT
+    while True:
+        pipeline = client.pipeline()
+        pipeline.get(epoch_key)
+        pipeline.scard(unfinished_key)
+        epoch, unfinished = pipeline.execute()
+        if not unfinished:
+            value = Entry.objects.get_value(key)
+            loaded = script(
+                keys=[flushed_key(key), epoch_key, unfinished_key],
+                args=[value, epoch or b"", base_ttl()],
+            )
+            if loaded:
+                return
+        next_try_at = mod_time.monotonic() + settings.WRITE_BEHIND_RETRY_SLEEP
+        if next_try_at > stop_trying_at:
+            raise LockError(f"Unable to load the flushed value of {key!r} in time")
+        mod_time.sleep(settings.WRITE_BEHIND_RETRY_SLEEP)
+
+
+def apply_flush(client, flush_id: str) -> int:
+    """
+    Applies the deltas claimed by ``flush_id`` to their rows unless it was
+    already, then finishes it in redis, and returns how many keys it had.
+    """
+    deltas = {
+        key.decode(): int(delta)
+        for key, delta in client.hgetall(flush_key(flush_id)).items()
+    }
+    values = {}
+    if deltas:
+        with atomic():
+            if WriteBehindFlush.objects.record(flush_id):
+                values = Entry.objects.increment_many(deltas)
+            else:
+                values = dict(
+                    Entry.objects.filter(key__in=deltas).values_list("key", "value")
+                )
+        entry_values.delete_many(list(values))
+
+    keys = sorted(values)
+    get_script(FINISH_SCRIPT)(
+        keys=[
+            cache.make_key(UNFINISHED_FLUSHES),
+            flush_key(flush_id),
+            cache.make_key(FLUSH_EPOCH),
+            *[name for key in keys for name in (flushed_key(key), claimed_key(key))],
+        ],
+        args=[flush_id, base_ttl(), *[values[key] for key in keys]],
+    )
+    if deltas:
+        WriteBehindFlush.objects.filter(id=flush_id).delete()
+    return len(deltas)
+
+
+def finish_flushes(client) -> int:
+    """
+    Finishes the flushes that were interrupted, and returns how many keys
+    they had.
+    """
+    unfinished = client.smembers(cache.make_key(UNFINISHED_FLUSHES))
+    return sum(apply_flush(client, flush_id.decode()) for flush_id in unfinished)
+
+
+def flush_batch(client, batch_size: int) -> int:
+    """
+    Moves the pending deltas of up to ``batch_size`` dirty keys into their
+    rows with one upsert and returns how many keys were flushed.
+    """
+    keys = sorted(
+        key.decode()
+        for key in client.srandmember(cache.make_key(DIRTY_KEYS), batch_size)
+    )
+    if not keys:
+        return 0
+
+    flush_id = uuid.uuid4().hex
+    get_script(CLAIM_SCRIPT)(
+        keys=[
+            cache.make_key(DIRTY_KEYS),
+            cache.make_key(UNFINISHED_FLUSHES),
+            flush_key(flush_id),
+            *[name for key in keys for name in (pending_key(key), claimed_key(key))],
+        ],
+        args=[flush_id, *keys],
+    )
+    apply_flush(client, flush_id)
+    return len(keys)
+
+
+def flush(batch_size: int = None) -> int:
+    """
+    Flushes every key that is dirty when it starts, in batches of
+    ``batch_size``, and returns how many keys were flushed. Flushes are
+    serialized by a redis lock, 0 is returned while another one runs.
+    """
+    if batch_size is None:
+        batch_size = settings.WRITE_BEHIND_BATCH_SIZE
+    client = get_redis_connection("default")
+    lock = cache.lock(FLUSH_LOCK, timeout=settings.WRITE_BEHIND_FLUSH_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        # keys keep getting dirty, only as many batches as there are keys now
+        finished = finish_flushes(client)
+        batches = math.ceil(client.scard(cache.make_key(DIRTY_KEYS)) / batch_size)
+        return finished + sum(flush_batch(client, batch_size) for _ in range(batches))
+    finally:
+        lock.release()
+
+
+def run_flusher(interval: float, batch_size: int = None):
+    """
+    Flushes every ``interval`` seconds, forever.
+    """
+    while True:
+        try:
+            flush(batch_size)
+        except Exception:
+            logger.exception("Flush of the pending increments failed")
+        finally:
+            close_old_connections()
+        mod_time.sleep(interval)
+
+
+def start_flusher() -> threading.Thread:
+    """
+    Starts the thread flushing every ``WRITE_BEHIND_INTERVAL`` seconds, once
+    per process.
+    """
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=run_flusher,
+                args=(settings.WRITE_BEHIND_INTERVAL,),
+                name="write-behind-flusher",
+                daemon=True,
+            )
+            _flusher.start()
+        return _flusher
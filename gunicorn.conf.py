@@ -0,0 +1,22 @@
+"""
+gunicorn configuration used by ``manage.py serve``
+"""
+import multiprocessing
+from os import environ
+
+bind = environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# every thread keeps its own database connection for CONN_MAX_AGE seconds, so
+# a server holds at most workers * threads connections to postgres, plus the
+# ones of the background threads
+workers = int(environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(environ.get("GUNICORN_THREADS", 4))
+worker_class = environ.get("GUNICORN_WORKER_CLASS", "gthread")
+
+timeout = 30
+graceful_timeout = 10
+keepalive = 5
+
+# workers are replaced every now and then, so that leaks can not pile up
+max_requests = 10000
+max_requests_jitter = 1000
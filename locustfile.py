@@ -1,7 +1,9 @@
-from random import choice
+from functools import lru_cache
+from itertools import accumulate
+from random import choice, choices
 
 from django.utils.lorem_ipsum import COMMON_WORDS
-from locust import HttpUser, between, task
+from locust import HttpUser, between, events, task
 
 COUNTRIES = [
     "Albania",
@@ -43,15 +45,54 @@ COUNTRIES = [
 
 TIMEOUT = 2
 
+KEY_DISTRIBUTIONS = ("uniform", "zipf", "hot")
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    parser.add_argument(
+        "--key-distribution",
+        choices=KEY_DISTRIBUTIONS,
+        default="uniform",
+        help="How users pick their key: uniformly, following Zipf's law or "
+        "all the same one",
+    )
+    parser.add_argument(
+        "--zipf-skew",
+        type=float,
+        default=1.1,
+        help="Exponent of the Zipf distribution, the higher the more skewed",
+    )
+
+
+@lru_cache
+def zipf_cum_weights(count: int, skew: float) -> list:
+    return list(accumulate(1 / rank**skew for rank in range(1, count + 1)))
+
+
+def choose_key(options) -> str:
+    """
+    Picks a key among ``COMMON_WORDS`` following the distribution of the
+    command line ``options``.
+    """
+    distribution = getattr(options, "key_distribution", "uniform")
+    if distribution == "hot":
+        return COMMON_WORDS[0]
+    if distribution == "zipf":
+        cum_weights = zipf_cum_weights(len(COMMON_WORDS), options.zipf_skew)
+        return choices(COMMON_WORDS, cum_weights=cum_weights)[0]
+    return choice(COMMON_WORDS)
+
 
 class BaseUser(HttpUser):
     wait_time = between(1, 2)
     url = ""
+    abstract = True
 
     def __init__(self, *args, **kwargs):
         super(BaseUser, self).__init__(*args, **kwargs)
 
-        self.key = choice(COMMON_WORDS)
+        self.key = choose_key(self.environment.parsed_options)
 
     @task
     def increment_entry(self):
@@ -78,9 +119,49 @@ class DjangoEntryRedisLockUser(BaseUser):
     url = "/entry/django/redis/lock/{key}/"
 
 
+class DjangoEntryAdvisoryLockUser(BaseUser):
+    url = "/entry/django/advisory/lock/{key}/"
+
+
+class DjangoEntryAtomicUser(BaseUser):
+    url = "/entry/django/atomic/{key}/"
+
+
+class DjangoEntryShardedUser(BaseUser):
+    url = "/entry/django/sharded/{key}/"
+
+
+class DjangoEntryWriteBehindUser(BaseUser):
+    url = "/entry/django/write-behind/{key}/"
+
+
 class RedisEntryDjangoLockUser(BaseUser):
     url = "/entry/redis/django/lock/{key}/"
 
 
+class RedisEntryAdvisoryLockUser(BaseUser):
+    url = "/entry/redis/advisory/lock/{key}/"
+
+
 class RedisEntryRedisLockUser(BaseUser):
     url = "/entry/redis/redis/lock/{key}/"
+
+
+class RedisEntryScriptLockUser(BaseUser):
+    url = "/entry/redis/script/lock/{key}/"
+
+
+class AsyncDjangoEntryDjangoLockUser(BaseUser):
+    url = "/entry/async/django/django/lock/{key}/"
+
+
+class AsyncDjangoEntryRedisLockUser(BaseUser):
+    url = "/entry/async/django/redis/lock/{key}/"
+
+
+class AsyncRedisEntryDjangoLockUser(BaseUser):
+    url = "/entry/async/redis/django/lock/{key}/"
+
+
+class AsyncRedisEntryRedisLockUser(BaseUser):
+    url = "/entry/async/redis/redis/lock/{key}/"
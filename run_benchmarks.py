@@ -0,0 +1,183 @@
+"""
+Runs the users of ``locustfile.py`` headless against a running server, for
+every number of users and key distribution, and writes a table comparing
+their throughput, latency and 408 rates.
+
+    python run_benchmarks.py --users 50 200 400 --distributions uniform hot
+"""
+import argparse
+import ast
+import csv
+import subprocess
+import sys
+from pathlib import Path
+
+LOCUSTFILE = Path(__file__).resolve().parent / "locustfile.py"
+
+COLUMNS = (
+    ("user", "User"),
+    ("distribution", "Keys"),
+    ("users", "Users"),
+    ("requests", "Requests"),
+    ("rps", "Req/s"),
+    ("p50", "p50 ms"),
+    ("p95", "p95 ms"),
+    ("p99", "p99 ms"),
+    ("timeout_rate", "408 %"),
+    ("failure_rate", "Failed %"),
+)
+
+
+def user_classes() -> list:
+    """
+    Returns the names of the users of the locustfile, read without importing
+    it so that locust is only needed by its processes.
+    """
+    tree = ast.parse(LOCUSTFILE.read_text())
+    return [
+        node.name
+        for node in tree.body
+        if isinstance(node, ast.ClassDef)
+        and any(getattr(base, "id", None) == "BaseUser" for base in node.bases)
+    ]
+
+
+def run_locust(options, user: str, users: int, distribution: str) -> Path:
+    """
+    Runs ``user`` once and returns the prefix of its CSV results.
+    """
+    prefix = options.results_dir / f"{user}-{distribution}-{users}"
+    command = [
+        "locust",
+        "--locustfile",
+        str(LOCUSTFILE),
+        "--headless",
+        "--only-summary",
+        "--host",
+        options.host,
+        "--users",
+        str(users),
+        "--spawn-rate",
+        str(options.spawn_rate),
+        "--run-time",
+        options.run_time,
+        "--reset-stats",
+        "--csv",
+        str(prefix),
+        "--key-distribution",
+        distribution,
+        "--zipf-skew",
+        str(options.zipf_skew),
+        user,
+    ]
+    # locust exits with 1 when any request failed, 408s included
+    subprocess.run(command, check=False)
+    return prefix
+
+
+def read_results(prefix: Path) -> dict:
+    """
+    Returns the throughput, latency percentiles and failure rates of a run
+    from its CSV results.
+    """
+    with open(f"{prefix}_stats.csv", newline="") as file:
+        total = next(row for row in csv.DictReader(file) if row["Name"] == "Aggregated")
+    with open(f"{prefix}_failures.csv", newline="") as file:
+        timeouts = sum(
+            int(row["Occurrences"])
+            for row in csv.DictReader(file)
+            if "408" in row["Error"]
+        )
+
+    requests = int(total["Request Count"])
+    failures = int(total["Failure Count"])
+    return {
+        "requests": requests,
+        "rps": float(total["Requests/s"]),
+        "p50": float(total["50%"]),
+        "p95": float(total["95%"]),
+        "p99": float(total["99%"]),
+        "timeout_rate": 100 * timeouts / requests if requests else 0.0,
+        "failure_rate": 100 * failures / requests if requests else 0.0,
+    }
+
+
+def format_table(rows: list) -> str:
+    """
+    Returns ``rows`` as a markdown table, sorted so that the users can be
+    compared for the same load.
+    """
+    rows = sorted(
+        rows, key=lambda row: (row["distribution"], row["users"], row["user"])
+    )
+    lines = [
+        "| " + " | ".join(title for _, title in COLUMNS) + " |",
+        "|" + "|".join("---" for _ in COLUMNS) + "|",
+    ]
+    for row in rows:
+        cells = []
+        for name, _ in COLUMNS:
+            value = row[name]
+            cells.append(f"{value:.1f}" if isinstance(value, float) else str(value))
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="http://localhost:8000")
+    parser.add_argument(
+        "--user-classes",
+        nargs="+",
+        metavar="USER",
+        help="users of the locustfile to run, all of them by default",
+    )
+    parser.add_argument("--users", nargs="+", type=int, default=[50, 200, 400])
+    parser.add_argument("--spawn-rate", type=float, default=50)
+    parser.add_argument("--run-time", default="60s")
+    parser.add_argument(
+        "--distributions",
+        nargs="+",
+        choices=("uniform", "zipf", "hot"),
+        default=["uniform", "zipf", "hot"],
+    )
+    parser.add_argument("--zipf-skew", type=float, default=1.1)
+    parser.add_argument("--results-dir", type=Path, default=Path("results"))
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    options.results_dir.mkdir(parents=True, exist_ok=True)
+
+    rows = []
+    for user in options.user_classes or user_classes():
+        for distribution in options.distributions:
+            for users in options.users:
+                print(f"Running {user} with {users} users, {distribution} keys")
+                prefix = run_locust(options, user, users, distribution)
+                try:
+                    results = read_results(prefix)
+                except (OSError, StopIteration):
+                    print(f"No results for {user}", file=sys.stderr)
+                    continue
+                rows.append(
+                    {
+                        "user": user,
+                        "distribution": distribution,
+                        "users": users,
+                        **results,
+                    }
+                )
+
+    table = format_table(rows)
+    (options.results_dir / "summary.md").write_text(table)
+    with open(options.results_dir / "summary.csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=[name for name, _ in COLUMNS])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import threading
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    "lock_acquire_seconds": ("histogram", "Time spent acquiring a lock"),
+    "lock_hold_seconds": ("histogram", "Time a lock was held"),
+    "lock_release_seconds": ("histogram", "Time spent releasing a lock"),
+    "lock_retries_total": ("counter", "Acquire attempts after the first one"),
+    "lock_timeouts_total": ("counter", "Locks that could not be acquired in time"),
+    "lock_steals_total": ("counter", "Expired locks taken over from their holder"),
+    "request_timeouts_total": ("counter", "Requests answered with a 408"),
+}
+
+# name of the view handling the current request, a label of every lock metric
+current_view = ContextVar("current_view", default="")
+
+# backend of the lock being acquired and the attempts it took so far, set by
+# InstrumentedLock around the acquire
+current_backend = ContextVar("current_backend", default="")
+current_attempts = ContextVar("current_attempts", default=None)
+
+
+@contextmanager
+def view_label(view: str):
+    """
+    Labels the metrics recorded inside the block with ``view``.
+    """
+    reset_token = current_view.set(view)
+    try:
+        yield
+    finally:
+        current_view.reset(reset_token)
+
+
+def count_attempt():
+    """
+    Counts an attempt of the lock being acquired, locks call it before every
+    attempt.
+    """
+    attempts = current_attempts.get()
+    if attempts is not None:
+        attempts[0] += 1
+
+
+class ThreadMetrics:
+    """
+    Counters and histograms recorded by one thread, only that thread writes
+    them
+    """
+
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}
+        # per label set, the count of every bucket, of +Inf and the sum
+        self.histograms = {}
+
+    def merge(self, other: "ThreadMetrics"):
+        """
+        Adds the counters and the histograms of ``other`` to these.
+        """
+        # copying a dict or a list holds the GIL, they can not change while
+        # they are copied
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, histogram in list(other.histograms.items()):
+            merged = self.histograms.setdefault(key, [0] * len(histogram))
+            for i, value in enumerate(list(histogram)):
+                merged[i] += value
+
+
+class ThreadExit:
+    """
+    Stored in the thread-local storage of a thread, it is freed with it when
+    the thread exits
+    """
+
+    __slots__ = ("__weakref__",)
+
+
+class Registry:
+    """
+    Metrics aggregated per thread, recording takes no lock and the threads
+    are only merged when the metrics are collected. The metrics of a thread
+    are folded into ``retired`` when it exits.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        # finalizers may run in a thread that holds it
+        self.lock = threading.RLock()
+        # bumped by reset, threads then record into new metrics
+        self.generation = 0
+        self.threads = set()
+        self.retired = ThreadMetrics()
+
+    def thread_metrics(self) -> ThreadMetrics:
+        local = self.local
+        if getattr(local, "generation", None) == self.generation:
+            return local.metrics
+        metrics = ThreadMetrics()
+        with self.lock:
+            self.threads.add(metrics)
+            local.generation = self.generation
+        local.metrics = metrics
+        local.exit = ThreadExit()
+        finalizer = weakref.finalize(local.exit, self.retire, metrics)
+        finalizer.atexit = False
+        return metrics
+
+    def retire(self, metrics: ThreadMetrics):
+        """
+        Folds the metrics of a thread that exited into ``retired``, unless
+        they were reset since.
+        """
+        with self.lock:
+            if metrics in self.threads:
+                self.threads.remove(metrics)
+                self.retired.merge(metrics)
+
+    def inc(self, name: str, value=1, **labels):
+        counters = self.thread_metrics().counters
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        histograms = self.thread_metrics().histograms
+        key = (name, tuple(sorted(labels.items())))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[bisect_left(BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def collect(self):
+        """
+        Returns the counters and the histograms of every thread merged.
+        """
+        merged = ThreadMetrics()
+        with self.lock:
+            merged.merge(self.retired)
+            threads = list(self.threads)
+        for metrics in threads:
+            merged.merge(metrics)
+        return merged.counters, merged.histograms
+
+    def total(self, name: str, **labels):
+        """
+        Returns the sum of the counter ``name``, or how many values the
+        histogram ``name`` observed, over the label sets including ``labels``.
+        """
+        counters, histograms = self.collect()
+        total = 0
+        for (metric, metric_labels), value in counters.items():
+            if metric == name and labels.items() <= dict(metric_labels).items():
+                total += value
+        for (metric, metric_labels), histogram in histograms.items():
+            if metric == name and labels.items() <= dict(metric_labels).items():
+                total += sum(histogram[:-1])
+        return total
+
+    def reset(self):
+        """
+        Forgets every metric, the threads record into new metrics instead of
+        having theirs cleared while they write them.
+        """
+        with self.lock:
+            self.generation += 1
+            self.threads = set()
+            self.retired = ThreadMetrics()
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text format.
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), histogram):
+                    cumulative += count
+                    bucket_labels = format_labels((*labels, ("le", str(bound))))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+registry = Registry()
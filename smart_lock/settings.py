@@ -82,10 +82,93 @@ CACHES = {
         "LOCATION": f"redis://{REDIS_HOST}:6379/1",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # threads wait for a free connection instead of failing once
+            # REDIS_MAX_CONNECTIONS of them are in use by this process
+            "CONNECTION_POOL_CLASS": "redis.BlockingConnectionPool",
+            "CONNECTION_POOL_KWARGS": {
+                "max_connections": int(environ.get("REDIS_MAX_CONNECTIONS", 50)),
+                "timeout": float(environ.get("REDIS_POOL_TIMEOUT", 5)),
+            },
+            "SOCKET_CONNECT_TIMEOUT": 5,
+            "SOCKET_TIMEOUT": 5,
         },
     }
 }
 
+# Independent redis servers used by entry.redlock.Redlock, comma separated,
+# the databases of the default server only stand in for them in development
+REDLOCK_NODES = environ.get(
+    "REDLOCK_NODES",
+    ",".join(f"redis://{REDIS_HOST}:6379/{db}" for db in range(2, 5)),
+).split(",")
+REDLOCK_SOCKET_TIMEOUT = float(environ.get("REDLOCK_SOCKET_TIMEOUT", 0.05))
+REDLOCK_MAX_WORKERS = int(environ.get("REDLOCK_MAX_WORKERS", 32))
+
+# Write-behind counters, pending increments are flushed to the Entry table
+# every WRITE_BEHIND_INTERVAL seconds by the flush_entries command, or by a
+# thread of every process using them when WRITE_BEHIND_FLUSH_THREAD is set.
+# The flushed values are kept in redis for WRITE_BEHIND_BASE_TTL seconds, so
+# writes to the table by anything else show after that long at most. A value
+# missing from redis waits up to WRITE_BEHIND_LOAD_TIMEOUT seconds for an
+# interrupted flush to be finished before the request fails
+WRITE_BEHIND_INTERVAL = float(environ.get("WRITE_BEHIND_INTERVAL", 1))
+WRITE_BEHIND_BATCH_SIZE = int(environ.get("WRITE_BEHIND_BATCH_SIZE", 1000))
+WRITE_BEHIND_BASE_TTL = float(environ.get("WRITE_BEHIND_BASE_TTL", 300))
+WRITE_BEHIND_FLUSH_TIMEOUT = 10
+WRITE_BEHIND_RETRY_SLEEP = 0.01
+WRITE_BEHIND_LOAD_TIMEOUT = 1
+WRITE_BEHIND_FLUSH_THREAD = bool(environ.get("WRITE_BEHIND_FLUSH_THREAD"))
+
+# Cache of the django entry values, the local tier of every process keeps up
+# to ENTRY_CACHE_SIZE values for ENTRY_CACHE_TTL seconds, the redis tier keeps
+# them for ENTRY_CACHE_REDIS_TTL seconds. Writes invalidate the redis tier
+# and the local tier of their process, the local tiers of other processes may
+# serve the previous value for ENTRY_CACHE_TTL seconds
+ENTRY_CACHE_SIZE = int(environ.get("ENTRY_CACHE_SIZE", 10000))
+ENTRY_CACHE_TTL = float(environ.get("ENTRY_CACHE_TTL", 1))
+ENTRY_CACHE_REDIS_TTL = float(environ.get("ENTRY_CACHE_REDIS_TTL", 300))
+
+# Sharded counters, a key is split in SHARDED_COUNTER_SHARDS shards for
+# SHARDED_COUNTER_TTL seconds once SHARDED_COUNTER_THRESHOLD increments found
+# its lock taken within SHARDED_COUNTER_WINDOW seconds
+SHARDED_COUNTER_SHARDS = int(environ.get("SHARDED_COUNTER_SHARDS", 8))
+SHARDED_COUNTER_THRESHOLD = int(environ.get("SHARDED_COUNTER_THRESHOLD", 10))
+SHARDED_COUNTER_WINDOW = 1
+SHARDED_COUNTER_TTL = 60
+
+# Locks acquired with auto_renew are renewed every LOCK_RENEW_INTERVAL
+# seconds, the views of the django locks opt in with LOCK_AUTO_RENEW
+LOCK_RENEW_INTERVAL = float(environ.get("LOCK_RENEW_INTERVAL", 0.25))
+LOCK_AUTO_RENEW = bool(environ.get("LOCK_AUTO_RENEW"))
+
+# Locks of the entry views, served under /entry/<storage>/<name>/lock/ for
+# every name. BACKEND is a registered backend of entry.backends or the dotted
+# path of a class, TIMEOUT is how long a lock lives, BLOCKING_TIMEOUT how long
+# a request waits for it before a 408, forever when empty, and SLEEP how long
+# it waits between two attempts. LOCK_<NAME>_<SETTING> overrides them.
+LOCK_BACKENDS = {
+    name: {
+        "BACKEND": name,
+        "TIMEOUT": float(environ.get(f"LOCK_{name.upper()}_TIMEOUT", 1)),
+        "BLOCKING_TIMEOUT": (
+            float(environ[f"LOCK_{name.upper()}_BLOCKING_TIMEOUT"])
+            if environ.get(f"LOCK_{name.upper()}_BLOCKING_TIMEOUT")
+            else None
+        ),
+        "SLEEP": float(environ.get(f"LOCK_{name.upper()}_SLEEP", 0.1)),
+        "OPTIONS": options,
+    }
+    for name, options in (
+        ("django", {"notify": True}),
+        ("redis", {}),
+        ("advisory", {}),
+    )
+}
+
+# Threads running the queries of the asynchronous views in each process, each
+# of them keeps its own database connection
+ASYNC_DB_THREADS = int(environ.get("ASYNC_DB_THREADS", 8))
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
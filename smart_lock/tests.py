@@ -1,7 +1,169 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from django.core.signals import request_started
+from django.db import connection, connections
 from rest_framework.status import HTTP_200_OK
 
+from smart_lock.metrics import Registry, current_view, registry, view_label
+from smart_lock.utils import close_broken_connections
+
 
 def test_health_check(client):
     response = client.get("/health-check/")
 
     assert response.status_code == HTTP_200_OK
+
+
+def test_metrics(client):
+    registry.inc("request_timeouts_total", view="FooView")
+    registry.observe("lock_acquire_seconds", 0.003, backend="django", view="FooView")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == HTTP_200_OK
+    assert response["Content-Type"].startswith("text/plain")
+    lines = response.content.decode().splitlines()
+    assert "# TYPE lock_acquire_seconds histogram" in lines
+    assert 'request_timeouts_total{view="FooView"} 1' in lines
+    labels = 'backend="django",view="FooView"'
+    assert f'lock_acquire_seconds_bucket{{{labels},le="0.0025"}} 0' in lines
+    assert f'lock_acquire_seconds_bucket{{{labels},le="0.005"}} 1' in lines
+    assert f'lock_acquire_seconds_bucket{{{labels},le="+Inf"}} 1' in lines
+    assert f"lock_acquire_seconds_sum{{{labels}}} 0.003" in lines
+    assert f"lock_acquire_seconds_count{{{labels}}} 1" in lines
+
+
+def test_registry_merges_threads():
+    registry = Registry()
+
+    def record():
+        for _ in range(100):
+            registry.inc("lock_retries_total", backend="redis")
+            registry.observe("lock_hold_seconds", 0.02, backend="redis")
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # the metrics of the threads that exited are folded together
+    assert not registry.threads
+    assert registry.total("lock_retries_total") == 400
+    assert registry.total("lock_retries_total", backend="django") == 0
+    assert registry.total("lock_hold_seconds", backend="redis") == 400
+
+
+def test_registry_merges_live_threads():
+    registry = Registry()
+    recorded = threading.Event()
+    done = threading.Event()
+
+    def record():
+        registry.inc("lock_retries_total", backend="redis")
+        recorded.set()
+        done.wait(5)
+
+    thread = threading.Thread(target=record)
+    thread.start()
+    assert recorded.wait(5)
+    registry.inc("lock_retries_total", backend="redis")
+
+    assert len(registry.threads) == 2
+    assert registry.total("lock_retries_total") == 2
+    done.set()
+    thread.join()
+    assert len(registry.threads) == 1
+    assert registry.total("lock_retries_total") == 2
+
+
+def test_registry_reset():
+    registry = Registry()
+    registry.inc("lock_retries_total")
+    thread = threading.Thread(target=registry.inc, args=("lock_retries_total",))
+    thread.start()
+    thread.join()
+
+    registry.reset()
+
+    assert registry.total("lock_retries_total") == 0
+    registry.inc("lock_retries_total")
+    assert registry.total("lock_retries_total") == 1
+    assert len(registry.threads) == 1
+
+
+def test_view_label():
+    assert current_view.get() == ""
+
+    with view_label("FooView"):
+        assert current_view.get() == "FooView"
+
+    assert current_view.get() == ""
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.inc("request_timeouts_total", view='say "hi"\\')
+
+    assert 'request_timeouts_total{view="say \\"hi\\"\\\\"} 1' in registry.render()
+
+
+def terminate(connection):
+    """
+    Makes the server close ``connection``.
+    """
+    connection.ensure_connection()
+    other = connections.create_connection("default")
+    with other.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_terminate_backend(%s)", [connection.connection.info.backend_pid]
+        )
+    other.close()
+    time.sleep(0.1)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestCloseBrokenConnections:
+    def test_healthy_connection_is_kept(self):
+        connection.ensure_connection()
+        pg_connection = connection.connection
+
+        with patch.dict(connection.settings_dict, {"CONN_HEALTH_CHECKS": True}):
+            close_broken_connections()
+
+        assert connection.connection is pg_connection
+
+    def test_terminated_connection_is_closed(self):
+        terminate(connection)
+
+        with patch.dict(connection.settings_dict, {"CONN_HEALTH_CHECKS": True}):
+            close_broken_connections()
+
+        assert connection.connection is None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    def test_connections_are_only_checked_when_enabled(self):
+        terminate(connection)
+        pg_connection = connection.connection
+
+        with patch.dict(connection.settings_dict, {"CONN_HEALTH_CHECKS": False}):
+            close_broken_connections()
+
+        assert connection.connection is pg_connection
+        connection.close()
+
+    def test_connections_are_checked_when_requests_start(self):
+        terminate(connection)
+        # persistent, django would close it anyway otherwise
+        connection.close_at = None
+
+        with patch.dict(
+            connection.settings_dict, {"CONN_HEALTH_CHECKS": True, "CONN_MAX_AGE": None}
+        ):
+            request_started.send(sender=None)
+
+        assert connection.connection is None
@@ -15,9 +15,10 @@ Including another URLconf
 """
 from django.urls import include, path
 
-from smart_lock.views import HealthCheckView
+from smart_lock.views import HealthCheckView, MetricsView
 
 urlpatterns = [
     path("entry/", include("entry.urls")),
     path("health-check/", HealthCheckView.as_view()),
+    path("metrics", MetricsView.as_view()),
 ]
@@ -1,6 +1,9 @@
 import logging
+import select
 from os import environ
 
+from django.db import connections
+
 logger = logging.getLogger(__name__)
 
 
@@ -12,7 +15,40 @@ def get_postgres_host_configuration_dict():
         "PASSWORD": environ.get("POSTGRES_PASSWORD", "smart_lock"),
         "HOST": environ.get("POSTGRES_HOST", "localhost"),
         "PORT": environ.get("POSTGRES_PORT", "5432"),
+        # every thread keeps its connection for CONN_MAX_AGE seconds, so a
+        # worker holds at most as many connections as it has threads
+        "CONN_MAX_AGE": int(environ.get("POSTGRES_CONN_MAX_AGE", 60)),
+        # persistent connections closed by the server are replaced before
+        # each request, see close_broken_connections
+        "CONN_HEALTH_CHECKS": environ.get("POSTGRES_CONN_HEALTH_CHECKS", "1") == "1",
+        "OPTIONS": {"connect_timeout": int(environ.get("POSTGRES_CONNECT_TIMEOUT", 5))},
     }
 
     logger.info(f"Postgres configuration is {configuration}")
     return configuration
+
+
+def close_broken_connections(**kwargs):
+    """
+    Closes the persistent connections that the server closed, so that the
+    request opens new ones instead of failing on its first query. The server
+    sends nothing to an idle connection unless it is closing it, so only the
+    connections with something to read are checked with a query.
+
+    Django 4.1 checks connections with ``CONN_HEALTH_CHECKS`` itself, at the
+    cost of a query per request.
+    """
+    for alias in connections:
+        connection = connections[alias]
+        if (
+            connection.connection is None
+            or connection.in_atomic_block
+            or not connection.settings_dict.get("CONN_HEALTH_CHECKS")
+        ):
+            continue
+        if not connection.connection.closed:
+            readable, _, _ = select.select([connection.connection], [], [], 0)
+            if not readable or connection.is_usable():
+                continue
+        logger.warning("Closing broken connection to %s", alias)
+        connection.close()
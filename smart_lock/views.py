@@ -1,11 +1,23 @@
+from django.http import HttpResponse
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK
 from rest_framework.views import APIView
 
+from smart_lock.metrics import registry
+
 
 class HealthCheckView(APIView):
     permission_classes = (AllowAny,)
 
     def get(self, request, **kwargs):
         return Response(status=HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    permission_classes = (AllowAny,)
+
+    def get(self, request, **kwargs):
+        return HttpResponse(
+            registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )